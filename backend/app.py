@@ -1,52 +1,71 @@
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, Response, g, request, jsonify, send_file, session, stream_with_context
 from flask_cors import CORS
+import concurrent.futures
+import contextlib
 import os
-import json
 from datetime import datetime
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from werkzeug.datastructures import FileStorage
 import uuid
-from PIL import Image, ImageOps, ImageFile
-import io
+import tempfile
 import logging
 from functools import wraps
 import hashlib
-import mimetypes
-from werkzeug.exceptions import RequestEntityTooLarge
+import random
+import time
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+from storage import WorksStore, file_lock, spool_upload
+from contacts_log import JsonlContactsStore
+from mailer import MailQueue
+from images import candidate_names, content_base, decode_memory, process_image_file, remove_image_files
+from image_jobs import ImageJobQueue
+from sqlite_storage import SqliteDatabase, SqliteWorksStore, SqliteContactsStore
+from payload_cache import KeyedPayloadCache, PayloadCache
+from works_query import (QUERY_PARAMS, IndexCache, QueryError, grid_index, parse_fields, parse_limit,
+                         parse_query, project, run_query)
+from search import SearchIndex
+from resumable import ResumableUploads, UploadOffsetError
+from uploads_gc import UploadsIndex, collect_orphans, scan_uploads
+from static_files import is_content_addressed, resolve_upload, upload_etag, upload_max_age, upload_mimetype
+from logging_setup import ACCESS_LOGGER, configure_logging, log_access
+from metrics import (registry as metrics_registry, http_requests, http_request_seconds,
+                     upload_bytes, upload_results, image_processing_seconds)
+from profiling import PROFILE_MODES, ProfileBuffer, RequestProfile, stage
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'postpress-secret-key-2025')
 CORS(app, supports_credentials=True)
 
-# Настройка логирования с безопасным обращением к файлам
-handlers = [logging.StreamHandler()]
-
-# Пытаемся добавить файловое логирование, но не падаем если не получается
-try:
-    file_handler = logging.FileHandler('app.log', encoding='utf-8')
-    handlers.append(file_handler)
-    print("Логирование в файл app.log включено")
-except (PermissionError, OSError) as e:
-    print(f"Предупреждение: Не удалось создать файл логов: {e}")
-    print("Логирование будет только в консоль")
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=handlers
-)
+# Настройка логирования: verbose — подробный текстовый лог, structured — строка JSON на запрос
+STRUCTURED_LOGGING = os.getenv('LOG_FORMAT', 'verbose').lower() == 'structured'
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))  # доля успешных запросов в access-логе
+# В структурированном режиме пошаговые сообщения обработчиков по умолчанию отключены — о запросе
+# говорит строка access-лога; LOG_LEVEL=info вернет их
+LOG_LEVEL = os.getenv('LOG_LEVEL') or ('warning' if STRUCTURED_LOGGING else 'info')
+configure_logging(structured=STRUCTURED_LOGGING, level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
-try:
-    Image.MAX_IMAGE_PIXELS = None
-    ImageFile.LOAD_TRUNCATED_IMAGES = True  # Позволяет открывать частично поврежденные JPEG
-    logger.info("[IMAGES] MAX_IMAGE_PIXELS отключен (разрешены большие изображения)")
-except Exception as e:
-    logger.warning(f"[IMAGES] Не удалось отключить MAX_IMAGE_PIXELS: {e}")
-
-# Middleware для логирования всех запросов
+access_log = logging.getLogger(ACCESS_LOGGER)
+
 @app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def log_access_line(response):
+    """Структурированный режим: одна строка на запрос; ошибки пишутся всегда"""
+    if STRUCTURED_LOGGING and (response.status_code >= 400 or random.random() < LOG_SAMPLE_RATE):
+        log_access(access_log, request.method, request.path, response.status_code,
+                   (time.perf_counter() - g.request_started) * 1000,
+                   response.calculate_content_length(), request.remote_addr)
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_requests.inc(method=request.method, route=route, status=response.status_code)
+    http_request_seconds.observe(time.perf_counter() - g.request_started, method=request.method, route=route)
+    return response
+
+# Middleware для логирования всех запросов (подробный режим)
 def log_request_info():
     logger.info(f"[REQUEST] ===== НОВЫЙ ЗАПРОС =====")
     logger.info(f"[REQUEST] Метод: {request.method}")
@@ -61,18 +80,24 @@ def log_request_info():
         logger.info(f"[REQUEST] Form данные: {dict(request.form)}")
     logger.info(f"[REQUEST] ========================")
 
-@app.after_request
 def log_response_info(response):
     logger.info(f"[RESPONSE] ===== ОТВЕТ =====")
     logger.info(f"[RESPONSE] Status Code: {response.status_code}")
     logger.info(f"[RESPONSE] Headers: {dict(response.headers)}")
-    if response.is_json:
+    if response.is_json and not response.content_encoding:
         logger.info(f"[RESPONSE] JSON ответ: {response.get_json()}")
     logger.info(f"[RESPONSE] =================")
     return response
 
+if not STRUCTURED_LOGGING:
+    app.before_request(log_request_info)
+    app.after_request(log_response_info)
+
 def log_function_call(func):
-    """Декоратор для логирования вызовов функций"""
+    """Декоратор для логирования вызовов функций (в структурированном режиме ничего не добавляет)"""
+    if STRUCTURED_LOGGING:
+        return func
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         logger.info(f"[FUNC] Вызов функции: {func.__name__}")
@@ -92,9 +117,33 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 DATA_FOLDER = os.path.join(BASE_DIR, 'data')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp', 'tiff', 'tif', 'heic', 'heif', 'avif', 'jfif'}
 MAX_CONTENT_LENGTH = 64 * 1024 * 1024  # 64MB
-THUMBNAIL_SIZE = (800, 600)  # Фиксированный размер для всех изображений
-JPEG_QUALITY = 85  # Оптимальное качество для веба
 MIN_IMAGE_SIZE = (400, 300)  # Минимальный размер изображения
+# Фоновая обработка изображений: 0 процессов — обрабатывать прямо в запросе
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', str(100_000_000)))  # бюджет на одно изображение
+IMAGE_WORKER_MEMORY_MB = int(os.getenv('IMAGE_WORKER_MEMORY_MB', '2048'))  # лимит памяти процесса пула
+IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', '6000'))  # длинная сторона мастер-файла; 0 — без уменьшения
+# Память на одновременное декодирование в процессе: сверх нее загрузки ждут, а не влезающие одни — отклоняются
+IMAGE_DECODE_MEMORY_MB = int(os.getenv('IMAGE_DECODE_MEMORY_MB', '1024'))
+# JPEG не больше этих пределов сохраняются мастером без перекодирования; 0 — перекодировать все
+JPEG_PASSTHROUGH_MAX_BYTES = int(os.getenv('JPEG_PASSTHROUGH_MAX_BYTES', str(12 * 1024 * 1024)))
+JPEG_PASSTHROUGH_MAX_EDGE = int(os.getenv('JPEG_PASSTHROUGH_MAX_EDGE', '4096'))
+JPEG_PASSTHROUGH = ((JPEG_PASSTHROUGH_MAX_BYTES, JPEG_PASSTHROUGH_MAX_EDGE)
+                    if JPEG_PASSTHROUGH_MAX_BYTES > 0 and JPEG_PASSTHROUGH_MAX_EDGE > 0 else None)
+# Пакетная загрузка: файлов в одном запросе и потоков обработки без пула процессов
+IMAGE_BATCH_MAX_FILES = int(os.getenv('IMAGE_BATCH_MAX_FILES', '50'))
+IMAGE_BATCH_THREADS = int(os.getenv('IMAGE_BATCH_THREADS', str(min(4, os.cpu_count() or 1))))
+# Возобновляемая загрузка кусками: предел размера одного исходника
+RESUMABLE_MAX_SIZE = int(os.getenv('RESUMABLE_MAX_SIZE', str(2 * 1024 * 1024 * 1024)))
+# Сборка мусора в uploads/: сколько файлов удалять за один запрос к API
+UPLOADS_GC_LIMIT = int(os.getenv('UPLOADS_GC_LIMIT', '5000'))
+IMAGE_REFS_LOCK = os.path.join(DATA_FOLDER, 'uploads.lock')  # привязка и удаление файлов загрузок
+WORK_NOT_FOUND_ERROR = 'Работа не найдена'
+IMAGE_GONE_ERROR = 'Файл изображения был удален во время загрузки, повторите попытку'
+# Профилирование: заголовок X-Profile от админа или доля случайных запросов
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'stages')  # режим для выборки: stages, cprofile, pyinstrument
+PROFILE_BUFFER_SIZE = int(os.getenv('PROFILE_BUFFER_SIZE', '50'))
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
@@ -103,6 +152,41 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(DATA_FOLDER, exist_ok=True)
 
+# Хранилище работ и заявок: JSON-файлы (по умолчанию) или SQLite
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+WORKS_FILE = os.path.join(DATA_FOLDER, 'works.json')
+
+if STORAGE_BACKEND == 'sqlite':
+    database = SqliteDatabase(os.getenv('SQLITE_PATH', os.path.join(DATA_FOLDER, 'postpress.db')))
+    works_store = SqliteWorksStore(database)
+    contacts_store = SqliteContactsStore(database)
+else:
+    # Работы держим в памяти процесса и перечитываем works.json только при его изменении
+    works_store = WorksStore(
+        WORKS_FILE,
+        wal=os.getenv('WORKS_WAL', 'false').lower() in ('1', 'true', 'yes'),
+        compact_every=int(os.getenv('WORKS_WAL_COMPACT_EVERY', '200')),
+    )
+    # Заявки дописываются в журнал JSON Lines, старый contacts.json переносится командой
+    # `python contacts_log.py import`
+    contacts_store = JsonlContactsStore(
+        DATA_FOLDER,
+        max_bytes=int(os.getenv('CONTACTS_LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+    )
+logger.info(f"[STORAGE] Хранилище данных: {STORAGE_BACKEND}")
+# Письма о заявках отправляются фоновым потоком из очереди на диске
+mail_queue = MailQueue(os.path.join(DATA_FOLDER, 'mail_spool'))
+mail_queue.start()
+
+# Сериализованный (и сжатый) ответ GET /api/works пересобирается только при изменении данных
+works_payload = PayloadCache(app.json.dumps)
+# Страницы выборки /api/works?limit=... и отдельные работы — по ключу запроса для той же версии
+works_query_payloads = KeyedPayloadCache(app.json.dumps)
+works_index = IndexCache()
+# Полнотекстовый индекс; add/update/delete обновляют его на месте
+search_index = SearchIndex()
+SEARCH_DEFAULT_LIMIT = 20
+
 # Дружелюбная ошибка при превышении лимита загрузки
 @app.errorhandler(413)
 def handle_large_file(error):
@@ -111,133 +195,315 @@ def handle_large_file(error):
         'code': 413
     }), 413
 
-# Регистрируем поддержку HEIC/HEIF/AVIF в Pillow, если доступно
-try:
-    import pillow_heif  # type: ignore
-    pillow_heif.register_heif_opener()
-    logger.info("[IMAGES] pillow-heif зарегистрирован (HEIC/HEIF/AVIF поддерживаются)")
-except Exception as e:
-    logger.warning(f"[IMAGES] Не удалось зарегистрировать pillow-heif: {e}")
+def spool_request_file(file: FileStorage) -> tuple[str, int, str]:
+    """Записывает файл из запроса во временный файл в папке данных.
+
+    Returns:
+        tuple[str, int, str]: Путь к временному файлу, размер и SHA-256.
+
+    Raises:
+        ValueError: Если файл больше MAX_CONTENT_LENGTH.
+    """
+    logger.info("[UPLOAD] Начало загрузки файла: %s", getattr(file, 'filename', 'unknown'))
+    fd, raw_path = tempfile.mkstemp(dir=DATA_FOLDER, prefix='.upload-')
+    os.close(fd)
+    file.stream.seek(0)
+    data_size, sha256 = spool_upload(file.stream, raw_path, MAX_CONTENT_LENGTH)
+    logger.info("[UPLOAD] Загрузка записана на диск: %s байт, sha256 %s", data_size, sha256)
+    return raw_path, data_size, sha256
+
+def save_uploaded_image(raw_path: str, sha256: str, original_name: str, mimetype: str) -> tuple[str, tuple[int, int], list[dict], dict]:
+    """Обрабатывает записанную на диск загрузку прямо в запросе (без фоновой очереди).
+
+    Подходящие JPEG (JPEG_PASSTHROUGH) сохраняются мастером как есть, без
+    перекодирования; остальное декодируется и кодируется заново.
+
+    Returns:
+        tuple[str, tuple[int, int], list[dict], dict]: Имя сохраненного файла,
+        размер (ширина, высота), список производных версий (пустой, если их нет)
+        и дополнительные метаданные (заглушка placeholder).
+
+    Raises:
+        ValueError: Если файл пуст или не может быть сохранен.
+    """
+    return process_image_file(raw_path, content_base(sha256), original_name, mimetype,
+                              UPLOAD_FOLDER, IMAGE_MAX_PIXELS, JPEG_PASSTHROUGH, IMAGE_MAX_EDGE or None)
+
+def find_known_image(sha256, original_name, mimetype):
+    """Ищет уже сохраненную загрузку с тем же содержимым. Возвращает (имя, метаданные) или None."""
+    for filename in candidate_names(sha256, original_name, mimetype):
+        info = works_store.find_image(filename)
+        if info is not None and os.path.exists(os.path.join(UPLOAD_FOLDER, filename)):
+            return filename, info
+    return None
 
-def save_uploaded_image(file: FileStorage) -> tuple[str, tuple[int, int]]:
-    """Сохраняет загруженное изображение с детальным логированием ошибок.
+def image_info(image_size, variants, meta=None):
+    """Метаданные изображения для work['image_info'] или None, если сохранять нечего.
+
+    Размеры (0, 0) означают, что файл не удалось декодировать, — тогда их нет в записи.
+    """
+    if not variants and not meta:
+        return None
+    info = {'width': image_size[0], 'height': image_size[1]} if all(image_size) else {}
+    return dict(info, variants=variants, **(meta or {}))
+
+def attach_images(work_id, images):
+    """Добавляет обработанные изображения к работе одной записью в хранилище.
 
     Args:
-        file: Объект файла из `request.files`.
+        work_id: Работа.
+        images: [(имя файла, метаданные image_info или None), ...].
 
     Returns:
-        tuple[str, tuple[int, int]]: Имя сохраненного файла и размер (ширина, высота).
+        tuple[str | None, list[str]]: Текст ошибки (работа удалена) или None и
+        имена файлов, которые успели удалить параллельно с загрузкой.
+    """
+    # Проверка файлов и новые ссылки — под той же блокировкой, что и удаление последней ссылки
+    with file_lock(IMAGE_REFS_LOCK):
+        present, missing = [], []
+        for filename, info in images:
+            if os.path.exists(os.path.join(UPLOAD_FOLDER, filename)):
+                present.append((filename, info))
+            else:
+                logger.error("[UPLOAD_API] Файл %s удален параллельно с загрузкой", filename)
+                missing.append(filename)
+        if not present:
+            return None, missing
+        # Добавляем в работу поверх свежего состояния (другой воркер мог изменить её за время обработки)
+        work = works_store.add_images(work_id, present, datetime.now().isoformat())
+        if work is None:
+            logger.error("[UPLOAD_API] Работа %s удалена во время загрузки", work_id)
+            for filename, info in present:
+                if works_store.image_refs(filename) == 0:
+                    remove_image_files(UPLOAD_FOLDER, filename, info)
+            return WORK_NOT_FOUND_ERROR, missing
+    logger.info("[UPLOAD_API] Добавлено изображений: %s. Всего в работе: %s", len(present), len(work['images']))
+    return None, missing
+
+def attach_image(work_id, filename, info):
+    """Добавляет обработанное изображение к работе. Возвращает текст ошибки или None."""
+    error, missing = attach_images(work_id, [(filename, info)])
+    return error or (IMAGE_GONE_ERROR if missing else None)
+
+def release_image(filename, info=None):
+    """Удаляет файлы изображения, если на него больше не ссылается ни одна работа"""
+    with file_lock(IMAGE_REFS_LOCK):
+        refs = works_store.image_refs(filename)
+        if refs:
+            logger.info(f"[FILES] {filename} остается: ссылок из работ — {refs}")
+            return False
+        remove_image_files(UPLOAD_FOLDER, filename, info)
+        logger.info(f"[FILES] Удалены файлы изображения {filename}")
+        return True
+
+def ingest_upload(work_id, raw_path, size, sha256, original_name, mimetype):
+    """Доводит записанную на диск загрузку до изображения работы.
+
+    Известное содержимое сразу привязывается к работе без декодирования,
+    новое уходит в фоновую очередь или обрабатывается в запросе. Временный
+    файл raw_path забирается очередью или удаляется.
+
+    Returns:
+        tuple[dict, int]: Тело ответа и HTTP-статус.
 
     Raises:
-        ValueError: Если файл пуст или не является изображением.
+        ValueError: Если файл пуст или не может быть сохранен.
     """
-    logger.info(f"[UPLOAD] Начало загрузки файла: {getattr(file, 'filename', 'unknown')}")
-    
     try:
-        # Сброс указателя файла
-        logger.info("[UPLOAD] Сброс указателя файла")
-        file.stream.seek(0)
-        
-        # Чтение данных
-        logger.info("[UPLOAD] Чтение данных файла")
-        raw_data = file.read()
-        data_size = len(raw_data)
-        logger.info(f"[UPLOAD] Прочитано байт: {data_size}")
-        
-        if data_size == 0:
+        if size == 0:
             raise ValueError("Файл пуст")
-        
-        if data_size > MAX_CONTENT_LENGTH:
-            raise ValueError(f"Файл слишком большой: {data_size} байт (максимум {MAX_CONTENT_LENGTH})")
-        
-        # Попытка открыть как изображение
-        logger.info("[UPLOAD] Попытка открыть как изображение")
-        img = Image.open(io.BytesIO(raw_data))
-        logger.info(f"[UPLOAD] Изображение открыто: {img.format}, размер: {img.size}, режим: {img.mode}")
-        
-        # Поворот по EXIF
+        upload_bytes.inc(size)
+
+        with stage('dedup_lookup'):
+            known = find_known_image(sha256, original_name, mimetype)
+        if known is not None:
+            filename, info = known
+            logger.info("[UPLOAD_API] Содержимое уже загружено как %s, обработка не нужна", filename)
+            image_size = (info.get('width', 0), info.get('height', 0))
+            variants = info.get('variants', [])
+            with stage('attach'):
+                error = attach_image(work_id, filename, info or None)
+            if error is None:
+                upload_results.inc(mode='dedup')
+                return {
+                    'filename': filename,
+                    'size': image_size,
+                    'variants': variants,
+                    'deduplicated': True,
+                    'message': 'Изображение успешно загружено'
+                }, 201
+            if error == WORK_NOT_FOUND_ERROR:
+                return {'error': error}, 404
+            # Файлы удалили между поиском и привязкой — обрабатываем заново
+
+        # Тяжелая обработка — в пуле процессов, клиенту сразу отдаем задание
+        if image_jobs is not None:
+            job = image_jobs.submit(work_id, raw_path, original_name, mimetype, size, sha256)
+            raw_path = None
+            upload_results.inc(mode='pool')
+            logger.info("[UPLOAD_API] Создано задание обработки: %s", job['id'])
+            return {
+                'job_id': job['id'],
+                'status': job['status'],
+                'status_url': f"/api/image-jobs/{job['id']}",
+                'events_url': f"/api/image-jobs/{job['id']}/events",
+                'message': 'Изображение принято в обработку'
+            }, 202
+
+        logger.info("[UPLOAD_API] Вызов save_uploaded_image")
+        with image_processing_seconds.time(mode='sync'):
+            filename, image_size, variants, meta = save_uploaded_image(raw_path, sha256, original_name, mimetype)
+        upload_results.inc(mode='sync')
+        logger.info("[UPLOAD_API] Файл сохранен: %s, размер: %s, версий: %s", filename, image_size, len(variants))
+
+        with stage('attach'):
+            error = attach_image(work_id, filename, image_info(image_size, variants, meta))
+        if error:
+            return {'error': error}, 404 if error == WORK_NOT_FOUND_ERROR else 409
+        logger.info("[UPLOAD_API] Данные сохранены в JSON")
+        return {
+            'filename': filename,
+            'size': image_size,
+            'variants': variants,
+            'message': 'Изображение успешно загружено'
+        }, 201
+    finally:
+        if raw_path is not None:
+            os.remove(raw_path)
+
+def process_uploads(uploads):
+    """Параллельно обрабатывает загрузки: в пуле процессов или, без него, в потоках.
+
+    Args:
+        uploads: [(путь к исходным байтам, sha256, исходное имя, MIME), ...].
+
+    Returns:
+        list: (имя файла, размер, версии, метаданные) или исключение для каждой загрузки.
+    """
+    if image_jobs is not None:
+        results = image_jobs.process_many([(raw_path, content_base(sha256), name, mimetype)
+                                           for raw_path, sha256, name, mimetype in uploads])
+        return [r if isinstance(r, Exception) else (r['filename'], tuple(r['size']), r['variants'], r['meta'])
+                for r in results]
+
+    def run(upload):
+        with image_processing_seconds.time(mode='sync'):
+            return save_uploaded_image(*upload)
+
+    # Pillow отпускает GIL при декодировании и кодировании — потоки обрабатывают параллельно
+    with concurrent.futures.ThreadPoolExecutor(max_workers=IMAGE_BATCH_THREADS) as pool:
+        futures = [pool.submit(run, upload) for upload in uploads]
+    results = []
+    for future in futures:
         try:
-            img = ImageOps.exif_transpose(img)
-            logger.info("[UPLOAD] EXIF поворот применен")
+            results.append(future.result())
         except Exception as e:
-            logger.warning(f"[UPLOAD] Не удалось применить EXIF поворот: {e}")
-        
-        # Конвертация в RGB
-        if img.mode != "RGB":
-            logger.info(f"[UPLOAD] Конвертация из {img.mode} в RGB")
-            img = img.convert("RGB")
-        
-        width, height = img.size
-        logger.info(f"[UPLOAD] Финальный размер: {width}x{height}")
-        
-        # Генерация имени файла
-        filename = f"{uuid.uuid4().hex}.jpg"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        logger.info(f"[UPLOAD] Сохранение в: {filepath}")
-        
-        # Сохранение
-        img.save(filepath, format="JPEG", quality=85, optimize=True)
-        file_size = os.path.getsize(filepath)
-        logger.info(f"[UPLOAD] Файл сохранен, размер на диске: {file_size} байт")
-        
-        return filename, (width, height)
-        
-    except Exception as exc:
-        # Фолбэк: сохраняем исходные байты без декодирования, чтобы не блокировать загрузку
-        logger.error(f"[UPLOAD] Не удалось обработать изображение Pillow: {type(exc).__name__}: {exc}")
-        try:
-            base = uuid.uuid4().hex
-            # Определяем расширение по исходному имени или mime-type
-            ext = (file.filename or '').rsplit('.', 1)[-1].lower() if '.' in (file.filename or '') else ''
-            if not ext:
-                guessed = mimetypes.guess_extension(getattr(file, 'mimetype', '') or '') or '.bin'
-                ext = guessed.lstrip('.')
-            if len(ext) > 8:
-                ext = 'bin'
-            filename = f"{base}.{ext}"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            logger.info(f"[UPLOAD] Фолбэк-сохранение оригинальных байт в: {filepath}")
-            with open(filepath, 'wb') as f:
-                f.write(raw_data)
-            # Размеры неизвестны, возвращаем (0, 0)
-            return filename, (0, 0)
-        except Exception as save_exc:
-            import traceback
-            logger.error(f"[UPLOAD] Фолбэк тоже не удался: {type(save_exc).__name__}: {save_exc}")
-            logger.error(f"[UPLOAD] Трассировка: {traceback.format_exc()}")
-            raise ValueError(f"Ошибка сохранения файла: {save_exc}")
-
-# Старый вспомогательный ресайз удален — сохраняем оригинальный размер как JPEG
+            results.append(e)
+    return results
 
-@log_function_call
-def load_works():
-    """Загружает работы из JSON файла"""
-    try:
-        json_path = os.path.join(DATA_FOLDER, 'works.json')
-        logger.info(f"[WORKS] Загружаем работы из {json_path}")
-        with open(json_path, 'r', encoding='utf-8') as f:
-            works = json.load(f)
-        logger.info(f"[WORKS] Загружено {len(works)} работ")
-        return works
-    except FileNotFoundError:
-        logger.warning(f"[WORKS] Файл {json_path} не найден, возвращаем пустой список")
-        return []
-    except json.JSONDecodeError:
-        logger.error(f"[WORKS] Ошибка чтения JSON файла {json_path}, создаем новый")
-        return []
+def ingest_batch(work_id, files):
+    """Загружает несколько файлов в работу: обработка параллельно, одна запись в хранилище.
 
-@log_function_call
-def save_works(works):
-    """Сохраняет работы в JSON файл"""
+    Returns:
+        tuple[dict, int]: Тело ответа с результатом по каждому файлу и HTTP-статус.
+    """
+    results = [{'original_filename': file.filename} for file in files]
+    ready = {}     # индекс файла -> (имя, размер, версии, image_info, найден ли по содержимому)
+    pending = {}   # sha256 -> (загрузка, [индексы файлов с этим содержимым])
+    raw_paths = []
     try:
-        json_path = os.path.join(DATA_FOLDER, 'works.json')
-        logger.info(f"[SAVE] Сохраняем {len(works)} работ в {json_path}")
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(works, f, ensure_ascii=False, indent=2)
-        logger.info(f"[SAVE] Работы успешно сохранены")
-    except Exception as e:
-        logger.error(f"[SAVE] Ошибка сохранения works.json: {e}")
-        raise
+        with stage('spool'):
+            for i, file in enumerate(files):
+                try:
+                    raw_path, size, sha256 = spool_request_file(file)
+                except ValueError as e:
+                    results[i]['error'] = str(e)
+                    continue
+                raw_paths.append(raw_path)
+                if size == 0:
+                    results[i]['error'] = 'Файл пуст'
+                    continue
+                upload_bytes.inc(size)
+                if sha256 in pending:
+                    # Одинаковые файлы в одном запросе обрабатываем один раз
+                    pending[sha256][1].append(i)
+                    continue
+                with stage('dedup_lookup'):
+                    known = find_known_image(sha256, file.filename, getattr(file, 'mimetype', ''))
+                if known is not None:
+                    filename, info = known
+                    ready[i] = (filename, (info.get('width', 0), info.get('height', 0)),
+                                info.get('variants', []), info or None, True)
+                    upload_results.inc(mode='dedup')
+                else:
+                    pending[sha256] = ((raw_path, sha256, file.filename, getattr(file, 'mimetype', '')), [i])
+
+        with stage('process'):
+            processed = process_uploads([upload for upload, _ in pending.values()])
+        for (upload, indexes), result in zip(pending.values(), processed):
+            for i in indexes:
+                if isinstance(result, Exception):
+                    logger.error(f"[UPLOAD_API] Не удалось обработать {upload[2]}: {result}")
+                    results[i]['error'] = str(result)
+                else:
+                    filename, image_size, variants, meta = result
+                    ready[i] = (filename, image_size, variants, image_info(image_size, variants, meta), False)
+            if not isinstance(result, Exception):
+                upload_results.inc(mode='batch')
+
+        with stage('attach'):
+            error, missing = attach_images(work_id, [(ready[i][0], ready[i][3]) for i in sorted(ready)])
+        if error:
+            return {'error': error, 'results': results}, 404
+        for i, (filename, image_size, variants, _, deduplicated) in ready.items():
+            if filename in missing:
+                results[i]['error'] = IMAGE_GONE_ERROR
+                continue
+            results[i].update(filename=filename, size=image_size, variants=variants)
+            if deduplicated:
+                results[i]['deduplicated'] = True
+    finally:
+        for raw_path in raw_paths:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(raw_path)
+
+    added = sum(1 for r in results if 'filename' in r)
+    logger.info(f"[UPLOAD_API] Пакет для работы {work_id}: добавлено {added} из {len(files)}")
+    return {
+        'results': results,
+        'added': added,
+        'failed': len(files) - added,
+        'message': f'Загружено изображений: {added} из {len(files)}'
+    }, 201 if added else 400
+
+decode_memory.limit = IMAGE_DECODE_MEMORY_MB * 1024 * 1024  # для обработки прямо в запросе
+image_jobs = None
+if IMAGE_WORKERS > 0:
+    image_jobs = ImageJobQueue(
+        os.path.join(DATA_FOLDER, 'image_jobs'),
+        UPLOAD_FOLDER,
+        workers=IMAGE_WORKERS,
+        max_pixels=IMAGE_MAX_PIXELS,
+        memory_limit_mb=IMAGE_WORKER_MEMORY_MB,
+        on_done=lambda job, result: attach_image(
+            job['work_id'], result['filename'],
+            image_info(result['size'], result['variants'], result.get('meta'))),
+        jpeg_passthrough=JPEG_PASSTHROUGH,
+        max_edge=IMAGE_MAX_EDGE or None,
+        decode_memory_mb=IMAGE_DECODE_MEMORY_MB,
+    )
+    image_jobs.start()
+
+resumable_uploads = ResumableUploads(os.path.join(DATA_FOLDER, 'resumable'), RESUMABLE_MAX_SIZE)
+uploads_index = UploadsIndex(UPLOAD_FOLDER, os.path.join(DATA_FOLDER, 'uploads_index.db'))
+
+metrics_registry.gauge('postpress_mail_queue_depth', 'Письма в очереди на отправку',
+                       lambda: len(mail_queue.pending()))
+metrics_registry.gauge('postpress_image_jobs_pending', 'Задания обработки изображений в очереди',
+                       lambda: image_jobs.pending() if image_jobs is not None else 0)
+metrics_registry.gauge('postpress_image_decode_memory_bytes', 'Память, занятая декодированием изображений в процессе',
+                       lambda: decode_memory.used)
+metrics_registry.gauge('postpress_works', 'Число работ в портфолио', lambda: len(works_store.all()))
 
 def hash_password(password):
     """Хеширует пароль с солью"""
@@ -257,6 +523,51 @@ def require_auth(f):
         return f(*args, **kwargs)
     return decorated_function
 
+profiles = ProfileBuffer(os.path.join(DATA_FOLDER, 'profiles'), PROFILE_BUFFER_SIZE)
+
+@app.before_request
+def start_profile():
+    """Включает профиль запроса по заголовку X-Profile (только для админа) или по выборке"""
+    mode = request.headers.get('X-Profile')
+    if mode and check_auth():
+        mode = mode if mode in PROFILE_MODES else 'stages'
+    elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        mode = PROFILE_MODE
+    else:
+        return
+    g.profile = RequestProfile(mode)
+    g.profile.start()
+
+@app.after_request
+def finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    duration_ms, report = profile.stop()
+    try:
+        profiles.add({
+            'id': profile.id,
+            'mode': profile.mode,
+            'started_at': datetime.fromtimestamp(profile.started_at).isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 3),
+            'stages': profile.stages,
+            'report': report,
+        })
+    except OSError as e:
+        logger.warning(f"[PROFILE] Не удалось сохранить профиль: {e}")
+    response.headers['X-Profile-Id'] = profile.id
+    return response
+
+@app.teardown_request
+def discard_profile(exc):
+    # after_request не вызывался (необработанная ошибка) — профиль нужно остановить
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.stop()
+
 @app.route('/api/login', methods=['POST'])
 @log_function_call
 def login():
@@ -320,79 +631,97 @@ def auth_status():
     else:
         return jsonify({'authenticated': False})
 
-@log_function_call
-def send_email(name, phone, email, message=""):
-    """
-    Отправляет email заявку. Не критично если не работает.
-    """
-    logger.info(f"[EMAIL] Начинаем отправку email для {name}, {phone}")
-    try:
-        # Получаем настройки email
-        smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-        smtp_port = int(os.getenv('SMTP_PORT', '587'))
-        sender_email = os.getenv('SENDER_EMAIL')
-        sender_password = os.getenv('SENDER_PASSWORD')
-        recipient_email = os.getenv('RECIPIENT_EMAIL')
-        
-        logger.info(f"[EMAIL] SMTP настройки - Server: {smtp_server}, Port: {smtp_port}")
-        logger.info(f"[EMAIL] Sender: {sender_email}, Recipient: {recipient_email}")
-        logger.info(f"[EMAIL] Password set: {bool(sender_password)}")
-        
-        # Если настройки не заданы, просто логируем заявку
-        if not all([sender_email, sender_password, recipient_email]):
-            logger.warning(f"[EMAIL] ПРЕДУПРЕЖДЕНИЕ: Email настройки не полные.")
-            logger.warning(f"[EMAIL] Sender: {bool(sender_email)}, Password: {bool(sender_password)}, Recipient: {bool(recipient_email)}")
-            logger.info(f"[EMAIL] Заявка логируется локально: {name}, {phone}, {message}")
-            return False
-            
-        logger.info(f"[EMAIL] Настройки полные, создаем сообщение...")
-        
-        # Создаем и отправляем email
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = recipient_email
-        msg['Subject'] = 'Новая заявка с сайта POSTPRESS'
-        
-        body = f"""
-Новая заявка с сайта POSTPRESS:
+def send_payload(payload):
+    """Отдает закэшированный ответ с учетом Accept-Encoding и условных заголовков"""
+    encoding = payload.choose_encoding(request.accept_encodings)
+    etag = payload.etag_for(encoding)
 
-Имя: {name}
-Телефон: {phone}
-Сообщение: {message}
+    if request.if_none_match:
+        # Прокси может ослабить ETag или отдать клиенту другой вариант сжатия
+        not_modified = any(request.if_none_match.contains_weak(payload.etag_for(e))
+                           for e in payload.available_encodings())
+    elif request.if_modified_since:
+        not_modified = int(payload.last_modified) <= request.if_modified_since.timestamp()
+    else:
+        not_modified = False
 
-Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}
-        """
-        
-        msg.attach(MIMEText(body, 'plain', 'utf-8'))
-        logger.info(f"[EMAIL] Сообщение создано, подключаемся к SMTP...")
-        
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            logger.info(f"[EMAIL] Подключились к {smtp_server}:{smtp_port}")
-            server.starttls()
-            logger.info(f"[EMAIL] STARTTLS выполнен")
-            server.login(sender_email, sender_password)
-            logger.info(f"[EMAIL] Авторизация успешна")
-            server.send_message(msg)
-            logger.info(f"[EMAIL] Сообщение отправлено")
-        
-        logger.info(f"[EMAIL] SUCCESS: Email отправлен успешно для {name}, {phone}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"[EMAIL] ERROR: Ошибка отправки email: {e}")
-        import traceback
-        logger.error(f"[EMAIL] ERROR TRACEBACK: {traceback.format_exc()}")
-        logger.info(f"[EMAIL] Заявка сохранена локально: {name}, {phone}, {message}")
-        return False
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = Response(payload.encoded(encoding), mimetype='application/json')
+        if encoding != 'identity':
+            response.content_encoding = encoding
+    response.set_etag(etag)
+    response.last_modified = payload.last_modified
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    return response
 
 # API routes
 @app.route('/api/works', methods=['GET'])
 @log_function_call
 def get_works():
+    """Список работ: целиком или страницей (limit, cursor, fields, area, since, until)"""
     logger.info("[API] Получение списка работ")
-    works = load_works()
-    logger.info(f"[API] Возвращаем {len(works)} работ")
-    return jsonify(works)
+    works, version, last_modified = works_store.state()
+    if not any(name in request.args for name in QUERY_PARAMS):
+        # Без параметров — прежний полный массив для существующих клиентов
+        logger.info(f"[API] Возвращаем {len(works)} работ")
+        return send_payload(works_payload.get(version, works, last_modified))
+    try:
+        query = parse_query(request.args)
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    key = ('query',) + tuple(request.args.get(name, '') for name in QUERY_PARAMS)
+    payload = works_query_payloads.get(
+        key, version, lambda: run_query(works_index.get(version, works), query), last_modified)
+    return send_payload(payload)
+
+@app.route('/api/works/grid', methods=['GET'])
+def get_works_grid():
+    """Компактный индекс для сетки портфолио: обложки с размерами и заглушками LQIP"""
+    works, version, last_modified = works_store.state()
+    return send_payload(works_query_payloads.get(('grid',), version, lambda: grid_index(works), last_modified))
+
+@app.route('/api/works/search', methods=['GET'])
+@log_function_call
+def search_works():
+    """Полнотекстовый поиск: q, limit, fields. Работы идут по убыванию релевантности."""
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'error': 'Пустой поисковый запрос'}), 400
+    try:
+        limit = parse_limit(request.args, SEARCH_DEFAULT_LIMIT)
+        fields = parse_fields(request.args.get('fields'))
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    works, version, last_modified = works_store.state()
+
+    def build():
+        with stage('search_sync'):
+            search_index.sync(version, works)
+        with stage('search_query'):
+            ranked, total = search_index.search(q, limit)
+        found = []
+        for work_id, score in ranked:
+            work = works_store.get(work_id)
+            if work is not None:
+                found.append(dict(project(work, fields), score=score))
+        return {'works': found, 'total': total}
+
+    key = ('search', q.lower(), limit, request.args.get('fields', ''))
+    return send_payload(works_query_payloads.get(key, version, build, last_modified))
+
+@app.route('/api/works/<work_id>', methods=['GET'])
+@log_function_call
+def get_work(work_id):
+    """Одна работа целиком (для лайтбокса при постраничной загрузке)"""
+    _, version, last_modified = works_store.state()
+    work = works_store.get(work_id)
+    if work is None:
+        return jsonify({'error': WORK_NOT_FOUND_ERROR}), 404
+    return send_payload(works_query_payloads.get(('work', work_id), version, lambda: work, last_modified))
 
 @app.route('/api/works', methods=['POST'])
 @log_function_call
@@ -403,8 +732,6 @@ def add_work():
         data = request.get_json()
         if not data:
             return jsonify({'error': 'Нет данных для создания работы'}), 400
-            
-        works = load_works()
         
         # Валидация данных
         title = data.get('title', '').strip()
@@ -424,8 +751,8 @@ def add_work():
             'updated_at': datetime.now().isoformat()
         }
         
-        works.append(new_work)
-        save_works(works)
+        works_store.add(new_work)
+        search_index.update_work(new_work)
         
         return jsonify(new_work), 201
     except Exception as e:
@@ -442,10 +769,8 @@ def update_work(work_id):
         if not data:
             return jsonify({'error': 'Нет данных для обновления'}), 400
             
-        works = load_works()
-        
-        work = next((w for w in works if w['id'] == work_id), None)
-        if not work:
+        work = works_store.get(work_id)
+        if work is None:
             return jsonify({'error': 'Работа не найдена'}), 404
         
         # Валидация данных
@@ -456,14 +781,16 @@ def update_work(work_id):
         if not title:
             return jsonify({'error': 'Название работы обязательно'}), 400
             
-        work.update({
+        work = works_store.update(work_id, {
             'title': title,
             'description': description,
             'area': area,
             'updated_at': datetime.now().isoformat()
         })
+        if work is None:
+            return jsonify({'error': 'Работа не найдена'}), 404
+        search_index.update_work(work)
         
-        save_works(works)
         return jsonify(work)
     except Exception as e:
         print(f"Ошибка обновления работы: {e}")
@@ -474,20 +801,15 @@ def update_work(work_id):
 @require_auth
 def delete_work(work_id):
     try:
-        works = load_works()
-        work = next((w for w in works if w['id'] == work_id), None)
-        
-        if not work:
+        work = works_store.delete(work_id)
+        if work is None:
             return jsonify({'error': 'Работа не найдена'}), 404
+        search_index.remove_work(work_id)
             
-        # Удаляем изображения
+        # Удаляем изображения уже после того, как работа удалена из хранилища,
+        # и только те, на которые не ссылаются другие работы
         for image in work.get('images', []):
-            image_path = os.path.join(UPLOAD_FOLDER, image)
-            if os.path.exists(image_path):
-                os.remove(image_path)
-                
-        works = [w for w in works if w['id'] != work_id]
-        save_works(works)
+            release_image(image, work.get('image_info', {}).get(image))
         
         return jsonify({'message': 'Работа удалена'})
     except Exception as e:
@@ -498,91 +820,269 @@ def delete_work(work_id):
 @require_auth
 def upload_image(work_id):
     """Загрузка изображения с подробным логированием и обработкой ошибок."""
-    logger.info(f"[UPLOAD_API] Начало загрузки для работы: {work_id}")
+    logger.info("[UPLOAD_API] Начало загрузки для работы: %s", work_id)
     
     try:
         # Проверяем существование работы
-        works = load_works()
-        work = next((w for w in works if w['id'] == work_id), None)
-        
-        if not work:
-            logger.error(f"[UPLOAD_API] Работа с ID {work_id} не найдена")
+        work = works_store.get(work_id)
+        if work is None:
+            logger.error("[UPLOAD_API] Работа с ID %s не найдена", work_id)
             return jsonify({'error': 'Работа не найдена'}), 404
         
-        logger.info(f"[UPLOAD_API] Работа найдена: {work.get('title', 'Без названия')}")
+        logger.info("[UPLOAD_API] Работа найдена: %s", work.get('title', 'Без названия'))
         
         # Проверяем наличие файла
-        logger.info(f"[UPLOAD_API] Проверка наличия файла в request.files")
-        logger.info(f"[UPLOAD_API] Ключи в request.files: {list(request.files.keys())}")
+        logger.info("[UPLOAD_API] Проверка наличия файла в request.files")
+        logger.info("[UPLOAD_API] Ключи в request.files: %s", list(request.files.keys()))
         
         if 'image' not in request.files:
             logger.error("[UPLOAD_API] Ключ 'image' не найден в request.files")
             return jsonify({'error': 'Нет файла для загрузки (ключ image отсутствует)'}), 400
         
         file = request.files['image']
-        logger.info(f"[UPLOAD_API] Файл получен: {getattr(file, 'filename', 'unknown')}")
+        logger.info("[UPLOAD_API] Файл получен: %s", getattr(file, 'filename', 'unknown'))
         
         if not file or not getattr(file, 'filename', None):
             logger.error("[UPLOAD_API] Файл пуст или не выбран")
             return jsonify({'error': 'Файл не выбран или пуст'}), 400
         
         # Логирование информации о файле
-        logger.info(f"[UPLOAD_API] Имя файла: {file.filename}")
-        logger.info(f"[UPLOAD_API] Content-Type: {getattr(file, 'content_type', 'unknown')}")
-        
-        # Сохранение файла
-        logger.info("[UPLOAD_API] Вызов save_uploaded_image")
-        filename, image_size = save_uploaded_image(file)
-        logger.info(f"[UPLOAD_API] Файл сохранен: {filename}, размер: {image_size}")
+        logger.info("[UPLOAD_API] Имя файла: %s", file.filename)
+        logger.info("[UPLOAD_API] Content-Type: %s", getattr(file, 'content_type', 'unknown'))
         
-        # Добавляем в работу
-        if 'images' not in work:
-            work['images'] = []
-        work['images'].append(filename)
-        work['updated_at'] = datetime.now().isoformat()
+        with stage('spool'):
+            raw_path, size, sha256 = spool_request_file(file)
+        response_data, status = ingest_upload(work_id, raw_path, size, sha256,
+                                              file.filename, getattr(file, 'mimetype', ''))
+        logger.info("[UPLOAD_API] Ответ %s: %s", status, response_data)
         
-        logger.info(f"[UPLOAD_API] Изображение добавлено к работе. Всего изображений: {len(work['images'])}")
-        
-        save_works(works)
-        logger.info("[UPLOAD_API] Данные сохранены в JSON")
-        
-        response_data = {
-            'filename': filename, 
-            'size': image_size, 
-            'message': 'Изображение успешно загружено'
-        }
-        logger.info(f"[UPLOAD_API] Успешный ответ: {response_data}")
-        
-        return jsonify(response_data), 201
+        return jsonify(response_data), status
         
     except ValueError as exc:
-        logger.error(f"[UPLOAD_API] Ошибка валидации: {exc}")
+        logger.error("[UPLOAD_API] Ошибка валидации: %s", exc)
         return jsonify({'error': str(exc)}), 400
         
     except Exception as e:
-        logger.error(f"[UPLOAD_API] Критическая ошибка: {type(e).__name__}: {e}")
+        logger.error("[UPLOAD_API] Критическая ошибка: %s: %s", type(e).__name__, e)
         import traceback
-        logger.error(f"[UPLOAD_API] Трассировка: {traceback.format_exc()}")
+        logger.error("[UPLOAD_API] Трассировка: %s", traceback.format_exc())
         return jsonify({'error': f'Внутренняя ошибка сервера: {str(e)}'}), 500
 
+@app.route('/api/works/<work_id>/images/batch', methods=['POST'])
+@log_function_call
+@require_auth
+def upload_images_batch(work_id):
+    """Загрузка нескольких изображений одним запросом (поле images, по файлу на часть)"""
+    try:
+        if works_store.get(work_id) is None:
+            return jsonify({'error': WORK_NOT_FOUND_ERROR}), 404
+        files = [file for file in request.files.getlist('images') if file and file.filename]
+        if not files:
+            return jsonify({'error': 'Нет файлов для загрузки (поле images пусто)'}), 400
+        if len(files) > IMAGE_BATCH_MAX_FILES:
+            return jsonify({'error': f'Не больше {IMAGE_BATCH_MAX_FILES} файлов за один запрос'}), 400
+        logger.info(f"[UPLOAD_API] Пакетная загрузка для работы {work_id}: {len(files)} файлов")
+        response_data, status = ingest_batch(work_id, files)
+        return jsonify(response_data), status
+    except Exception as e:
+        logger.error(f"[UPLOAD_API] Критическая ошибка пакетной загрузки: {type(e).__name__}: {e}")
+        return jsonify({'error': f'Внутренняя ошибка сервера: {str(e)}'}), 500
+
+def resumable_response(record, status=200):
+    """Состояние возобновляемой загрузки: JSON и заголовки Upload-Offset/Upload-Length"""
+    response = jsonify({
+        'upload_id': record['id'],
+        'work_id': record['work_id'],
+        'filename': record['filename'],
+        'offset': record['offset'],
+        'length': record['length'],
+        'upload_url': f"/api/uploads/{record['id']}",
+    })
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(record['offset'])
+    response.headers['Upload-Length'] = str(record['length'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/works/<work_id>/uploads', methods=['POST'])
+@log_function_call
+@require_auth
+def create_resumable_upload(work_id):
+    """Начало возобновляемой загрузки: {filename, size, mimetype}"""
+    if works_store.get(work_id) is None:
+        return jsonify({'error': WORK_NOT_FOUND_ERROR}), 404
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get('filename') or '').strip()
+    if not filename:
+        return jsonify({'error': 'Не указано имя файла'}), 400
+    try:
+        length = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректный размер файла'}), 400
+    try:
+        record = resumable_uploads.create(work_id, filename, str(data.get('mimetype') or ''), length)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = resumable_response(record, 201)
+    response.headers['Location'] = f"/api/uploads/{record['id']}"
+    return response
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@require_auth
+def get_resumable_upload(upload_id):
+    """Текущее смещение загрузки (GET или HEAD) — с него клиент продолжает после обрыва"""
+    record = resumable_uploads.get(upload_id)
+    if record is None:
+        return jsonify({'error': 'Загрузка не найдена'}), 404
+    return resumable_response(record)
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+@require_auth
+def append_resumable_upload(upload_id):
+    """Очередной кусок: тело запроса — байты файла начиная с заголовка Upload-Offset"""
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Нужен заголовок Upload-Offset'}), 400
+    try:
+        with stage('spool'):
+            record = resumable_uploads.append(upload_id, offset, request.stream)
+    except UploadOffsetError as e:
+        logger.warning(f"[RESUMABLE] Сессия {upload_id}: кусок с {offset}, ожидалось {e.offset}")
+        response = jsonify({'error': str(e), 'offset': e.offset})
+        response.status_code = 409
+        response.headers['Upload-Offset'] = str(e.offset)
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except ClientDisconnected:
+        # Полученные до обрыва байты уже в файле: клиент узнает смещение и продолжит
+        logger.info(f"[RESUMABLE] Сессия {upload_id}: клиент отключился посреди куска")
+        return jsonify({'error': 'Соединение прервано'}), 400
+    if record is None:
+        return jsonify({'error': 'Загрузка не найдена'}), 404
+    return resumable_response(record)
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+@log_function_call
+@require_auth
+def finalize_resumable_upload(upload_id):
+    """Завершение: собранный файл обрабатывается как обычная загрузка изображения"""
+    fd, raw_path = tempfile.mkstemp(dir=DATA_FOLDER, prefix='.upload-')
+    os.close(fd)
+    try:
+        finished = resumable_uploads.finish(upload_id, raw_path)
+    except ValueError as e:
+        os.remove(raw_path)
+        return jsonify({'error': str(e)}), 409
+    if finished is None:
+        os.remove(raw_path)
+        return jsonify({'error': 'Загрузка не найдена'}), 404
+    record, sha256 = finished
+    # Сессия закрывается только после успешной обработки: иначе завершение можно повторить,
+    # не передавая файл заново
+    try:
+        response_data, status = ingest_upload(record['work_id'], raw_path, record['length'], sha256,
+                                              record['filename'], record['mimetype'])
+    except ValueError as e:
+        logger.error(f"[RESUMABLE] Не удалось обработать {record['filename']}: {e}")
+        return jsonify({'error': str(e), 'upload_id': upload_id}), 400
+    except Exception as e:
+        logger.exception(f"[RESUMABLE] Ошибка обработки {record['filename']}")
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(raw_path)
+        return jsonify({'error': f'Внутренняя ошибка сервера: {e}. Повторите завершение загрузки',
+                        'upload_id': upload_id}), 500
+    if status < 400:
+        resumable_uploads.close(upload_id)
+    response_data['upload_id'] = upload_id
+    return jsonify(response_data), status
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@require_auth
+def discard_resumable_upload(upload_id):
+    if not resumable_uploads.discard(upload_id):
+        return jsonify({'error': 'Загрузка не найдена'}), 404
+    return '', 204
+
+@app.route('/api/image-jobs/<job_id>', methods=['GET'])
+@log_function_call
+@require_auth
+def get_image_job(job_id):
+    """Состояние задания обработки изображения"""
+    job = image_jobs.get(job_id) if image_jobs is not None else None
+    if job is None:
+        return jsonify({'error': 'Задание не найдено'}), 404
+    return jsonify(job)
+
+@app.route('/api/image-jobs/<job_id>/events', methods=['GET'])
+@log_function_call
+@require_auth
+def image_job_events(job_id):
+    """SSE-поток изменений задания до его завершения"""
+    if image_jobs is None or image_jobs.get(job_id) is None:
+        return jsonify({'error': 'Задание не найдено'}), 404
+    return Response(
+        stream_with_context(image_jobs.events(job_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@log_function_call
+@require_auth
+def list_profiles():
+    """Последние профили запросов (без отчетов интерпретатора)"""
+    return jsonify({'profiles': profiles.list()})
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@log_function_call
+@require_auth
+def get_profile(profile_id):
+    """Полный профиль запроса, включая отчет cProfile/pyinstrument"""
+    record = profiles.get(profile_id)
+    if record is None:
+        return jsonify({'error': 'Профиль не найден'}), 404
+    return jsonify(record)
+
+@app.route('/api/admin/uploads/scan', methods=['GET'])
+@log_function_call
+@require_auth
+def scan_uploads_folder():
+    """Отчет о папке загрузок: сироты, пропавшие файлы, дубликаты (?full=1 — перечитать все)"""
+    return jsonify(scan_uploads(uploads_index, works_store.all(), full=request.args.get('full') == '1'))
+
+@app.route('/api/admin/uploads/gc', methods=['POST'])
+@log_function_call
+@require_auth
+def collect_uploads_garbage():
+    """Удаляет файлы загрузок без ссылок, не больше limit за запрос (dry_run — только посчитать)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        limit = min(int(data.get('limit', UPLOADS_GC_LIMIT)), UPLOADS_GC_LIMIT)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit должен быть числом'}), 400
+    if limit <= 0:
+        return jsonify({'error': 'limit должен быть больше нуля'}), 400
+    stats = collect_orphans(uploads_index, works_store, IMAGE_REFS_LOCK, limit=limit,
+                            dry_run=bool(data.get('dry_run')))
+    return jsonify(stats)
+
 @app.route('/api/works/<work_id>/images/<filename>', methods=['DELETE'])
 @log_function_call
 @require_auth
 def delete_image(work_id, filename):
     try:
-        works = load_works()
-        work = next((w for w in works if w['id'] == work_id), None)
-        
-        if not work:
+        work = works_store.get(work_id)
+        if work is None:
             return jsonify({'error': 'Работа не найдена'}), 404
             
         if filename in work['images']:
-            work['images'].remove(filename)
-            save_works(works)
+            info = work.get('image_info', {}).get(filename)
+            if works_store.remove_image(work_id, filename) is None:
+                return jsonify({'error': 'Работа не найдена'}), 404
             
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            release_image(filename, info)
                 
             return jsonify({'message': 'Изображение удалено'})
         else:
@@ -602,8 +1102,8 @@ def send_contact():
         # Получаем данные из запроса
         logger.info("[CONTACT] Шаг 2: Получаем JSON данные из запроса")
         data = request.get_json()
-        logger.info(f"[CONTACT] Шаг 3: Получены данные: {data}")
-        logger.info(f"[CONTACT] Шаг 4: Тип данных: {type(data)}")
+        logger.info("[CONTACT] Шаг 3: Получены данные: %s", data)
+        logger.info("[CONTACT] Шаг 4: Тип данных: %s", type(data))
         
         if not data:
             logger.warning("[CONTACT] Шаг 5: Данные пустые - возвращаем ошибку 400")
@@ -615,10 +1115,10 @@ def send_contact():
         phone = data.get('phone', '')
         message = data.get('message', '')
         
-        logger.info(f"[CONTACT] Шаг 7: Извлеченные поля:")
-        logger.info(f"[CONTACT]   - Имя: '{name}' (тип: {type(name)}, длина: {len(name)})")
-        logger.info(f"[CONTACT]   - Телефон: '{phone}' (тип: {type(phone)}, длина: {len(phone)})")
-        logger.info(f"[CONTACT]   - Сообщение: '{message[:100]}...' (тип: {type(message)}, длина: {len(message)})")
+        logger.info("[CONTACT] Шаг 7: Извлеченные поля:")
+        logger.info("[CONTACT]   - Имя: '%s' (тип: %s, длина: %s)", name, type(name), len(name))
+        logger.info("[CONTACT]   - Телефон: '%s' (тип: %s, длина: %s)", phone, type(phone), len(phone))
+        logger.info("[CONTACT]   - Сообщение: '%s...' (тип: %s, длина: %s)", message[:100], type(message), len(message))
         
         # Валидация
         logger.info("[CONTACT] Шаг 8: Проводим валидацию")
@@ -632,8 +1132,8 @@ def send_contact():
         
         logger.info("[CONTACT] Шаг 11: Валидация прошла успешно!")
         
-        # Сохраняем заявку в файл для истории
-        logger.info("[CONTACT] Шаг 12: Сохраняем заявку в файл")
+        # Сохраняем заявку для истории
+        logger.info("[CONTACT] Шаг 12: Сохраняем заявку в хранилище")
         try:
             contact_data = {
                 'name': name.strip(),
@@ -644,76 +1144,67 @@ def send_contact():
                 'user_agent': str(request.user_agent)
             }
             
-            contacts_file = os.path.join(DATA_FOLDER, 'contacts.json')
-            logger.info(f"[CONTACT] Шаг 13: Файл для сохранения: {contacts_file}")
-            
-            # Загружаем существующие контакты
-            if os.path.exists(contacts_file):
-                with open(contacts_file, 'r', encoding='utf-8') as f:
-                    contacts = json.load(f)
-                logger.info(f"[CONTACT] Шаг 14: Загружено {len(contacts)} существующих контактов")
-            else:
-                contacts = []
-                logger.info("[CONTACT] Шаг 14: Создаем новый файл контактов")
-            
-            contacts.append(contact_data)
-            
-            # Сохраняем обновленный список
-            with open(contacts_file, 'w', encoding='utf-8') as f:
-                json.dump(contacts, f, ensure_ascii=False, indent=2)
-            
-            logger.info(f"[CONTACT] Шаг 15: Заявка сохранена успешно. Всего контактов: {len(contacts)}")
+            contacts_store.append(contact_data)
+            logger.info("[CONTACT] Шаг 13: Заявка сохранена успешно")
             
         except Exception as save_error:
-            logger.error(f"[CONTACT] Шаг 15: Ошибка сохранения в файл: {save_error}")
+            logger.error("[CONTACT] Шаг 13: Ошибка сохранения заявки: %s", save_error)
             # Продолжаем, даже если сохранение не удалось
         
-        # Попытка отправки email (не критично)
-        logger.info("[CONTACT] Шаг 16: Попытка отправки email")
+        # Email отправит фоновый поток — ответ клиенту не ждет SMTP (не критично)
+        logger.info("[CONTACT] Шаг 14: Ставим email в очередь отправки")
         try:
-            send_email(name.strip(), phone.strip(), "", message.strip())
-            logger.info("[CONTACT] Шаг 17: Email отправлен успешно")
+            mail_queue.enqueue(name.strip(), phone.strip(), message.strip())
+            logger.info("[CONTACT] Шаг 15: Email поставлен в очередь")
         except Exception as email_error:
-            logger.warning(f"[CONTACT] Шаг 17: Ошибка отправки email (не критично): {email_error}")
+            logger.warning("[CONTACT] Шаг 15: Ошибка постановки email в очередь (не критично): %s", email_error)
         
-        logger.info("[CONTACT] Шаг 18: Возвращаем успешный ответ")
+        logger.info("[CONTACT] Шаг 16: Возвращаем успешный ответ")
         response_data = {'message': 'Заявка принята! Спасибо за обращение, мы свяжемся с вами в ближайшее время.'}
-        logger.info(f"[CONTACT] Шаг 19: Ответ клиенту: {response_data}")
+        logger.info("[CONTACT] Шаг 17: Ответ клиенту: %s", response_data)
         
         return jsonify(response_data)
         
     except Exception as e:
-        logger.error(f"[CONTACT] ERROR: КРИТИЧЕСКАЯ ОШИБКА: {str(e)}")
-        logger.error(f"[CONTACT] ERROR: ТИП ОШИБКИ: {type(e).__name__}")
+        logger.error("[CONTACT] ERROR: КРИТИЧЕСКАЯ ОШИБКА: %s", str(e))
+        logger.error("[CONTACT] ERROR: ТИП ОШИБКИ: %s", type(e).__name__)
         
         # Подробная информация об ошибке
         import traceback
-        logger.error(f"[CONTACT] ERROR: ПОЛНЫЙ ТРЕЙСБЭК:\n{traceback.format_exc()}")
+        logger.error("[CONTACT] ERROR: ПОЛНЫЙ ТРЕЙСБЭК:\n%s", traceback.format_exc())
         
         error_response = {'error': f'Внутренняя ошибка сервера: {str(e)}'}
-        logger.error(f"[CONTACT] ERROR: Возвращаем ошибку клиенту: {error_response}")
+        logger.error("[CONTACT] ERROR: Возвращаем ошибку клиенту: %s", error_response)
         
         return jsonify(error_response), 500
 
+@app.route('/api/contacts', methods=['GET'])
+@log_function_call
+@require_auth
+def list_contacts():
+    """Постраничная выдача заявок для админки (?cursor=...&limit=...)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        contacts, next_cursor = contacts_store.read_page(request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({'error': 'Некорректные параметры cursor/limit'}), 400
+    return jsonify({'contacts': contacts, 'next_cursor': next_cursor})
+
 @app.route('/uploads/<filename>')
 @log_function_call
 def uploaded_file(filename):
-    """Отдает загруженные изображения"""
-    logger.info(f"[FILES] Запрос файла: {filename}")
-    try:
-        # Проверяем, что файл существует
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        logger.info(f"[FILES] Проверяем путь: {file_path}")
-        if not os.path.exists(file_path):
-            logger.warning(f"[FILES] Файл не найден: {file_path}")
-            return jsonify({'error': 'Файл не найден'}), 404
-            
-        # Безопасно отдаем файл
-        logger.info(f"[FILES] Отдаем файл: {filename}")
-        return send_from_directory(UPLOAD_FOLDER, filename)
-    except Exception as e:
-        logger.error(f"[FILES] Ошибка при отдаче файла {filename}: {e}")
-        return jsonify({'error': str(e)}), 500
+    """Отдает загруженные изображения: Range, условные запросы, долгий кэш для имен по содержимому"""
+    path = resolve_upload(UPLOAD_FOLDER, filename)
+    if path is None:
+        logger.warning(f"[FILES] Файл не найден: {filename}")
+        return jsonify({'error': 'Файл не найден'}), 404
+    # send_file отдает файл через wsgi.file_wrapper (sendfile в gunicorn) и сам
+    # обрабатывает Range, If-None-Match и If-Modified-Since
+    response = send_file(path, mimetype=upload_mimetype(filename), etag=upload_etag(filename, os.stat(path)),
+                         max_age=upload_max_age(filename), conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = is_content_addressed(filename)
+    return response
 
 @app.route('/health')
 @log_function_call
@@ -721,6 +1212,11 @@ def health():
     logger.info("[HEALTH] Health check запрос")
     return jsonify({'status': 'ok', 'version': 'LOGGED_VERSION_2025', 'message': 'All systems operational!'})
 
+@app.route('/metrics')
+def metrics():
+    """Метрики в формате Prometheus (nginx наружу не проксирует, доступны только из сети compose)"""
+    return Response(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/test')
 @log_function_call
 def test():
@@ -0,0 +1,186 @@
+"""ASGI-режим бэкенда (SERVER_MODE=asgi).
+
+Те же маршруты app.py, но соединения обслуживает цикл событий uvicorn, а не
+синхронный воркер gunicorn:
+
+- тело запроса читается в цикле событий и складывается во временный файл,
+  поэтому медленная загрузка не занимает поток, пока байты идут по сети;
+- обработчик Flask выполняется в пуле потоков (ASGI_THREADS на процесс) —
+  файловый ввод-вывод, Pillow (при IMAGE_WORKERS=0) и прочая синхронная
+  работа не блокируют цикл событий и идут параллельно;
+- ответ отдается по мере готовности кусков (SSE, файлы) блоками
+  ASGI_FILE_BLOCK байт.
+
+SMTP и тяжелая обработка изображений и так выполняются вне запроса: фоновым
+потоком очереди писем и пулом процессов image_jobs.
+
+Запуск: gunicorn -c gunicorn.conf.py при SERVER_MODE=asgi или
+uvicorn asgi:app --port 5000.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import sys
+import threading
+from tempfile import SpooledTemporaryFile
+
+from app import app as flask_app
+
+logger = logging.getLogger(__name__)
+
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', '32'))
+BODY_SPOOL_SIZE = 1024 * 1024  # тело больше этого размера уходит на диск
+FILE_BLOCK_SIZE = int(os.getenv('ASGI_FILE_BLOCK', str(256 * 1024)))
+
+
+class _FileWrapper:
+    """wsgi.file_wrapper: файл отдается крупными блоками (у werkzeug по умолчанию 8 КБ)"""
+
+    def __init__(self, file, block_size=FILE_BLOCK_SIZE):
+        self.file = file
+        self.block_size = max(block_size, FILE_BLOCK_SIZE)
+
+    def __iter__(self):
+        while True:
+            data = self.file.read(self.block_size)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self.file.close()
+
+
+class WsgiAdapter:
+    """ASGI-приложение поверх WSGI-приложения с пулом потоков.
+
+    Args:
+        wsgi_app: WSGI-приложение (Flask).
+        threads: Сколько запросов процесса обрабатываются одновременно.
+    """
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            if scope['type'] == 'websocket':
+                await send({'type': 'websocket.close', 'code': 1003})
+            return
+
+        body = SpooledTemporaryFile(max_size=BODY_SPOOL_SIZE)
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            disconnected = threading.Event()
+            watcher = asyncio.ensure_future(self._watch_disconnect(receive, disconnected))
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(self.executor, self._run, scope, body, send, loop, disconnected)
+            finally:
+                watcher.cancel()
+        finally:
+            body.close()
+
+    @staticmethod
+    async def _watch_disconnect(receive, disconnected):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    def _environ(scope, body):
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'SERVER_NAME': scope['server'][0] if scope.get('server') else 'localhost',
+            'SERVER_PORT': str(scope['server'][1]) if scope.get('server') else '80',
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            # Тело уже целиком прочитано: werkzeug может читать до конца и без Content-Length (chunked)
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': _FileWrapper,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f'HTTP_{name}'
+            value = value.decode('latin-1')
+            environ[name] = f'{environ[name]},{value}' if name in environ else value
+        return environ
+
+    def _run(self, scope, body, send, loop, disconnected):
+        """Выполняется в потоке пула: вызывает Flask и пересылает ответ в цикл событий"""
+        def forward(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response_start.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_start['message'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            }
+            return lambda data: None  # write() не используется Flask
+
+        try:
+            result = self.wsgi_app(self._environ(scope, body), start_response)
+        except Exception:
+            logger.exception("[ASGI] Необработанная ошибка приложения")
+            forward({'type': 'http.response.start', 'status': 500, 'headers': []})
+            forward({'type': 'http.response.body'})
+            return
+        try:
+            for chunk in result:
+                if disconnected.is_set():
+                    # Клиент ушел (например, закрыл поток SSE) — дальше генерировать незачем
+                    return
+                if not response_start.get('sent'):
+                    response_start['sent'] = True
+                    forward(response_start['message'])
+                if chunk:
+                    forward({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not response_start.get('sent'):
+                forward(response_start['message'])
+            forward({'type': 'http.response.body'})
+        except OSError as e:
+            logger.info(f"[ASGI] Ответ прерван: {e}")
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+app = WsgiAdapter(flask_app)
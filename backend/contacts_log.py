@@ -0,0 +1,248 @@
+"""Журнал заявок с контактной формы в формате JSON Lines.
+
+Каждая заявка — одна строка, записанная одним вызовом write() в файл, открытый
+с O_APPEND, поэтому параллельные воркеры не перетирают записи друг друга, а
+сохранение не зависит от размера истории. Журнал разбит на сегменты
+contacts-00000001.jsonl, contacts-00000002.jsonl, ...: когда текущий сегмент
+превышает лимит размера, следующая запись уходит в новый.
+
+Чтение идет постранично по курсору "<сегмент>:<смещение>", не загружая всю
+историю в память.
+
+Импорт старого contacts.json идемпотентен: хэши перенесенных файлов
+записываются в contacts-imported.json, и повторный запуск их пропускает.
+
+Запуск как скрипта:
+    python contacts_log.py export [--format jsonl|json]   # выгрузка всех заявок
+    python contacts_log.py import [--source data/contacts.json]   # перенос старого contacts.json
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+
+from storage import atomic_write_json, file_lock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+SEGMENT_RE = re.compile(r'^contacts-(\d{8})\.jsonl$')
+IMPORT_MARKER = 'contacts-imported.json'
+
+
+class JsonlContactsStore:
+    """Заявки в сегментированном append-only журнале.
+
+    Args:
+        directory: Папка с сегментами журнала.
+        max_bytes: Размер сегмента, после которого начинается новый.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock_path = os.path.join(directory, 'contacts.jsonl.lock')
+        self.marker_path = os.path.join(directory, IMPORT_MARKER)
+        self._lock = threading.Lock()
+        self._segment = None
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f'contacts-{number:08d}.jsonl')
+
+    def segments(self):
+        """Номера существующих сегментов по возрастанию"""
+        numbers = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                match = SEGMENT_RE.match(entry.name)
+                if match:
+                    numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def _latest_segment(self):
+        numbers = self.segments()
+        return numbers[-1] if numbers else 1
+
+    def _current_segment(self):
+        """Последний сегмент (под lock_path): кэш догоняет ротации других воркеров"""
+        if self._segment is None:
+            self._segment = self._latest_segment()
+        while os.path.exists(self._segment_path(self._segment + 1)):
+            self._segment += 1
+        return self._segment
+
+    def _rotate(self):
+        """Начинает новый сегмент (под lock_path); файл создается сразу, чтобы его видели все воркеры"""
+        self._segment += 1
+        os.close(os.open(self._segment_path(self._segment), os.O_WRONLY | os.O_CREAT, 0o644))
+        logger.info(f"[CONTACT] Новый сегмент журнала заявок: {self._segment_path(self._segment)}")
+
+    def append(self, contact):
+        """Дописывает заявку одной записью в конец последнего сегмента.
+
+        Запись, проверка размера и ротация идут под общей блокировкой воркеров:
+        иначе процесс с устаревшим номером сегмента дописал бы заявку в уже
+        закрытый сегмент, мимо читателей, которые перешли к следующему.
+        """
+        line = (json.dumps(contact, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock, file_lock(self.lock_path):
+            segment = self._current_segment()
+            fd = os.open(self._segment_path(segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            if size >= self.max_bytes:
+                self._rotate()
+
+    def extend(self, contacts):
+        """Дописывает пачку заявок (импорт)"""
+        for contact in contacts:
+            self.append(contact)
+
+    def _imported(self):
+        try:
+            with open(self.marker_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def is_imported(self, source):
+        """Перенесен ли уже файл source (сверяется по хэшу содержимого)"""
+        return _file_digest(source) in self._imported()
+
+    def import_json(self, source):
+        """Переносит заявки из старого contacts.json в журнал один раз.
+
+        Returns:
+            int | None: Сколько заявок перенесено; None, если этот файл уже перенесен.
+        """
+        digest = _file_digest(source)
+        # Отдельный lock-файл: каждый append() берет lock_path
+        with file_lock(os.path.join(self.directory, 'contacts-import.lock')):
+            imported = self._imported()
+            if digest in imported:
+                return None
+            with open(source, 'r', encoding='utf-8') as f:
+                contacts = json.load(f)
+            self.extend(contacts)
+            imported[digest] = {'source': os.path.abspath(source), 'count': len(contacts)}
+            atomic_write_json(self.marker_path, imported)
+        return len(contacts)
+
+    def read_page(self, cursor=None, limit=100):
+        """Возвращает (заявки, следующий курсор). Курсор None — заявок больше нет.
+
+        Raises:
+            ValueError: Если курсор не в формате "<сегмент>:<смещение>" или отрицательный.
+        """
+        segments = self.segments()
+        if not segments:
+            return [], None
+        if cursor:
+            segment, offset = (int(part) for part in cursor.split(':', 1))
+            if segment < 1 or offset < 0:
+                raise ValueError(f"Некорректный курсор: {cursor}")
+        else:
+            segment, offset = segments[0], 0
+
+        records = []
+        while len(records) < limit:
+            try:
+                f = open(self._segment_path(segment), 'rb')
+            except FileNotFoundError:
+                f = None
+            if f is not None:
+                with f:
+                    f.seek(offset)
+                    while len(records) < limit:
+                        line = f.readline()
+                        if not line.endswith(b'\n'):
+                            # Конец сегмента или строка еще дописывается
+                            break
+                        offset += len(line)
+                        try:
+                            records.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            logger.error(f"[CONTACT] Поврежденная строка в сегменте {segment}, смещение {offset}")
+            if len(records) >= limit:
+                break
+            later = [n for n in segments if n > segment]
+            if not later:
+                break
+            segment, offset = later[0], 0
+
+        at_end = segment == segments[-1] and offset >= _file_size(self._segment_path(segment))
+        return records, None if at_end else f'{segment}:{offset}'
+
+    def iter_all(self, page_size=1000):
+        """Генератор всех заявок по порядку, с памятью O(page_size)"""
+        cursor = None
+        while True:
+            records, cursor = self.read_page(cursor, page_size)
+            yield from records
+            if cursor is None:
+                return
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def main(argv=None):
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+    parser = argparse.ArgumentParser(description='Журнал заявок POSTPRESS')
+    parser.add_argument('--dir', default=data_dir, help='папка с сегментами журнала')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export = subparsers.add_parser('export', help='выгрузить все заявки')
+    export.add_argument('--format', choices=('jsonl', 'json'), default='jsonl')
+    export.add_argument('--output', default='-')
+    import_ = subparsers.add_parser('import', help='перенести заявки из contacts.json в журнал')
+    import_.add_argument('--source', default=os.path.join(data_dir, 'contacts.json'))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    store = JsonlContactsStore(args.dir)
+
+    if args.command == 'export':
+        out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+        try:
+            if args.format == 'json':
+                out.write('[')
+            for i, record in enumerate(store.iter_all()):
+                if args.format == 'json':
+                    out.write((',\n' if i else '\n') + json.dumps(record, ensure_ascii=False, indent=2))
+                else:
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            if args.format == 'json':
+                out.write('\n]\n')
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    elif args.command == 'import':
+        count = store.import_json(args.source)
+        if count is None:
+            print(f"{args.source} уже перенесен, пропускаю")
+        else:
+            print(f"Перенесено заявок: {count}")
+
+
+if __name__ == '__main__':
+    main()
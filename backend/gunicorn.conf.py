@@ -0,0 +1,17 @@
+"""Настройки gunicorn.
+
+SERVER_MODE=wsgi (по умолчанию) — синхронные воркеры и app:app, как раньше.
+SERVER_MODE=asgi — воркеры uvicorn и asgi:app: соединения обслуживает цикл
+событий, обработчики идут в пуле из ASGI_THREADS потоков на процесс.
+"""
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_WORKERS', '2'))
+timeout = 120
+
+if os.getenv('SERVER_MODE', 'wsgi').lower() == 'asgi':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'asgi:app'
+else:
+    wsgi_app = 'app:app'
@@ -0,0 +1,335 @@
+"""Фоновая обработка загруженных изображений.
+
+Запрос на загрузку только сохраняет исходные байты и создает задание, а
+декодирование, поворот по EXIF и кодирование JPEG/WebP/AVIF выполняются в
+пуле процессов. Состояние заданий лежит в файлах (data/image_jobs), поэтому
+его видит любой воркер gunicorn: админка может опрашивать задание или
+подписаться на его события (SSE) через любой из них.
+
+Статусы задания: queued (ждет процесса пула) -> processing (процесс пула
+взял его в работу) -> done или failed.
+
+Каждый процесс пула ограничен по памяти (RLIMIT_AS), а каждое задание — по
+числу пикселей, поэтому одна огромная загрузка не может отнять ресурсы у
+остальных. Задания воркера, который завершился, не дождавшись результата,
+подхватываются при следующем запуске.
+"""
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from images import content_base, decode_memory
+from metrics import image_processing_seconds, registry
+from profiling import capture_stages
+from storage import atomic_write_bytes, file_lock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+JOB_TTL = 24 * 3600  # завершенные задания хранятся сутки
+FINISHED_STATUSES = ('done', 'failed')
+
+
+def _init_worker(memory_limit_mb, decode_memory_mb=0):
+    """Инициализация процесса пула: лимит памяти, бюджет на декодирование и логирование"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    decode_memory.limit = decode_memory_mb * 1024 * 1024
+    if memory_limit_mb and resource is not None:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _mark_processing(record_path):
+    """Отмечает задание взятым в работу (в процессе пула, до обработки)"""
+    try:
+        with open(record_path, 'r', encoding='utf-8') as f:
+            job = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    job.update(status='processing', updated_at=datetime.now().isoformat())
+    atomic_write_bytes(record_path, json.dumps(job, ensure_ascii=False).encode('utf-8'))
+
+
+def _run_job(raw_path, base, original_name, mimetype, upload_folder, max_pixels, jpeg_passthrough=None,
+             max_edge=None, record_path=None):
+    """Выполняется в процессе пула; record_path — запись задания, которой выставляется processing"""
+    from images import process_image_file
+    if record_path is not None:
+        _mark_processing(record_path)
+    started = time.perf_counter()
+    try:
+        with capture_stages() as stages:
+            filename, size, variants, meta = process_image_file(raw_path, base, original_name, mimetype,
+                                                                upload_folder, max_pixels, jpeg_passthrough,
+                                                                max_edge)
+    except MemoryError:
+        raise ValueError("Недостаточно памяти для обработки изображения")
+    finally:
+        image_processing_seconds.observe(time.perf_counter() - started, mode='pool')
+        # atexit в процессах пула не вызывается — сбрасываем метрики сразу
+        registry.flush()
+    return {
+        'filename': filename,
+        'size': list(size),
+        'variants': variants,
+        'meta': meta,
+        'processing_ms': round((time.perf_counter() - started) * 1000),
+        'stages': stages,
+    }
+
+
+class ImageJobQueue:
+    """Очередь заданий обработки изображений с пулом процессов.
+
+    Args:
+        directory: Папка заданий (записи и исходные байты).
+        upload_folder: Папка загрузок, куда пишет обработка.
+        workers: Число процессов пула.
+        max_pixels: Бюджет пикселей на одно задание.
+        memory_limit_mb: Лимит адресного пространства процесса пула.
+        on_done: Вызывается в родительском процессе с (job, result) после
+            обработки; возвращает текст ошибки или None.
+        jpeg_passthrough: Пределы JPEG, которые сохраняются без перекодирования
+            (см. process_image_file), или None.
+        max_edge: Предел длинной стороны мастер-файла или None.
+        decode_memory_mb: Бюджет памяти на декодирование в процессе пула
+            (images.DecodeMemory), 0 — без ограничения.
+    """
+
+    def __init__(self, directory, upload_folder, workers, max_pixels, memory_limit_mb, on_done,
+                 jpeg_passthrough=None, max_edge=None, decode_memory_mb=0):
+        self.directory = directory
+        self.upload_folder = upload_folder
+        self.workers = workers
+        self.max_pixels = max_pixels
+        self.memory_limit_mb = memory_limit_mb
+        self.on_done = on_done
+        self.jpeg_passthrough = jpeg_passthrough
+        self.max_edge = max_edge
+        self.decode_memory_mb = decode_memory_mb
+        self.owner = uuid.uuid4().hex
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._owner_lock_file = None
+
+    # ---- записи заданий ----
+
+    def _record_path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def raw_path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.raw')
+
+    def get(self, job_id):
+        """Текущее состояние задания или None"""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._record_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save(self, job):
+        job['updated_at'] = datetime.now().isoformat()
+        atomic_write_bytes(self._record_path(job['id']), json.dumps(job, ensure_ascii=False).encode('utf-8'))
+
+    # ---- жизненный цикл ----
+
+    def start(self):
+        """Регистрирует процесс владельцем заданий и подхватывает брошенные задания"""
+        os.makedirs(self.directory, exist_ok=True)
+        owners = os.path.join(self.directory, 'owners')
+        os.makedirs(owners, exist_ok=True)
+        # Блокировка держится, пока жив процесс: по ней другие видят, что владелец жив
+        self._owner_lock_file = open(os.path.join(owners, f'{self.owner}.lock'), 'a')
+        if fcntl is not None:
+            fcntl.flock(self._owner_lock_file.fileno(), fcntl.LOCK_EX)
+        self.recover()
+
+    def _pool_executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: процессы пула не наследуют потоки и соединения воркера
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.memory_limit_mb, self.decode_memory_mb),
+                )
+            return self._pool
+
+    def _reset_pool(self):
+        # Процесс пула убит (например, OOM) — пересоздадим пул для следующих заданий
+        with self._pool_lock:
+            self._pool = None
+
+    def process_many(self, uploads):
+        """Обрабатывает несколько загрузок параллельно в пуле и ждет все результаты.
+
+        В отличие от submit, задания не записываются на диск: вызывающий сам
+        привязывает результаты к работе (одной записью в хранилище).
+
+        Args:
+            uploads: [(путь к исходным байтам, имя по содержимому, исходное имя, MIME), ...].
+
+        Returns:
+            list: Для каждой загрузки в том же порядке — словарь результата
+            (как у задания) или исключение.
+        """
+        pool = self._pool_executor()
+        futures = [pool.submit(_run_job, raw_path, base, original_name, mimetype,
+                               self.upload_folder, self.max_pixels, self.jpeg_passthrough, self.max_edge)
+                   for raw_path, base, original_name, mimetype in uploads]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except concurrent.futures.process.BrokenProcessPool:
+                self._reset_pool()
+                results.append(ValueError('Процесс обработки аварийно завершился'))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def submit(self, work_id, raw_path, original_name, mimetype, size, sha256):
+        """Забирает записанную на диск загрузку в папку заданий и ставит задание в очередь"""
+        job_id = uuid.uuid4().hex
+        os.replace(raw_path, self.raw_path(job_id))
+        job = {
+            'id': job_id,
+            'work_id': work_id,
+            'status': 'queued',
+            'original_filename': original_name,
+            'mimetype': mimetype,
+            'size_bytes': size,
+            'sha256': sha256,
+            'owner': self.owner,
+            'created_at': datetime.now().isoformat(),
+        }
+        self._save(job)
+        self._dispatch(job)
+        logger.info(f"[JOBS] Задание {job_id} поставлено в очередь для работы {work_id}")
+        return job
+
+    def _dispatch(self, job):
+        # Сохраняем до отправки в пул: иначе queued может затереть processing из процесса пула
+        job['status'] = 'queued'
+        self._save(job)
+        future = self._pool_executor().submit(
+            _run_job, self.raw_path(job['id']), content_base(job['sha256']), job['original_filename'],
+            job['mimetype'], self.upload_folder, self.max_pixels, self.jpeg_passthrough, self.max_edge,
+            self._record_path(job['id']))
+        future.add_done_callback(lambda f, job=job: self._finished(job, f))
+
+    def _finished(self, job, future):
+        # Вызывается потоком пула: исключение здесь никто не увидит, а задание осталось бы
+        # в processing навсегда — поэтому запись и уборка выполняются в любом случае
+        try:
+            result = future.result()
+            error = self.on_done(job, result)
+            if error:
+                job.update(status='failed', error=error)
+            else:
+                job.update(status='done', result=result)
+        except concurrent.futures.process.BrokenProcessPool:
+            self._reset_pool()
+            job.update(status='failed', error='Процесс обработки аварийно завершился')
+        except Exception as e:
+            if future.exception() is None:
+                logger.exception(f"[JOBS] Задание {job['id']}: ошибка привязки результата")
+            job.update(status='failed', error=str(e))
+        finally:
+            try:
+                self._save(job)
+            finally:
+                try:
+                    os.remove(self.raw_path(job['id']))
+                except FileNotFoundError:
+                    pass
+        logger.info(f"[JOBS] Задание {job['id']}: {job['status']} {job.get('error', '')}")
+
+    def pending(self):
+        """Число заданий, которые ждут или проходят обработку"""
+        try:
+            return sum(1 for name in os.listdir(self.directory) if name.endswith('.raw'))
+        except FileNotFoundError:
+            return 0
+
+    def _owner_alive(self, owner):
+        if owner == self.owner:
+            return True
+        if fcntl is None:
+            return False
+        path = os.path.join(self.directory, 'owners', f'{owner}.lock')
+        try:
+            with open(path, 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return True
+        os.remove(path)
+        return False
+
+    def recover(self):
+        """Подхватывает незавершенные задания умерших процессов и чистит старые"""
+        now = time.time()
+        # Под блокировкой, чтобы два стартующих воркера не взяли одно задание
+        with file_lock(os.path.join(self.directory, 'recover.lock')):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    self._recover_job(name[:-5], now)
+
+    def _recover_job(self, job_id, now):
+        job = self.get(job_id)
+        if job is None:
+            return
+        if job['status'] in FINISHED_STATUSES:
+            if now - os.path.getmtime(self._record_path(job_id)) > JOB_TTL:
+                os.remove(self._record_path(job_id))
+            return
+        if self._owner_alive(job.get('owner')):
+            return
+        if not os.path.exists(self.raw_path(job_id)):
+            job.update(status='failed', error='Исходный файл задания потерян')
+            self._save(job)
+            return
+        logger.info(f"[JOBS] Подхватываем брошенное задание {job_id}")
+        job['owner'] = self.owner
+        self._dispatch(job)
+
+    def events(self, job_id, poll_interval=0.5, timeout=60):
+        """Генератор SSE-событий об изменении задания до его завершения.
+
+        Поток ограничен timeout секундами, чтобы не упереться в таймаут воркера
+        gunicorn; EventSource на клиенте сам переподключится.
+        """
+        deadline = time.monotonic() + timeout
+        last = None
+        while time.monotonic() < deadline:
+            job = self.get(job_id)
+            if job is None:
+                yield 'event: error\ndata: {"error": "Задание не найдено"}\n\n'
+                return
+            if job.get('updated_at') != last:
+                last = job.get('updated_at')
+                yield f"data: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if job['status'] in FINISHED_STATUSES:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,1076 @@
+"""Обработка загруженных изображений.
+
+process_image_file() декодирует загрузку, поворачивает по EXIF, сохраняет
+мастер-файл в JPEG и создает производные версии. Модуль не зависит от Flask,
+поэтому его можно вызывать и в запросе, и в отдельном процессе (image_jobs.py).
+JPEG разумного размера не перекодируются: исходные байты становятся мастером
+(без EXIF, с поворотом без потерь через jpegtran), а версии строятся по
+уменьшенному декодированию — это быстрее и без потери качества поколения.
+
+Мастер не больше max_edge по длинной стороне, и огромный оригинал по
+возможности декодируется сразу уменьшенным (fit_pixel_budget()). Пиковая
+память обработки оценивается заранее и резервируется в бюджете процесса
+(decode_memory): загрузки сверх бюджета ждут очереди, а не влезающие в него
+даже поодиночке отклоняются до декодирования.
+
+Для каждой загрузки рядом с мастер-файлом создаются уменьшенные копии под
+разные места на сайте (миниатюра, карточка портфолио, лайтбокс) в JPEG, а
+также в WebP и AVIF, если Pillow умеет их кодировать. Список версий хранится в
+метаданных работы (image_info) и отдается в /api/works, чтобы фронтенд мог
+собрать srcset/<picture> и не скачивать оригиналы ради карточек. Там же
+лежат метаданные мастер-файла (METADATA_KEYS): размеры, формат, размер в
+байтах, SHA-256, преобладающий цвет и крошечная заглушка (LQIP, data: URI в
+пару сотен байт) — клиент размечает сетку и показывает заглушку, не скачивая
+само изображение. Для загрузок, сделанных до появления метаданных, их
+досчитывает команда backfill.
+
+Имена файлов адресуются содержимым: первые 32 hex-символа SHA-256 исходной
+загрузки (<hash>.jpg, <hash>_card.webp, ...). Повторная загрузка тех же байт
+получает то же имя, поэтому её можно не обрабатывать, а браузеры и CDN
+делят кэш между работами. Файл удаляется, только когда на него не осталось
+ссылок ни из одной работы.
+
+Запуск как скрипта:
+    python images.py dedupe [--dry-run]   # перевести uploads/ на имена по содержимому
+    python images.py backfill [--workers N] [--force] [--dry-run]   # досчитать метаданные
+    python images.py bench [папка с фото]   # CPU и байты: перекодирование JPEG против сохранения как есть
+    python images.py budget-check   # большой JPEG 2000 проходит бюджет памяти уменьшенным
+"""
+import argparse
+import base64
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+from PIL import Image, ImageOps, ImageFile, features
+
+from metrics import image_decode_seconds
+from profiling import stage
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = 85  # Оптимальное качество для веба
+JPEG_DRAFT_SCALES = (1, 2, 4, 8)  # во сколько раз libjpeg умеет уменьшать при декодировании
+JPEG2000_REDUCE_LEVELS = 3  # уровни reduce JPEG 2000 (OpenJPEG по умолчанию пишет 5 уровней разложения)
+CODEC_BUFFER_BYTES = {'HEIF': 3, 'AVIF': 3, 'JPEG2000': 12}  # свой буфер кодека на пиксель: pillow-heif, int32 OpenJPEG
+DECODE_WAIT_TIMEOUT = 60  # сколько секунд загрузка ждет памяти под обработку
+CONTENT_NAME_LENGTH = 32  # hex-символов SHA-256 в имени файла
+PLACEHOLDER_EDGE = 16  # длинная сторона заглушки LQIP в px
+COLOR_SAMPLE_EDGE = 64  # по копии такого размера считаются цвет и заглушка
+DOMINANT_COLORS = 5  # на сколько цветов квантуется копия при поиске преобладающего
+EXIF_ORIENTATION = 0x0112
+# Как привести изображение к нормальной ориентации (как в ImageOps.exif_transpose)
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+# Сегменты JPEG, которые вырезаются из мастер-файла без перекодирования: (маркер, начало данных)
+JPEG_METADATA_SEGMENTS = (
+    (0xE1, b''),  # APP1: EXIF и XMP
+    (0xED, b''),  # APP13: Photoshop/IPTC
+    (0xFE, b''),  # COM: комментарий
+    (0xE2, b'MPF\x00'),  # APP2 MPF: оглавление кадров MPO (ICC_PROFILE в APP2 остается)
+)
+JPEGTRAN = shutil.which('jpegtran')  # поворот JPEG без потерь (libjpeg-turbo-progs), необязателен
+# Аргументы jpegtran для ориентации EXIF (как EXIF_TRANSPOSE)
+JPEGTRAN_OPTIONS = {
+    2: ('-flip', 'horizontal'),
+    3: ('-rotate', '180'),
+    4: ('-flip', 'vertical'),
+    5: ('-transpose',),
+    6: ('-rotate', '90'),
+    7: ('-transverse',),
+    8: ('-rotate', '270'),
+}
+# Метаданные изображения в image_info помимо списка версий
+METADATA_KEYS = ('width', 'height', 'format', 'bytes', 'sha256', 'color', 'placeholder')
+
+# Ширины производных версий: (метка, ширина в px)
+DERIVATIVE_WIDTHS = (
+    ('lightbox', 1600),
+    ('card', 800),
+    ('thumb', 400),
+)
+
+# Параметры кодирования по форматам: (формат Pillow, расширение, параметры save)
+DERIVATIVE_FORMATS = (
+    ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    ('AVIF', 'avif', {'quality': 60, 'speed': 6}),
+)
+
+
+def available_formats():
+    """Форматы производных версий, которые поддерживает текущая сборка Pillow"""
+    Image.init()
+    return [fmt for fmt in DERIVATIVE_FORMATS if fmt[0] in Image.SAVE]
+
+
+def derivative_name(base, label, ext):
+    return f"{base}_{label}.{ext}"
+
+
+def content_base(sha256):
+    """Имя файла без расширения для содержимого с данным SHA-256"""
+    return sha256[:CONTENT_NAME_LENGTH]
+
+
+def fallback_extension(original_name, mimetype):
+    """Расширение для файла, сохраненного без декодирования"""
+    ext = (original_name or '').rsplit('.', 1)[-1].lower() if '.' in (original_name or '') else ''
+    if not ext:
+        guessed = mimetypes.guess_extension(mimetype or '') or '.bin'
+        ext = guessed.lstrip('.')
+    if len(ext) > 8:
+        ext = 'bin'
+    return ext
+
+
+def candidate_names(sha256, original_name, mimetype):
+    """Имена, под которыми могла быть сохранена загрузка с таким содержимым"""
+    base = content_base(sha256)
+    return [f"{base}.jpg", f"{base}.{fallback_extension(original_name, mimetype)}"]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _save_atomic(folder, filename, write):
+    """Пишет файл через временное имя и rename.
+
+    Одинаковое содержимое может обрабатываться двумя воркерами одновременно —
+    оба пишут под одним именем, и читатель не должен увидеть недописанный файл.
+    """
+    tmp_path = os.path.join(folder, f".{filename}.{uuid.uuid4().hex}.tmp")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, os.path.join(folder, filename))
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+def create_derivatives(img, base, folder):
+    """Создает уменьшенные версии изображения во всех доступных форматах.
+
+    Args:
+        img: Декодированное RGB-изображение (уже повернутое по EXIF).
+        base: Имя мастер-файла без расширения.
+        folder: Папка для сохранения.
+
+    Returns:
+        list[dict]: Версии от большей к меньшей: label, width, height и имя файла
+        для каждого формата (ключи jpg, webp, avif).
+    """
+    formats = available_formats()
+    variants = []
+    source = img
+    seen_widths = set()
+    for label, target_width in DERIVATIVE_WIDTHS:
+        width = min(target_width, img.width)
+        if width in seen_widths:
+            # Оригинал уже меньше этой ширины — такая версия есть
+            continue
+        seen_widths.add(width)
+        height = max(1, round(img.height * width / img.width))
+        # Каждую следующую версию уменьшаем из предыдущей — так заметно быстрее
+        if (width, height) != source.size:
+            with stage(f'resize_{label}'):
+                source = source.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+
+        variant = {'label': label, 'width': width, 'height': height}
+        for pil_format, ext, params in formats:
+            filename = derivative_name(base, label, ext)
+            try:
+                with stage(f'encode_{label}_{ext}'):
+                    _save_atomic(folder, filename, lambda path: source.save(path, format=pil_format, **params))
+            except Exception as e:
+                logger.warning(f"[IMAGES] Не удалось сохранить {filename}: {e}")
+                continue
+            variant[ext] = filename
+        variants.append(variant)
+        logger.info(f"[IMAGES] Версия {label}: {width}x{height}, форматы: {[k for k in variant if k in ('jpg', 'webp', 'avif')]}")
+    return variants
+
+
+def shrink(img, edge):
+    """Копия не больше edge px по длинной стороне (или само изображение, если оно меньше)"""
+    scale = edge / max(img.size)
+    if scale >= 1:
+        return img
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    # reducing_gap: сначала быстрое целочисленное уменьшение, поэтому большой мастер не замедляет
+    return img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+def make_placeholder(img):
+    """Заглушка LQIP: копия шириной в PLACEHOLDER_EDGE px как data: URI (WebP или JPEG)"""
+    small = shrink(img, PLACEHOLDER_EDGE)
+    if any(fmt[0] == 'WEBP' for fmt in available_formats()):
+        pil_format, mimetype, params = 'WEBP', 'image/webp', {'quality': 40}
+    else:
+        pil_format, mimetype, params = 'JPEG', 'image/jpeg', {'quality': 40, 'optimize': True}
+    buf = io.BytesIO()
+    small.save(buf, format=pil_format, **params)
+    return f"data:{mimetype};base64,{base64.b64encode(buf.getvalue()).decode('ascii')}"
+
+
+def dominant_color(img):
+    """Преобладающий цвет #rrggbb: самый частый после квантования median cut"""
+    quantized = shrink(img, COLOR_SAMPLE_EDGE).quantize(colors=DOMINANT_COLORS, method=Image.Quantize.MEDIANCUT)
+    _, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def describe_pixels(img):
+    """Метаданные по пикселям RGB-изображения: преобладающий цвет и заглушка"""
+    sample = shrink(img, COLOR_SAMPLE_EDGE)
+    return {'color': dominant_color(sample), 'placeholder': make_placeholder(sample)}
+
+
+def describe_file(path, pil_format):
+    """Метаданные сохраненного файла: формат, размер в байтах и SHA-256"""
+    return {'format': pil_format, 'bytes': os.path.getsize(path), 'sha256': file_sha256(path)}
+
+
+def guess_format(filename):
+    """Формат по расширению — для файлов, которые эта сборка Pillow не открывает"""
+    ext = os.path.splitext(filename)[1].lower()
+    return Image.registered_extensions().get(ext) or ext.lstrip('.').upper() or None
+
+
+def image_metadata(folder, filename):
+    """Все метаданные (METADATA_KEYS) уже сохраненного изображения — для backfill.
+
+    Файлы, которые Pillow не открывает (например, HEIC без pillow-heif),
+    получают только формат по расширению, размер и SHA-256.
+    """
+    path = os.path.join(folder, filename)
+    try:
+        img = Image.open(path)
+    except (OSError, SyntaxError, ValueError):
+        return describe_file(path, guess_format(filename))
+    with img:
+        meta = describe_file(path, img.format)
+        width, height = img.size
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        if orientation in (5, 6, 7, 8):  # поворот на 90°: ширина и высота меняются местами
+            width, height = height, width
+        meta.update(width=width, height=height)
+        # Декодируем сразу уменьшенным, где кодек умеет: для цвета и заглушки хватит копии в 64 px
+        fit_pixel_budget(img, None, COLOR_SAMPLE_EDGE)
+        sample = img.convert('RGB')
+    if orientation in EXIF_TRANSPOSE:
+        sample = sample.transpose(EXIF_TRANSPOSE[orientation])
+    meta.update(describe_pixels(sample))
+    return meta
+
+
+def image_files(filename, info=None):
+    """Все файлы изображения на диске: мастер и производные версии"""
+    files = [filename]
+    for variant in (info or {}).get('variants', []):
+        for _, ext, _ in DERIVATIVE_FORMATS:
+            if variant.get(ext):
+                files.append(variant[ext])
+    return files
+
+
+def remove_image_files(folder, filename, info=None):
+    """Удаляет мастер-файл и все его производные версии"""
+    for name in image_files(filename, info):
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class ImageBudgetError(ValueError):
+    """Изображение превышает допустимый бюджет пикселей"""
+
+
+def configure_pillow():
+    """Общие настройки Pillow: большие и частично поврежденные файлы, HEIC/AVIF"""
+    try:
+        Image.MAX_IMAGE_PIXELS = None
+        ImageFile.LOAD_TRUNCATED_IMAGES = True  # Позволяет открывать частично поврежденные JPEG
+        logger.info("[IMAGES] MAX_IMAGE_PIXELS отключен (разрешены большие изображения)")
+    except Exception as e:
+        logger.warning(f"[IMAGES] Не удалось отключить MAX_IMAGE_PIXELS: {e}")
+
+    # Регистрируем поддержку HEIC/HEIF/AVIF в Pillow, если доступно
+    try:
+        import pillow_heif  # type: ignore
+        pillow_heif.register_heif_opener()
+        if hasattr(pillow_heif, 'register_avif_opener'):
+            pillow_heif.register_avif_opener()
+        logger.info("[IMAGES] pillow-heif зарегистрирован (HEIC/HEIF/AVIF поддерживаются)")
+    except Exception as e:
+        logger.warning(f"[IMAGES] Не удалось зарегистрировать pillow-heif: {e}")
+
+
+def decode_options(img):
+    """Размеры, в которых кодек умеет декодировать открытое изображение дешевле полного.
+
+    JPEG уменьшается при обратном DCT (Image.draft(): в 2/4/8 раз), JPEG 2000 —
+    по уровням вейвлет-разложения (reduce), у пирамидального TIFF уменьшенные
+    копии лежат следующими страницами. Остальные форматы (PNG, WebP, HEIC/AVIF
+    через pillow-heif) декодируются только целиком.
+
+    Returns:
+        list[tuple[tuple[int, int], Callable | None]]: (размер, как его выбрать
+        до load()) от большего к меньшему; первым идет полный размер.
+    """
+    width, height = img.size
+    options = [(img.size, None)]
+    if img.format in ('JPEG', 'MPO') and len(img.tile) == 1:
+        for scale in JPEG_DRAFT_SCALES[1:]:
+            # draft() выбирает наибольший масштаб, при котором результат не меньше запрошенного
+            request = (max(1, width // scale), max(1, height // scale))
+            options.append(((-(-width // scale), -(-height // scale)),
+                            lambda img, request=request: img.draft('RGB', request)))
+    elif img.format == 'JPEG2000':
+        for level in range(1, JPEG2000_REDUCE_LEVELS + 1):
+            power = 1 << level
+            size = (-(-width // power), -(-height // power))  # OpenJPEG округляет вверх
+            options.append((size, lambda img, level=level: setattr(img, 'reduce', level)))
+    elif img.format == 'TIFF' and getattr(img, 'n_frames', 1) > 1:
+        pages = []
+        for page in range(1, img.n_frames):
+            img.seek(page)
+            page_width, page_height = img.size
+            # Уменьшенная копия — та же картинка: меньше и с теми же пропорциями
+            if page_width < width and abs(page_width * height - page_height * width) <= max(width, height):
+                pages.append(((page_width, page_height), lambda img, page=page: img.seek(page)))
+        img.seek(0)
+        options += sorted(pages, key=lambda option: option[0], reverse=True)
+    return options
+
+
+def fit_pixel_budget(img, max_pixels, max_edge=None):
+    """Выбирает самое дешевое декодирование открытого (еще не декодированного) изображения.
+
+    Из decode_options() берется наименьший размер, которого хватает на
+    max_edge по длинной стороне, — так 100-мегапиксельный оригинал не
+    декодируется целиком ради мастера в max_edge px. Размер должен
+    укладываться в бюджет пикселей; если кодек не умеет уменьшать, превышение
+    бюджета означает отказ.
+
+    Args:
+        img: Открытое изображение, к нему применяется выбранное уменьшение.
+        max_pixels: Максимум пикселей после декодирования или None.
+        max_edge: Нужная длинная сторона в px или None — тогда декодируется
+            наибольший размер в пределах бюджета.
+
+    Returns:
+        tuple[int, int]: Размер после декодирования. У JPEG 2000 img.size
+        меняется только при load(), поэтому оценивать память нужно по нему.
+
+    Raises:
+        ImageBudgetError: Если изображение не удается уложить в бюджет.
+    """
+    options = [option for option in decode_options(img)
+               if not max_pixels or option[0][0] * option[0][1] <= max_pixels]
+    if not options:
+        raise ImageBudgetError(
+            f"Изображение слишком большое: {img.width}x{img.height} "
+            f"(максимум {max_pixels / 1_000_000:.0f} Мп)")
+    covering = [option for option in options if max_edge and max(option[0]) >= max_edge]
+    size, select = covering[-1] if covering else options[0]
+    if select is not None:
+        original = img.size
+        select(img)
+        logger.info(f"[UPLOAD] {img.format} {original[0]}x{original[1]} декодируется в {size[0]}x{size[1]}")
+    return size
+
+
+def memory_estimate(img, size=None):
+    """Оценка пиковой памяти на обработку изображения после fit_pixel_budget(), байт.
+
+    Декодированный буфер (и буфер кодека, если он декодирует в свой), плюс
+    копия в RGB или после поворота — Pillow хранит RGB по 4 байта на пиксель.
+    size — размер после декодирования (результат fit_pixel_budget()), по
+    умолчанию img.size.
+    """
+    width, height = size or img.size
+    pixels = width * height
+    mode_bytes = 1 if img.mode in ('1', 'L', 'P') else 2 if img.mode.startswith('I;16') else 4
+    return pixels * (mode_bytes + CODEC_BUFFER_BYTES.get(img.format, 0) + 4)
+
+
+class DecodeMemory:
+    """Бюджет памяти процесса на одновременную обработку изображений.
+
+    Перед декодированием обработка резервирует оценку пиковой памяти
+    (memory_estimate()). Если бюджет занят другими загрузками, она ждет
+    очереди; изображение, которое не влезает в бюджет даже одно, отклоняется
+    сразу — вместо того чтобы процесс убил OOM.
+
+    Args:
+        limit: Бюджет в байтах, 0 — без ограничения.
+        timeout: Сколько секунд ждать очереди, прежде чем отказать.
+    """
+
+    def __init__(self, limit=0, timeout=DECODE_WAIT_TIMEOUT):
+        self.limit = limit
+        self.timeout = timeout
+        self.used = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, nbytes):
+        """Держит nbytes бюджета на время блока.
+
+        Raises:
+            ImageBudgetError: Если nbytes больше бюджета или очередь не дошла за timeout.
+        """
+        if not self.limit:
+            yield
+            return
+        if nbytes > self.limit:
+            raise ImageBudgetError(
+                f"Для обработки нужно около {nbytes >> 20} МБ памяти (бюджет {self.limit >> 20} МБ)")
+        with self._cond:
+            if self.used + nbytes > self.limit:
+                logger.info(f"[UPLOAD] Ждем память: нужно {nbytes >> 20} МБ, занято {self.used >> 20} "
+                            f"из {self.limit >> 20} МБ")
+            if not self._cond.wait_for(lambda: self.used + nbytes <= self.limit, timeout=self.timeout):
+                raise ImageBudgetError("Сервер занят обработкой других изображений, повторите загрузку позже")
+            self.used += nbytes
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.used -= nbytes
+                self._cond.notify_all()
+
+
+decode_memory = DecodeMemory()  # бюджет процесса; задается через decode_memory.limit
+
+
+def strip_jpeg_metadata(data):
+    """Байты JPEG без сегментов метаданных (JPEG_METADATA_SEGMENTS) — без перекодирования.
+
+    Сжатые данные копируются как есть до первого EOI: все, что дописано после
+    (вторые кадры MPO, хвосты камер), отбрасывается.
+
+    Returns:
+        bytes | None: Очищенный файл или None, если структура не разобрана
+        (например, файл обрезан).
+    """
+    if data[:2] != b'\xff\xd8':
+        return None
+    parts = [data[:2]]
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # байты-заполнители перед маркером
+            pos += 1
+            continue
+        if marker == 0xDA:  # SOS: дальше сжатые данные, внутри них 0xFFD9 встретиться не может
+            end = data.find(b'\xff\xd9', pos)
+            if end < 0:
+                return None
+            parts.append(data[pos:end + 2])
+            return b''.join(parts)
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # маркеры без длины
+            parts.append(data[pos:pos + 2])
+            pos += 2
+            continue
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+        payload = data[pos + 4:end]
+        if not any(marker == m and payload.startswith(prefix) for m, prefix in JPEG_METADATA_SEGMENTS):
+            parts.append(data[pos:end])
+        pos = end
+    return None
+
+
+def jpegtran_transpose(data, orientation):
+    """Поворачивает JPEG по EXIF без перекодирования через jpegtran.
+
+    Returns:
+        bytes | None: Повернутый файл или None, если jpegtran не установлен или
+        поворот без потерь невозможен (размер не кратен блоку MCU).
+    """
+    if JPEGTRAN is None:
+        return None
+    try:
+        result = subprocess.run([JPEGTRAN, '-copy', 'all', '-perfect', *JPEGTRAN_OPTIONS[orientation]],
+                                input=data, capture_output=True, timeout=60)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"[UPLOAD] jpegtran не отработал: {e}")
+        return None
+    if result.returncode != 0:
+        logger.info(f"[UPLOAD] Поворот без потерь невозможен: {result.stderr.decode(errors='replace').strip()}")
+        return None
+    return result.stdout
+
+
+def kept_jpeg_master(img, path, data_size, jpeg_passthrough):
+    """Мастер-файл из исходного JPEG без перекодирования, если загрузка подходит.
+
+    Подходит JPEG в RGB или оттенках серого не больше заданных размера файла и
+    длинной стороны. Ориентация по EXIF применяется без потерь (jpegtran), а
+    EXIF, XMP и IPTC вырезаются — как и при перекодировании, в мастер не
+    попадают геометки и данные камеры. ICC-профиль сохраняется.
+
+    Args:
+        img: Открытое, еще не декодированное изображение.
+        path: Путь к исходным байтам.
+        data_size: Размер исходного файла в байтах.
+        jpeg_passthrough: (макс. байт, макс. длинная сторона в px).
+
+    Returns:
+        bytes | None: Байты мастер-файла или None — тогда загрузка перекодируется.
+    """
+    max_bytes, max_edge = jpeg_passthrough
+    if img.format not in ('JPEG', 'MPO') or img.mode not in ('RGB', 'L'):
+        return None
+    if data_size > max_bytes or max(img.size) > max_edge:
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+    if orientation in JPEGTRAN_OPTIONS:
+        data = jpegtran_transpose(data, orientation)
+        if data is None:
+            return None
+    return strip_jpeg_metadata(data)
+
+
+def _ingest_kept_jpeg(img, master, base, folder):
+    """Сохраняет исходный JPEG мастером и строит версии по уменьшенному декодированию.
+
+    Полноразмерные пиксели не нужны: самая большая версия — DERIVATIVE_WIDTHS[0],
+    поэтому libjpeg декодирует сразу в 2/4/8 раз меньше (Image.draft()).
+    """
+    orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+    width, height = img.size
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+
+    filename = f"{base}.jpg"
+    filepath = os.path.join(folder, filename)
+    with stage('keep_master'):
+        _save_atomic(folder, filename, lambda tmp: _write_bytes(tmp, master))
+    logger.info(f"[UPLOAD] JPEG сохранен без перекодирования: {filepath}, {len(master)} байт")
+
+    largest = max(target for _, target in DERIVATIVE_WIDTHS)
+    if width > largest:
+        scale = largest / width
+        img.draft('RGB', (-(-img.width * largest // width), -(-img.height * largest // width)))
+        logger.info(f"[UPLOAD] Для версий JPEG декодируется в {img.size[0]}x{img.size[1]} (масштаб {scale:.2f})")
+    with decode_memory.reserve(memory_estimate(img)):
+        with stage('decode'), image_decode_seconds.time(format=img.format):
+            img.load()
+        pixels = img.transpose(EXIF_TRANSPOSE[orientation]) if orientation in EXIF_TRANSPOSE else img
+        if pixels.mode != 'RGB':
+            with stage('convert_rgb'):
+                pixels = pixels.convert('RGB')
+
+        try:
+            variants = create_derivatives(pixels, base, folder)
+        except Exception as e:
+            logger.warning(f"[UPLOAD] Не удалось создать уменьшенные версии: {e}")
+            variants = []
+
+        with stage('describe'):
+            meta = describe_file(filepath, 'JPEG')
+            try:
+                meta.update(describe_pixels(pixels))
+            except Exception as e:
+                logger.warning(f"[UPLOAD] Не удалось посчитать цвет и заглушку: {e}")
+        return filename, (width, height), variants, meta
+
+
+def _write_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _ingest_decoded(img, base, folder, max_edge=None):
+    """Декодирует изображение, перекодирует мастер в JPEG и строит версии"""
+    with stage('decode'), image_decode_seconds.time(format=img.format or 'unknown'):
+        img.load()
+
+    # Поворот по EXIF на месте, без второй копии буфера
+    try:
+        with stage('exif_transpose'):
+            ImageOps.exif_transpose(img, in_place=True)
+        logger.info("[UPLOAD] EXIF поворот применен")
+    except Exception as e:
+        logger.warning(f"[UPLOAD] Не удалось применить EXIF поворот: {e}")
+
+    # Конвертация в RGB; исходный буфер освобождаем сразу
+    if img.mode != "RGB":
+        logger.info(f"[UPLOAD] Конвертация из {img.mode} в RGB")
+        with stage('convert_rgb'):
+            rgb = img.convert("RGB")
+        img.close()
+        img = rgb
+
+    # Мастер не больше max_edge по длинной стороне
+    if max_edge and max(img.size) > max_edge:
+        with stage('resize_master'):
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS, reducing_gap=3.0)
+
+    width, height = img.size
+    logger.info(f"[UPLOAD] Финальный размер: {width}x{height}")
+
+    filename = f"{base}.jpg"
+    filepath = os.path.join(folder, filename)
+    logger.info(f"[UPLOAD] Сохранение в: {filepath}")
+
+    # Сохранение
+    with stage('save_master'):
+        _save_atomic(folder, filename,
+                     lambda tmp: img.save(tmp, format="JPEG", quality=JPEG_QUALITY, optimize=True))
+    file_size = os.path.getsize(filepath)
+    logger.info(f"[UPLOAD] Файл сохранен, размер на диске: {file_size} байт")
+
+    # Уменьшенные версии для карточек и лайтбокса (не критично)
+    try:
+        variants = create_derivatives(img, base, folder)
+    except Exception as e:
+        logger.warning(f"[UPLOAD] Не удалось создать уменьшенные версии: {e}")
+        variants = []
+
+    with stage('describe'):
+        meta = describe_file(filepath, 'JPEG')
+        try:
+            meta.update(describe_pixels(img))
+        except Exception as e:
+            logger.warning(f"[UPLOAD] Не удалось посчитать цвет и заглушку: {e}")
+
+    return filename, (width, height), variants, meta
+
+
+def process_image_file(path, base, original_name, mimetype, folder, max_pixels=None, jpeg_passthrough=None,
+                       max_edge=None):
+    """Обрабатывает загруженный файл и сохраняет результат в папку загрузок.
+
+    Args:
+        path: Путь к исходным байтам загрузки.
+        base: Имя результата без расширения (content_base() от хэша загрузки).
+        original_name: Имя файла у клиента (для расширения в фолбэке).
+        mimetype: Content-Type загрузки (для расширения в фолбэке).
+        folder: Папка загрузок.
+        max_pixels: Максимум пикселей (ширина × высота) после декодирования или
+            None без ограничения (см. fit_pixel_budget()).
+        jpeg_passthrough: (макс. байт, макс. длинная сторона) для JPEG, которые
+            сохраняются мастером без перекодирования (kept_jpeg_master()),
+            или None, чтобы перекодировать все.
+        max_edge: Предел длинной стороны мастер-файла в px или None; больший
+            оригинал по возможности декодируется сразу уменьшенным.
+
+    Returns:
+        tuple[str, tuple[int, int], list[dict], dict]: Имя сохраненного файла,
+        размер (ширина, высота), список производных версий (пустой, если их нет)
+        и метаданные мастер-файла для image_info (см. METADATA_KEYS).
+
+    Raises:
+        ValueError: Если файл пуст.
+        ImageBudgetError: Если изображение больше max_pixels или не влезает в
+            бюджет памяти decode_memory.
+    """
+    data_size = os.path.getsize(path)
+    logger.info(f"[UPLOAD] Обработка {original_name or 'unknown'}: {data_size} байт")
+    if data_size == 0:
+        raise ValueError("Файл пуст")
+    if jpeg_passthrough and max_edge:
+        # Мастер без перекодирования тоже не больше max_edge
+        jpeg_passthrough = (jpeg_passthrough[0], min(jpeg_passthrough[1], max_edge))
+
+    try:
+        # Попытка открыть как изображение (заголовок читается без декодирования)
+        logger.info("[UPLOAD] Попытка открыть как изображение")
+        with stage('open'):
+            img = Image.open(path)
+        with img:
+            logger.info(f"[UPLOAD] Изображение открыто: {img.format}, размер: {img.size}, режим: {img.mode}")
+
+            # Подходящий JPEG уже годится в мастер — не тратим CPU и качество на перекодирование
+            master = kept_jpeg_master(img, path, data_size, jpeg_passthrough) if jpeg_passthrough else None
+            if master is not None:
+                return _ingest_kept_jpeg(img, master, base, folder)
+
+            decoded_size = fit_pixel_budget(img, max_pixels, max_edge)
+            with decode_memory.reserve(memory_estimate(img, decoded_size)):
+                return _ingest_decoded(img, base, folder, max_edge)
+
+    except ImageBudgetError:
+        raise
+    except Exception as exc:
+        # Фолбэк: сохраняем исходные байты без декодирования, чтобы не блокировать загрузку
+        logger.error(f"[UPLOAD] Не удалось обработать изображение Pillow: {type(exc).__name__}: {exc}")
+        try:
+            filename = f"{base}.{fallback_extension(original_name, mimetype)}"
+            filepath = os.path.join(folder, filename)
+            logger.info(f"[UPLOAD] Фолбэк-сохранение оригинальных байт в: {filepath}")
+            _save_atomic(folder, filename, lambda tmp: shutil.copyfile(path, tmp))
+            # Размеры неизвестны, возвращаем (0, 0) и без уменьшенных версий
+            return filename, (0, 0), [], describe_file(filepath, guess_format(filename))
+        except Exception as save_exc:
+            import traceback
+            logger.error(f"[UPLOAD] Фолбэк тоже не удался: {type(save_exc).__name__}: {save_exc}")
+            logger.error(f"[UPLOAD] Трассировка: {traceback.format_exc()}")
+            raise ValueError(f"Ошибка сохранения файла: {save_exc}")
+
+
+def _rename_info(info, new_base):
+    """Метаданные изображения с производными версиями под новым базовым именем"""
+    if not info:
+        return info
+    variants = []
+    for variant in info.get('variants', []):
+        renamed = dict(variant)
+        for _, ext, _ in DERIVATIVE_FORMATS:
+            if variant.get(ext):
+                renamed[ext] = derivative_name(new_base, variant['label'], ext)
+        variants.append(renamed)
+    return dict(info, variants=variants)
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        pass
+    except OSError:
+        _save_atomic(os.path.dirname(dst), os.path.basename(dst), lambda tmp: shutil.copyfile(src, tmp))
+
+
+def dedupe_uploads(store, folder, dry_run=False):
+    """Переводит папку загрузок на имена по содержимому и убирает побайтовые дубликаты.
+
+    Новые имена сначала создаются жесткими ссылками, затем в хранилище
+    сохраняются обновленные работы, и только после этого удаляются старые
+    имена — прерванный запуск оставляет лишние файлы, но не битые ссылки.
+    Запускать при остановленном бэкенде.
+
+    Args:
+        store: Хранилище работ (WorksStore или SqliteWorksStore).
+        folder: Папка загрузок.
+        dry_run: Только посчитать, ничего не менять.
+
+    Returns:
+        dict: Число файлов, переименований, дубликатов и освобождаемых байт.
+    """
+    works = store.snapshot()
+    referenced = {}
+    for work in works:
+        for filename in work.get('images', []):
+            referenced.setdefault(filename, work.get('image_info', {}).get(filename) or {})
+    derived = {name for filename, info in referenced.items() for name in image_files(filename, info)[1:]}
+
+    hashes = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.startswith('.') and entry.name not in derived:
+                hashes[entry.name] = file_sha256(entry.path)
+
+    # Каноническое имя для каждого содержимого; файлы работ обрабатываются первыми
+    sources, renames, infos = {}, {}, {}
+    for name in sorted(hashes, key=lambda n: (n not in referenced, n)):
+        source = sources.setdefault(hashes[name], name)
+        ext = source.rsplit('.', 1)[-1].lower() if '.' in source else 'bin'
+        new_name = renames[name] = f"{content_base(hashes[name])}.{ext}"
+        if source == name:
+            infos[new_name] = _rename_info(referenced.get(name), new_name.rsplit('.', 1)[0])
+
+    stale = [name for name, new_name in renames.items() if name != new_name]
+    duplicates = {name for name in hashes if sources[hashes[name]] != name}
+    stats = {
+        'files': len(hashes),
+        'renamed': len(stale) - len(duplicates),
+        'duplicates': len(duplicates),
+        'bytes_freed': sum(os.path.getsize(os.path.join(folder, name)) for name in duplicates),
+    }
+    if dry_run or not stale:
+        return stats
+
+    # 1. Новые имена — жесткие ссылки на канонический файл и его версии
+    for name in stale:
+        if name in duplicates:
+            continue
+        new_name = renames[name]
+        _link_or_copy(os.path.join(folder, name), os.path.join(folder, new_name))
+        old_files = image_files(name, referenced.get(name))[1:]
+        new_files = image_files(new_name, infos[new_name])[1:]
+        for old_file, new_file in zip(old_files, new_files):
+            if os.path.exists(os.path.join(folder, old_file)):
+                _link_or_copy(os.path.join(folder, old_file), os.path.join(folder, new_file))
+
+    # 2. Работы ссылаются на новые имена
+    for work in works:
+        images, image_info = [], {}
+        for filename in work.get('images', []):
+            new_name = renames.get(filename, filename)
+            if new_name in images:
+                continue
+            images.append(new_name)
+            info = infos[new_name] if new_name in infos else work.get('image_info', {}).get(filename)
+            if info:
+                image_info[new_name] = info
+        work['images'] = images
+        if image_info or 'image_info' in work:
+            work['image_info'] = image_info
+    store.save(works)
+
+    # 3. Старые имена и дубликаты больше не нужны
+    for name in stale:
+        remove_image_files(folder, name, referenced.get(name))
+    logger.info(f"[IMAGES] Дедупликация загрузок: {stats}")
+    return stats
+
+
+def backfill_metadata(store, folder, workers=None, force=False, dry_run=False):
+    """Досчитывает метаданные (METADATA_KEYS) изображений, загруженных без них.
+
+    Файлы читаются параллельно в пуле процессов, а результаты записываются
+    одной операцией store.update_image_info: поля дописываются к image_info,
+    версии не трогаются, работы и изображения, удаленные за время прохода,
+    пропускаются. Поэтому запускать можно на работающем бэкенде.
+
+    Args:
+        store: Хранилище работ (WorksStore или SqliteWorksStore).
+        folder: Папка загрузок.
+        workers: Число процессов (по умолчанию — по числу ядер).
+        force: Пересчитать и для изображений, у которых метаданные уже есть.
+        dry_run: Только посчитать, сколько изображений нужно обработать.
+
+    Returns:
+        dict: Сколько изображений нужно было обработать, обновлено, без файла и с ошибкой.
+    """
+    pending = {}  # имя файла -> id работ, которые на него ссылаются
+    for work in store.snapshot():
+        for filename in work.get('images', []):
+            info = (work.get('image_info') or {}).get(filename) or {}
+            if force or any(key not in info for key in METADATA_KEYS):
+                pending.setdefault(filename, []).append(work['id'])
+    stats = {'images': len(pending), 'updated': 0, 'missing': 0, 'failed': 0}
+    if dry_run or not pending:
+        return stats
+
+    updates = {}  # id работы -> {имя файла: метаданные}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(image_metadata, folder, filename): filename for filename in pending}
+        for future in concurrent.futures.as_completed(futures):
+            filename = futures[future]
+            try:
+                meta = future.result()
+            except FileNotFoundError:
+                logger.warning(f"[IMAGES] {filename}: файла нет в папке загрузок")
+                stats['missing'] += 1
+                continue
+            except Exception as e:
+                logger.warning(f"[IMAGES] {filename}: не удалось посчитать метаданные: {e}")
+                stats['failed'] += 1
+                continue
+            for work_id in pending[filename]:
+                updates.setdefault(work_id, {})[filename] = meta
+            stats['updated'] += 1
+
+    if updates:
+        store.update_image_info(updates)
+    logger.info(f"[IMAGES] Метаданные изображений: {stats}")
+    return stats
+
+
+def synthetic_corpus(folder, count, seed=1):
+    """Корпус «фотографий» для bench: JPEG с телефона и камеры (часть повернута по EXIF) и PNG"""
+    import random
+    rng = random.Random(seed)
+    shapes = (
+        ((4032, 3024), 'JPEG', 92, 1),   # телефон
+        ((3024, 4032), 'JPEG', 90, 6),   # телефон, снято вертикально
+        ((2048, 1365), 'JPEG', 88, 1),   # уже уменьшенное для веба
+        ((6000, 4000), 'JPEG', 95, 1),   # камера — больше предела, перекодируется
+        ((1920, 1080), 'PNG', None, 1),  # скриншот
+    )
+    paths = []
+    for i in range(count):
+        size, pil_format, quality, orientation = shapes[i % len(shapes)]
+        # Плавный фон с шумом разной силы — похоже на фото по сжимаемости
+        gradient = Image.radial_gradient('L').resize(size, Image.BILINEAR)
+        noise = Image.effect_noise(size, rng.uniform(10, 40))
+        img = Image.merge('RGB', (gradient, Image.blend(gradient, noise, 0.3), noise))
+        path = os.path.join(folder, f"photo{i:03d}.{'jpg' if pil_format == 'JPEG' else 'png'}")
+        if pil_format == 'JPEG':
+            exif = Image.Exif()
+            exif[EXIF_ORIENTATION] = orientation
+            img.save(path, format='JPEG', quality=quality, exif=exif.tobytes())
+        else:
+            img.save(path, format=pil_format)
+        paths.append(path)
+    return paths
+
+
+def bench_ingest(paths, jpeg_passthrough, max_pixels=None):
+    """CPU и байты на выходе при обработке корпуса с перекодированием всего и с сохранением JPEG как есть.
+
+    Returns:
+        dict: По режиму (reencode, passthrough) — files, kept (сохранено без
+        перекодирования), cpu_s, master_bytes, derivative_bytes.
+    """
+    import tempfile
+    from profiling import capture_stages
+    results = {}
+    for mode, passthrough in (('reencode', None), ('passthrough', jpeg_passthrough)):
+        stats = {'files': 0, 'kept': 0, 'cpu_s': 0.0, 'master_bytes': 0, 'derivative_bytes': 0}
+        with tempfile.TemporaryDirectory(prefix='ingest-bench-') as folder:
+            for i, path in enumerate(paths):
+                started = time.process_time()
+                with capture_stages() as stages:
+                    filename, _, variants, _ = process_image_file(
+                        path, f'bench{i:04d}', os.path.basename(path), None, folder, max_pixels, passthrough)
+                stats['cpu_s'] += time.process_time() - started
+                stats['files'] += 1
+                stats['kept'] += any(name == 'keep_master' for name, _ in stages)
+                stats['master_bytes'] += os.path.getsize(os.path.join(folder, filename))
+                stats['derivative_bytes'] += sum(os.path.getsize(os.path.join(folder, name))
+                                                 for name in image_files(filename, {'variants': variants})[1:])
+        stats['cpu_s'] = round(stats['cpu_s'], 2)
+        results[mode] = stats
+    return results
+
+
+def main(argv=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(base_dir, 'data')
+
+    parser = argparse.ArgumentParser(description='Обслуживание папки загрузок POSTPRESS')
+    parser.add_argument('--uploads', default=os.path.join(base_dir, 'uploads'))
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default=os.getenv('STORAGE_BACKEND', 'json'))
+    parser.add_argument('--works', default=os.path.join(data_dir, 'works.json'))
+    parser.add_argument('--db', default=os.getenv('SQLITE_PATH', os.path.join(data_dir, 'postpress.db')))
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    dedupe = subparsers.add_parser('dedupe', help='перевести загрузки на имена по содержимому')
+    dedupe.add_argument('--dry-run', action='store_true', help='только показать, что изменится')
+    backfill = subparsers.add_parser('backfill', help='досчитать метаданные изображений (размеры, цвет, заглушка)')
+    backfill.add_argument('--workers', type=int, default=None, help='число процессов (по умолчанию — по числу ядер)')
+    backfill.add_argument('--force', action='store_true', help='пересчитать и для изображений с метаданными')
+    backfill.add_argument('--dry-run', action='store_true', help='только показать, сколько изображений обработать')
+    bench = subparsers.add_parser('bench', help='сравнить обработку загрузок с перекодированием JPEG и без него')
+    bench.add_argument('corpus', nargs='?', help='папка с фотографиями (по умолчанию — синтетический корпус)')
+    bench.add_argument('--synthetic', type=int, default=10, help='размер синтетического корпуса')
+    bench.add_argument('--max-bytes', type=int, default=12 * 1024 * 1024, help='предел JPEG без перекодирования, байт')
+    bench.add_argument('--max-edge', type=int, default=4096, help='предел JPEG без перекодирования, px')
+    budget = subparsers.add_parser('budget-check', help='большой JPEG 2000 проходит бюджет памяти уменьшенным')
+    budget.add_argument('--size', type=int, nargs=2, default=(4000, 3000), metavar=('W', 'H'))
+    budget.add_argument('--max-edge', type=int, default=1000)
+    budget.add_argument('--budget-mb', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        run_bench(args)
+        return
+    if args.command == 'budget-check':
+        result = check_decode_budget(tuple(args.size), args.max_edge, args.budget_mb)
+        print(', '.join(f'{key}={value}' for key, value in result.items()))
+        if not result['ok']:
+            raise SystemExit(1)
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.storage == 'sqlite':
+        from sqlite_storage import SqliteDatabase, SqliteWorksStore
+        store = SqliteWorksStore(SqliteDatabase(args.db))
+    else:
+        from storage import WorksStore
+        store = WorksStore(args.works)
+
+    if args.command == 'dedupe':
+        stats = dedupe_uploads(store, args.uploads, dry_run=args.dry_run)
+        prefix = 'План' if args.dry_run else 'Готово'
+        print(f"{prefix}: файлов {stats['files']}, переименований {stats['renamed']}, "
+              f"дубликатов {stats['duplicates']}, освобождается {stats['bytes_freed']} байт")
+    elif args.command == 'backfill':
+        started = time.perf_counter()
+        stats = backfill_metadata(store, args.uploads, workers=args.workers, force=args.force, dry_run=args.dry_run)
+        if args.dry_run:
+            print(f"План: изображений без метаданных {stats['images']}")
+        else:
+            print(f"Готово за {time.perf_counter() - started:.1f} с: изображений {stats['images']}, "
+                  f"обновлено {stats['updated']}, нет файла {stats['missing']}, ошибок {stats['failed']}")
+
+
+def run_bench(args):
+    import tempfile
+    with tempfile.TemporaryDirectory(prefix='ingest-corpus-') as corpus:
+        if args.corpus:
+            paths = sorted(entry.path for entry in os.scandir(args.corpus) if entry.is_file())
+        else:
+            paths = synthetic_corpus(corpus, args.synthetic)
+        results = bench_ingest(paths, (args.max_bytes, args.max_edge))
+    for mode, stats in results.items():
+        print(f"{mode}: " + ', '.join(f'{key}={value}' for key, value in stats.items()))
+    before, after = results['reencode'], results['passthrough']
+    if before['cpu_s']:
+        print(f"CPU: {after['cpu_s'] / before['cpu_s']:.0%} от перекодирования, "
+              f"мастер-файлы: {after['master_bytes'] / max(1, before['master_bytes']):.0%} по байтам")
+
+
+def check_decode_budget(size, max_edge, budget_mb):
+    """JPEG 2000, который целиком не влезает в бюджет decode_memory, обрабатывается уменьшенным.
+
+    Бюджет резервируется по размеру выбранного уровня reduce, а не по полному
+    размеру из заголовка.
+    """
+    import tempfile
+    if not features.check('jpg_2000'):
+        return {'skipped': 'Pillow собран без OpenJPEG', 'ok': True}
+    with tempfile.TemporaryDirectory(prefix='budget-check-') as directory:
+        path = os.path.join(directory, 'large.jp2')
+        Image.linear_gradient('L').resize(size).convert('RGB').save(path, 'JPEG2000')
+        with Image.open(path) as img:
+            full = memory_estimate(img)
+            decoded = fit_pixel_budget(img, None, max_edge)
+            reduced = memory_estimate(img, decoded)
+        limit = decode_memory.limit
+        decode_memory.limit = budget_mb * 1024 * 1024
+        try:
+            filename, master_size, _, _ = process_image_file(path, 'large', 'large.jp2', 'image/jp2', directory,
+                                                             max_edge=max_edge)
+            error = None
+        except ImageBudgetError as e:
+            filename, master_size, error = None, None, str(e)
+        finally:
+            decode_memory.limit = limit
+    return {
+        'image': f'{size[0]}x{size[1]}',
+        'decoded': f'{decoded[0]}x{decoded[1]}',
+        'full_estimate_mb': full >> 20,
+        'reduced_estimate_mb': reduced >> 20,
+        'budget_mb': budget_mb,
+        'master': f'{master_size[0]}x{master_size[1]}' if master_size else error,
+        'ok': filename is not None and full > budget_mb * 1024 * 1024 and max(master_size) <= max_edge,
+    }
+
+
+configure_pillow()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,605 @@
+"""Сквозные проверки и нагрузочные замеры бэкенда через HTTP.
+
+Каждая команда копирует *.py бэкенда во временную папку (как Dockerfile),
+запускает там gunicorn с пустыми data/ и uploads/ и обращается к нему по
+HTTP, как браузер за nginx. Рабочие data/ и uploads/ не затрагиваются.
+
+Запуск как скрипта:
+    python loadtest.py mail [--smtp-delay 2]   # /api/contact не ждет SMTP, письма доходят
+    python loadtest.py upload-memory [--max-edge 2000]   # пиковая память воркера на большой загрузке
+    python loadtest.py resumable   # загрузка кусками: обрыв, смещение, докачка, побайтное совпадение
+    python loadtest.py logging [--duration 5]   # req/s: LOG_FORMAT=verbose против structured
+    python loadtest.py serving [--slow-uploads 4]   # SERVER_MODE=wsgi против asgi при медленных загрузках
+"""
+import argparse
+import email
+import glob
+import hashlib
+import http.client
+import json
+import os
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_START_TIMEOUT = 60
+ADMIN = {'username': 'admin', 'password': 'loadtest'}
+UPLOAD_MEMORY_SLACK = 32 * 1024 * 1024  # сверх оценки images.memory_estimate(): версии, буферы кодеков
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """Копия бэкенда во временной папке, запущенная под gunicorn.
+
+    Args:
+        env: Переменные окружения поверх текущих (SERVER_MODE, LOG_FORMAT, ...).
+        workers: Сколько воркеров gunicorn.
+        works: Сколько синтетических работ положить в data/works.json до запуска.
+    """
+
+    def __init__(self, env=None, workers=1, works=0):
+        self.env = dict(env or {})
+        self.workers = workers
+        self.works = works
+        self.directory = None
+        self.process = None
+        self.port = None
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix='postpress-loadtest-')
+        for path in glob.glob(os.path.join(BACKEND_DIR, '*.py')):
+            shutil.copy(path, self.directory)
+        if self.works:
+            from storage import atomic_write_json, synthetic_works
+            os.makedirs(self.data_path(), exist_ok=True)
+            atomic_write_json(self.data_path('works.json'), synthetic_works(self.works))
+        self.port = _free_port()
+        env = dict(os.environ, BIND=f'127.0.0.1:{self.port}', WEB_WORKERS=str(self.workers),
+                   IMAGE_WORKERS='0', SMTP_SERVER='127.0.0.1', SMTP_PORT='1',
+                   LOGIN=ADMIN['username'], PASSWORD=ADMIN['password'])
+        env.update(self.env)
+        self._log = open(os.path.join(self.directory, 'server.log'), 'wb')
+        self.process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+                                        cwd=self.directory, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while True:
+            try:
+                if self.request('GET', '/health')[0] == 200:
+                    return self
+            except OSError:
+                pass
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.__exit__(None, None, None)
+                raise RuntimeError(f"Сервер не запустился, см. лог в {self._log.name}")
+            time.sleep(0.2)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self._log.close()
+        if exc_type is None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        else:
+            print(f"Папка сервера сохранена для разбора: {self.directory}", file=sys.stderr)
+        return False
+
+    def worker_pids(self):
+        """PID воркеров gunicorn (дочерних процессов мастера)"""
+        with open(f'/proc/{self.process.pid}/task/{self.process.pid}/children') as f:
+            return [int(pid) for pid in f.read().split()]
+
+    def login(self):
+        """Входит в админку. Returns: заголовки с cookie сессии."""
+        status, headers, body = self.request('POST', '/api/login', ADMIN)
+        if status != 200:
+            raise RuntimeError(f"Вход не удался: {status} {body[:200]!r}")
+        return {'Cookie': headers['Set-Cookie'].split(';', 1)[0]}
+
+    def create_work(self, auth, title='Нагрузочный тест'):
+        status, _, body = self.request('POST', '/api/works', {'title': title}, headers=auth)
+        if status != 201:
+            raise RuntimeError(f"Работа не создана: {status} {body[:200]!r}")
+        return json.loads(body)['id']
+
+    def upload(self, work_id, path, auth, mimetype='image/jpeg'):
+        """POST /api/works/<id>/images: multipart-тело читается с диска кусками"""
+        boundary = uuid.uuid4().hex
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="image"; '
+                f'filename="{os.path.basename(path)}"\r\nContent-Type: {mimetype}\r\n\r\n').encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+        def body():
+            yield head
+            with open(path, 'rb') as f:
+                while chunk := f.read(1024 * 1024):
+                    yield chunk
+            yield tail
+
+        headers = dict(auth, **{'Content-Type': f'multipart/form-data; boundary={boundary}',
+                                'Content-Length': str(len(head) + os.path.getsize(path) + len(tail))})
+        return self.request('POST', f'/api/works/{work_id}/images', body(), headers)
+
+    def data_path(self, *parts):
+        return os.path.join(self.directory, 'data', *parts)
+
+    def connection(self, timeout=60):
+        return http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+
+    def request(self, method, path, body=None, headers=None, conn=None):
+        """Запрос к серверу. Returns: (статус, заголовки, тело)."""
+        own = conn is None
+        conn = conn or self.connection()
+        try:
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body).encode('utf-8')
+                headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.headers, response.read()
+        finally:
+            if own:
+                conn.close()
+
+
+def _p(samples, q):
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 1)
+
+
+def run_load(server, send, concurrency, duration):
+    """Нагрузка из concurrency потоков, каждый со своим keep-alive соединением.
+
+    Args:
+        send: send(server, conn, n) выполняет один запрос и возвращает HTTP-статус.
+
+    Returns:
+        dict: Запросов в секунду, p50/p95 задержки в мс и число ошибок (статус >= 400, сбои).
+    """
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+
+    def client(number):
+        conn = server.connection()
+        n = 0
+        try:
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    status = send(server, conn, number * 1_000_000 + n)
+                except (OSError, http.client.HTTPException) as e:
+                    errors.append(repr(e))
+                    conn.close()
+                    conn = server.connection()
+                    continue
+                latencies.append(time.perf_counter() - started)
+                if status >= 400:
+                    errors.append(status)
+                n += 1
+        finally:
+            conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'req_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': _p(latencies, 0.5) if latencies else None,
+        'p95_ms': _p(latencies, 0.95) if latencies else None,
+        'errors': len(errors),
+    }
+
+
+def get_works(server, conn, n):
+    return server.request('GET', '/api/works', headers={'Accept-Encoding': 'gzip'}, conn=conn)[0]
+
+
+def post_contact(server, conn, n):
+    return server.request('POST', '/api/contact', {
+        'name': f'Клиент {n}', 'phone': f'+7 900 {n % 10_000_000:07d}', 'message': 'Нужна вывеска'}, conn=conn)[0]
+
+
+# ---- локальный SMTP ----
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Минимальный SMTP-сервер, который принимает любые письма с задержкой delay секунд.
+
+    Задержка на приветствии и после DATA изображает медленный почтовый сервер.
+    STARTTLS не поддерживается (SMTP_USE_TLS=false), AUTH PLAIN принимается любой.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay=0.0):
+        super().__init__(('127.0.0.1', 0), _SmtpHandler)
+        self.delay = delay
+        self.messages = []
+        self.connections = 0
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+        return False
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        time.sleep(self.server.delay)
+        self.reply('220 sink ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith('EHLO'):
+                self.wfile.write(b'250-sink\r\n250-AUTH PLAIN\r\n250 8BITMIME\r\n')
+            elif command.startswith('AUTH'):
+                self.reply('235 ok')
+            elif command == 'DATA':
+                self.reply('354 end with .')
+                lines = []
+                while (data := self.rfile.readline()) not in (b'.\r\n', b''):
+                    lines.append(data[1:] if data.startswith(b'..') else data)
+                time.sleep(self.server.delay)
+                self.server.messages.append(email.message_from_bytes(b''.join(lines)))
+                self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+def _message_text(message):
+    return ''.join(part.get_payload(decode=True).decode('utf-8')
+                   for part in message.walk() if part.get_content_type() == 'text/plain')
+
+
+def check_mail(smtp_delay, leads):
+    """Заявки с медленным SMTP: ответ /api/contact быстрее задержки SMTP, все письма доставлены"""
+    with SmtpSink(delay=smtp_delay) as sink, Server(env={
+            'SMTP_SERVER': '127.0.0.1', 'SMTP_PORT': str(sink.port), 'SMTP_USE_TLS': 'false',
+            'SENDER_EMAIL': 'site@example.com', 'SENDER_PASSWORD': 'secret',
+            'RECIPIENT_EMAIL': 'sales@example.com'}) as server:
+        latencies = []
+        for i in range(leads):
+            started = time.perf_counter()
+            status, _, body = server.request('POST', '/api/contact', {
+                'name': f'Клиент {i}', 'phone': f'+7 900 000-00-{i:02d}', 'message': 'Нужна вывеска'})
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                raise RuntimeError(f"/api/contact вернул {status}: {body[:200]!r}")
+
+        started = time.perf_counter()
+        # Одно соединение: приветствие + DATA на каждое письмо, с запасом
+        deadline = time.monotonic() + smtp_delay * (leads + 1) * 2 + 30
+        while len(sink.messages) < leads and time.monotonic() < deadline:
+            time.sleep(0.1)
+        delivered_seconds = time.perf_counter() - started
+        texts = [_message_text(message) for message in sink.messages]
+        spool_left = [n for n in os.listdir(server.data_path('mail_spool')) if n.endswith('.json')]
+
+    result = {
+        'leads': leads,
+        'smtp_delay_ms': smtp_delay * 1000,
+        'contact_p50_ms': _p(latencies, 0.5),
+        'contact_max_ms': _p(latencies, 1.0),
+        'delivered': len(sink.messages),
+        'delivered_in_s': round(delivered_seconds, 1),
+        'smtp_connections': sink.connections,
+        'spool_left': len(spool_left),
+    }
+    result['ok'] = (max(latencies) < smtp_delay
+                    and len(sink.messages) == leads
+                    and all(any(f'+7 900 000-00-{i:02d}' in text for text in texts) for i in range(leads))
+                    and not spool_left)
+    return result
+
+
+def _peak_rss(pid):
+    """Пиковый RSS процесса (VmHWM), байт"""
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError(f"Нет VmHWM для {pid}")
+
+
+def _write_large_jpeg(path, size):
+    from PIL import Image
+    noise = Image.effect_noise(size, 40)
+    gradient = Image.linear_gradient('L').resize(size)
+    Image.merge('RGB', (noise, noise.rotate(180), gradient)).save(path, quality=92)
+
+
+def check_upload_memory(size, max_edge):
+    """Пиковая память воркера на одной большой загрузке, обработанной прямо в запросе.
+
+    Загрузка пишется на диск кусками, а декодируется уменьшенной (draft), поэтому
+    прирост пикового RSS воркера не должен превышать оценку images.memory_estimate()
+    для выбранного размера декодирования плюс UPLOAD_MEMORY_SLACK — и не зависит от
+    размера файла.
+    """
+    from PIL import Image
+    from images import configure_pillow, fit_pixel_budget, memory_estimate
+
+    with tempfile.TemporaryDirectory(prefix='upload-memory-') as directory:
+        small, large = os.path.join(directory, 'small.jpg'), os.path.join(directory, 'large.jpg')
+        _write_large_jpeg(small, (1600, 1200))
+        _write_large_jpeg(large, size)
+        configure_pillow()
+        with Image.open(large) as img:
+            decoded = fit_pixel_budget(img, None, max_edge)
+            estimate = memory_estimate(img, decoded)
+
+        with Server(env={'IMAGE_MAX_EDGE': str(max_edge), 'JPEG_PASSTHROUGH_MAX_BYTES': '0'}) as server:
+            auth = server.login()
+            work_id = server.create_work(auth)
+            # Прогрев: модули Pillow и кодеки загружены до замера
+            status, _, body = server.upload(work_id, small, auth)
+            if status not in (200, 201):
+                raise RuntimeError(f"Загрузка не удалась: {status} {body[:200]!r}")
+            worker = server.worker_pids()[0]
+            before = _peak_rss(worker)
+            status, _, body = server.upload(work_id, large, auth)
+            if status not in (200, 201):
+                raise RuntimeError(f"Загрузка не удалась: {status} {body[:200]!r}")
+            after = _peak_rss(worker)
+        file_size = os.path.getsize(large)
+
+    growth = after - before
+    return {
+        'upload_mb': round(file_size / 2**20, 1),
+        'image': f'{size[0]}x{size[1]}',
+        'decoded': f'{decoded[0]}x{decoded[1]}',
+        'peak_before_mb': before >> 20,
+        'peak_after_mb': after >> 20,
+        'growth_mb': growth >> 20,
+        'bound_mb': (estimate + UPLOAD_MEMORY_SLACK) >> 20,
+        'ok': growth <= estimate + UPLOAD_MEMORY_SLACK,
+    }
+
+
+class SlowUpload(threading.Thread):
+    """Медленный клиент: загрузка изображения, тело которой идет по chunk байт раз в interval секунд.
+
+    Так выглядит фотограф на плохом канале: синхронный воркер все это время занят
+    чтением тела. Через duration секунд (или при stop()) соединение обрывается,
+    не дослав тело, — иначе запросы к занятым синхронным воркерам ждали бы вечно.
+    """
+
+    def __init__(self, server, work_id, auth, duration, chunk=16 * 1024, interval=0.2,
+                 length=64 * 1024 * 1024):
+        super().__init__(daemon=True)
+        self.server, self.work_id, self.auth = server, work_id, auth
+        self.deadline = time.monotonic() + duration
+        self.chunk, self.interval, self.length = chunk, interval, length
+        self.sent = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        head = '\r\n'.join([
+            f'POST /api/works/{self.work_id}/images HTTP/1.1',
+            f'Host: 127.0.0.1:{self.server.port}',
+            f"Cookie: {self.auth['Cookie']}",
+            'Content-Type: multipart/form-data; boundary=slow',
+            f'Content-Length: {self.length}',
+            '', '']).encode('latin-1')
+        with socket.create_connection(('127.0.0.1', self.server.port)) as sock:
+            sock.sendall(head + b'--slow\r\nContent-Disposition: form-data; name="image"; filename="slow.jpg"\r\n\r\n')
+            while (not self._stop_event.wait(self.interval) and time.monotonic() < self.deadline
+                   and self.sent < self.length // 2):
+                try:
+                    sock.sendall(b'\0' * self.chunk)
+                except OSError:
+                    return
+                self.sent += self.chunk
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+SERVING_MODES = ('wsgi', 'asgi')
+
+
+def bench_serving(slow_uploads, concurrency, duration, works, workers):
+    """Пропускная способность /api/works и /api/contact в режимах wsgi и asgi,
+    без медленных загрузок и пока slow_uploads клиентов медленно шлют файлы"""
+    rows = []
+    for mode in SERVING_MODES:
+        with Server(env={'SERVER_MODE': mode, 'LOG_FORMAT': 'structured'}, workers=workers, works=works) as server:
+            auth = server.login()
+            work_id = server.create_work(auth)
+            for slow in sorted({0, slow_uploads}):
+                for name, send in (('GET /api/works', get_works), ('POST /api/contact', post_contact)):
+                    # Медленные загрузки идут все время замера и обрываются сразу после него
+                    uploads = [SlowUpload(server, work_id, auth, duration + 0.5) for _ in range(slow)]
+                    for upload in uploads:
+                        upload.start()
+                    time.sleep(0.5)  # медленные загрузки успели занять воркеры
+                    try:
+                        result = run_load(server, send, concurrency, duration)
+                    finally:
+                        for upload in uploads:
+                            upload.stop()
+                    rows.append(dict({'mode': mode, 'slow_uploads': slow, 'route': name}, **result))
+    return rows
+
+
+LOGGING_MODES = (
+    ('verbose', {'LOG_FORMAT': 'verbose'}),
+    ('structured', {'LOG_FORMAT': 'structured'}),
+    ('structured+info', {'LOG_FORMAT': 'structured', 'LOG_LEVEL': 'info'}),
+)
+
+
+def bench_logging(concurrency, duration, works):
+    """req/s одного воркера в режимах логирования на GET /api/works и POST /api/contact"""
+    rows = []
+    for mode, env in LOGGING_MODES:
+        with Server(env=dict(env, LOG_LEVEL=env.get('LOG_LEVEL', '')), works=works) as server:
+            for name, send in (('GET /api/works', get_works), ('POST /api/contact', post_contact)):
+                rows.append(dict({'mode': mode, 'route': name}, **run_load(server, send, concurrency, duration)))
+    return rows
+
+
+def _abort_patch(server, upload_id, offset, data, sent, auth):
+    """PATCH с объявленным len(data), но обрыв соединения после sent байт"""
+    head = '\r\n'.join([
+        f'PATCH /api/uploads/{upload_id} HTTP/1.1',
+        f'Host: 127.0.0.1:{server.port}',
+        f"Cookie: {auth['Cookie']}",
+        'Content-Type: application/offset+octet-stream',
+        f'Upload-Offset: {offset}',
+        f'Content-Length: {len(data)}',
+        '', '']).encode('latin-1')
+    with socket.create_connection(('127.0.0.1', server.port)) as sock:
+        sock.sendall(head + data[:sent])
+        time.sleep(0.5)  # сервер успел записать полученное
+
+
+def check_resumable(size, chunk):
+    """Возобновляемая загрузка с обрывом посреди куска.
+
+    Первый кусок уходит целиком, второй обрывается на середине; клиент узнает
+    смещение через HEAD, досылает остаток с него и завершает загрузку. Собранный
+    файл должен совпасть с исходным побайтно: имя мастер-файла — первые 32
+    hex-символа SHA-256 собранной загрузки.
+    """
+    with tempfile.TemporaryDirectory(prefix='resumable-') as directory:
+        source = os.path.join(directory, 'large.jpg')
+        _write_large_jpeg(source, size)
+        with open(source, 'rb') as f:
+            data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    with Server() as server:
+        auth = server.login()
+        work_id = server.create_work(auth)
+        status, headers, body = server.request('POST', f'/api/works/{work_id}/uploads', {
+            'filename': 'large.jpg', 'size': len(data), 'mimetype': 'image/jpeg'}, headers=auth)
+        if status != 201:
+            raise RuntimeError(f"Сессия не создана: {status} {body[:200]!r}")
+        upload_url = headers['Location']
+        upload_id = upload_url.rsplit('/', 1)[1]
+
+        status, headers, _ = server.request('PATCH', upload_url, data[:chunk],
+                                            headers=dict(auth, **{'Upload-Offset': '0'}))
+        first_offset = int(headers['Upload-Offset'])
+        _abort_patch(server, upload_id, first_offset, data[first_offset:first_offset + 2 * chunk], chunk + chunk // 2,
+                     auth)
+        status, headers, _ = server.request('HEAD', upload_url, headers=auth)
+        resumed_from = int(headers['Upload-Offset'])
+        # Кусок со старого смещения — конфликт с текущим смещением сессии (сервер отвечает, не читая тело)
+        stale, _, _ = server.request('PATCH', upload_url, data[first_offset:first_offset + 1024],
+                                     headers=dict(auth, **{'Upload-Offset': str(first_offset)}))
+        offset = resumed_from
+        while offset < len(data):
+            status, headers, body = server.request('PATCH', upload_url, data[offset:offset + chunk],
+                                                   headers=dict(auth, **{'Upload-Offset': str(offset)}))
+            if status != 200:
+                raise RuntimeError(f"Кусок с {offset} не принят: {status} {body[:200]!r}")
+            offset = int(headers['Upload-Offset'])
+        status, _, body = server.request('POST', f'{upload_url}/finalize', headers=auth)
+        result = json.loads(body)
+        session_after, _, _ = server.request('GET', upload_url, headers=auth)
+        master_status, _, _ = server.request('GET', f"/uploads/{result.get('filename')}")
+
+    return {
+        'size': len(data),
+        'first_offset': first_offset,
+        'aborted_after': first_offset + chunk + chunk // 2,
+        'resumed_from': resumed_from,
+        'stale_patch': stale,
+        'finalize': status,
+        'filename': result.get('filename'),
+        'session_after': session_after,
+        'ok': (status == 201 and first_offset == chunk
+               and first_offset < resumed_from <= first_offset + chunk + chunk // 2
+               and (stale == 409 if resumed_from != first_offset else True)
+               and result.get('filename', '').startswith(sha256[:32])
+               and master_status == 200 and session_after == 404),
+    }
+
+
+def _report(result):
+    print(', '.join(f'{key}={value}' for key, value in result.items()))
+    if not result.get('ok', True):
+        raise SystemExit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сквозные проверки и нагрузочные замеры бэкенда POSTPRESS')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    mail = subparsers.add_parser('mail', help='заявки не ждут SMTP, письма доставляются')
+    mail.add_argument('--smtp-delay', type=float, default=2.0, help='задержка SMTP-сервера, секунд')
+    mail.add_argument('--leads', type=int, default=5)
+    upload_memory = subparsers.add_parser('upload-memory', help='пиковая память воркера на большой загрузке')
+    upload_memory.add_argument('--width', type=int, default=8000)
+    upload_memory.add_argument('--height', type=int, default=6000)
+    upload_memory.add_argument('--max-edge', type=int, default=2000, help='IMAGE_MAX_EDGE сервера')
+    resumable = subparsers.add_parser('resumable', help='обрыв и докачка возобновляемой загрузки')
+    resumable.add_argument('--width', type=int, default=6000)
+    resumable.add_argument('--height', type=int, default=4000)
+    resumable.add_argument('--chunk', type=int, default=4 * 1024 * 1024, help='байт в куске PATCH')
+    logging_parser = subparsers.add_parser('logging', help='req/s в режимах логирования verbose и structured')
+    logging_parser.add_argument('--concurrency', type=int, default=8)
+    logging_parser.add_argument('--duration', type=float, default=5.0, help='секунд на замер')
+    logging_parser.add_argument('--works', type=int, default=100)
+    serving = subparsers.add_parser('serving', help='пропускная способность wsgi и asgi при медленных загрузках')
+    serving.add_argument('--slow-uploads', type=int, default=4, help='медленных клиентов одновременно')
+    serving.add_argument('--concurrency', type=int, default=16)
+    serving.add_argument('--duration', type=float, default=5.0, help='секунд на замер')
+    serving.add_argument('--works', type=int, default=100)
+    serving.add_argument('--workers', type=int, default=2, help='воркеров gunicorn, как в проде')
+    args = parser.parse_args(argv)
+
+    if args.command == 'mail':
+        _report(check_mail(args.smtp_delay, args.leads))
+    elif args.command == 'upload-memory':
+        _report(check_upload_memory((args.width, args.height), args.max_edge))
+    elif args.command == 'resumable':
+        _report(check_resumable((args.width, args.height), args.chunk))
+    elif args.command == 'logging':
+        for row in bench_logging(args.concurrency, args.duration, args.works):
+            _report(row)
+    elif args.command == 'serving':
+        for row in bench_serving(args.slow_uploads, args.concurrency, args.duration, args.works, args.workers):
+            _report(row)
+
+
+if __name__ == '__main__':
+    main()
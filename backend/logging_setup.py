@@ -0,0 +1,104 @@
+"""Настройка логирования бэкенда.
+
+Два режима (LOG_FORMAT):
+
+- verbose — прежний подробный текстовый лог: все заголовки и тела запросов
+  и ответов, аргументы каждого обработчика. Удобно при отладке, но заметно
+  нагружает каждый запрос.
+- structured — одна JSON-строка на запрос в логгер access (метод, путь,
+  статус, длительность, размер ответа). Успешные запросы можно сэмплировать
+  (LOG_SAMPLE_RATE), ошибки пишутся всегда. Запись в stdout и app.log
+  выполняет отдельный поток через QueueHandler/QueueListener, поэтому
+  поток запроса не ждет файлового ввода-вывода. Сообщения приложения по
+  умолчанию пишутся начиная с WARNING (LOG_LEVEL в app.py), а на горячих
+  путях передают аргументы лениво (logger.info("...%s", x)): отключенный
+  уровень не форматирует строку.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+from datetime import datetime, timezone
+
+ACCESS_LOGGER = 'access'
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись в одну JSON-строку; поля из extra={'fields': {...}} попадают в корень"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _output_handlers(log_file):
+    handlers = [logging.StreamHandler()]
+    # Пытаемся добавить файловое логирование, но не падаем если не получается
+    try:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+        print(f"Логирование в файл {log_file} включено")
+    except (PermissionError, OSError) as e:
+        print(f"Предупреждение: Не удалось создать файл логов: {e}")
+        print("Логирование будет только в консоль")
+    return handlers
+
+
+def configure_logging(structured=False, level='info', log_file='app.log'):
+    """Настраивает корневой логгер.
+
+    Args:
+        structured: JSON-строки через очередь вместо подробного текстового лога.
+        level: Уровень сообщений приложения (debug, info, warning, ...). Логгер
+            access в структурированном режиме всегда пишет на уровне INFO.
+        log_file: Файл лога в дополнение к stdout.
+
+    Returns:
+        logging.handlers.QueueListener | None: Поток записи (в структурированном режиме).
+    """
+    level_value = getattr(logging, str(level).upper(), logging.INFO)
+    handlers = _output_handlers(log_file)
+    if not structured:
+        logging.basicConfig(level=level_value, format=TEXT_FORMAT, handlers=handlers)
+        return None
+
+    formatter = JsonFormatter()
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # QueueHandler подставляет в запись уже отформатированный текст — без префиксов
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=level_value, handlers=[queue_handler])
+    logging.getLogger(ACCESS_LOGGER).setLevel(logging.INFO)
+    return listener
+
+
+def log_access(logger, method, path, status, duration_ms, size, remote_addr):
+    """Одна структурированная строка о завершенном запросе"""
+    level = logging.WARNING if status >= 500 else logging.INFO
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, 'request', extra={'fields': {
+        'method': method,
+        'path': path,
+        'status': status,
+        'duration_ms': round(duration_ms, 2),
+        'bytes': size,
+        'ip': remote_addr,
+    }})
@@ -0,0 +1,252 @@
+"""Фоновая отправка email-заявок.
+
+/api/contact только кладет письмо в очередь на диске (data/mail_spool) и сразу
+отвечает клиенту. Отправкой занимается отдельный поток: он держит одно
+SMTP-соединение и переиспользует его для следующих писем, а при ошибке
+откладывает письмо с экспоненциальной паузой. Очередь лежит в файлах, поэтому
+переживает перезапуск контейнера.
+
+Поток запускается в каждом воркере gunicorn, но письма отправляет только тот,
+кто держит блокировку на spool.lock; остальные ждут и подхватят очередь, если
+этот воркер завершится.
+"""
+import json
+import logging
+import os
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from metrics import smtp_send_seconds, smtp_sends
+from storage import atomic_write_bytes
+
+try:
+    import fcntl
+except ImportError:  # Windows: отправляет каждый процесс, что допустимо для разработки
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 30  # секунд, удваивается с каждой попыткой
+RETRY_MAX_DELAY = 3600
+POLL_INTERVAL = 2  # как часто проверять очередь, пополненную другими воркерами
+SMTP_IDLE_TIMEOUT = 60  # закрываем простаивающее соединение
+
+
+def smtp_settings():
+    """Настройки SMTP из окружения"""
+    return {
+        'server': os.getenv('SMTP_SERVER', 'smtp.gmail.com'),
+        'port': int(os.getenv('SMTP_PORT', '587')),
+        'use_tls': os.getenv('SMTP_USE_TLS', 'true').lower() in ('1', 'true', 'yes'),
+        'sender': os.getenv('SENDER_EMAIL'),
+        'password': os.getenv('SENDER_PASSWORD'),
+        'recipient': os.getenv('RECIPIENT_EMAIL'),
+    }
+
+
+def build_message(settings, lead):
+    """Собирает письмо о новой заявке"""
+    msg = MIMEMultipart()
+    msg['From'] = settings['sender']
+    msg['To'] = settings['recipient']
+    msg['Subject'] = 'Новая заявка с сайта POSTPRESS'
+
+    body = f"""
+Новая заявка с сайта POSTPRESS:
+
+Имя: {lead['name']}
+Телефон: {lead['phone']}
+Сообщение: {lead['message']}
+
+Дата: {datetime.fromisoformat(lead['created_at']).strftime('%d.%m.%Y %H:%M')}
+        """
+
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    return msg
+
+
+class SmtpConnection:
+    """Долгоживущее SMTP-соединение, которое переподключается при обрыве."""
+
+    def __init__(self):
+        self._smtp = None
+        self._settings = None
+        self._last_used = 0
+
+    def _connect(self, settings):
+        logger.info(f"[EMAIL] Подключаемся к {settings['server']}:{settings['port']}")
+        smtp = smtplib.SMTP(settings['server'], settings['port'], timeout=30)
+        try:
+            if settings['use_tls']:
+                smtp.starttls()
+            smtp.login(settings['sender'], settings['password'])
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._settings = settings
+
+    def send(self, settings, msg):
+        if self._smtp is not None and settings != self._settings:
+            self.close()
+        if self._smtp is None:
+            self._connect(settings)
+        try:
+            self._smtp.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # Сервер закрыл простаивавшее соединение — одна повторная попытка на новом
+            self.close()
+            self._connect(settings)
+            self._smtp.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+
+
+class MailQueue:
+    """Очередь писем в папке на диске с отдельным потоком отправки.
+
+    Args:
+        directory: Папка очереди; письма, исчерпавшие попытки, попадают в failed/.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.failed_directory = os.path.join(directory, 'failed')
+        self.lock_path = os.path.join(directory, 'spool.lock')
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._connection = SmtpConnection()
+
+    def enqueue(self, name, phone, message=''):
+        """Кладет заявку в очередь. Возвращает False, если email не настроен."""
+        settings = smtp_settings()
+        if not all([settings['sender'], settings['password'], settings['recipient']]):
+            logger.warning(f"[EMAIL] Email настройки не полные, письмо не ставится в очередь")
+            logger.info(f"[EMAIL] Заявка логируется локально: {name}, {phone}, {message}")
+            return False
+
+        os.makedirs(self.directory, exist_ok=True)
+        lead = {
+            'name': name,
+            'phone': phone,
+            'message': message,
+            'created_at': datetime.now().isoformat(),
+            'attempts': 0,
+            'next_attempt_at': 0,
+        }
+        filename = f"{time.time_ns()}-{uuid.uuid4().hex}.json"
+        atomic_write_bytes(os.path.join(self.directory, filename),
+                           json.dumps(lead, ensure_ascii=False).encode('utf-8'))
+        logger.info(f"[EMAIL] Письмо поставлено в очередь: {filename}")
+        self._wakeup.set()
+        return True
+
+    def pending(self):
+        """Имена писем в очереди в порядке постановки"""
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith('.json')]
+        except FileNotFoundError:
+            return []
+        return sorted(names)
+
+    def start(self):
+        """Запускает поток отправки (повторный вызов ничего не делает)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='mail-sender', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        with open(self.lock_path, 'a') as lock_file:
+            # Ждем, пока станем единственным отправителем среди воркеров
+            while not self._stop.is_set():
+                if fcntl is None:
+                    break
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except OSError:
+                    self._stop.wait(POLL_INTERVAL * 5)
+            logger.info(f"[EMAIL] Поток отправки писем активен (pid {os.getpid()})")
+
+            while not self._stop.is_set():
+                try:
+                    self._drain()
+                except Exception as e:
+                    logger.error(f"[EMAIL] Ошибка обработки очереди: {e}")
+                self._connection.close_if_idle()
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+            self._connection.close()
+
+    def _drain(self):
+        """Отправляет все письма, срок которых наступил"""
+        now = time.time()
+        for filename in self.pending():
+            if self._stop.is_set():
+                return
+            path = os.path.join(self.directory, filename)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    lead = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError) as e:
+                logger.error(f"[EMAIL] Не удалось прочитать {filename}: {e}")
+                continue
+            if lead.get('next_attempt_at', 0) > now:
+                continue
+            self._deliver(path, filename, lead)
+
+    def _deliver(self, path, filename, lead):
+        settings = smtp_settings()
+        started = time.perf_counter()
+        try:
+            self._connection.send(settings, build_message(settings, lead))
+        except Exception as e:
+            self._connection.close()
+            lead['attempts'] = lead.get('attempts', 0) + 1
+            lead['last_error'] = f"{type(e).__name__}: {e}"
+            outcome = 'failed' if lead['attempts'] >= MAX_ATTEMPTS else 'retry'
+            smtp_send_seconds.observe(time.perf_counter() - started, outcome=outcome)
+            smtp_sends.inc(outcome=outcome)
+            if outcome == 'failed':
+                logger.error(f"[EMAIL] ERROR: {filename} не отправлено за {MAX_ATTEMPTS} попыток: {e}")
+                os.makedirs(self.failed_directory, exist_ok=True)
+                os.replace(path, os.path.join(self.failed_directory, filename))
+                return
+            delay = min(RETRY_BASE_DELAY * 2 ** (lead['attempts'] - 1), RETRY_MAX_DELAY)
+            lead['next_attempt_at'] = time.time() + delay
+            atomic_write_bytes(path, json.dumps(lead, ensure_ascii=False).encode('utf-8'))
+            logger.warning(f"[EMAIL] Ошибка отправки {filename} (попытка {lead['attempts']}): {e}. "
+                           f"Повтор через {delay} с")
+            return
+        smtp_send_seconds.observe(time.perf_counter() - started, outcome='sent')
+        smtp_sends.inc(outcome='sent')
+        os.remove(path)
+        logger.info(f"[EMAIL] SUCCESS: Email отправлен для {lead['name']}, {lead['phone']} "
+                    f"за {(time.perf_counter() - started) * 1000:.0f} мс")
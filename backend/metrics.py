@@ -0,0 +1,328 @@
+"""Метрики в формате Prometheus, общие для всех процессов бэкенда.
+
+Каждый процесс (воркеры gunicorn, процессы пула обработки изображений)
+копит счетчики и гистограммы в памяти и раз в секунду атомарно сбрасывает их
+в свой файл data/metrics/<token>.json. /metrics складывает файлы всех
+процессов, поэтому не важно, какой воркер ответил на запрос Prometheus.
+
+Пока процесс жив, он держит flock на <token>.lock. Файлы завершившихся
+процессов при сборе вливаются в archive.json — счетчики не откатываются
+назад при перезапуске воркеров.
+
+Мгновенные значения (длины очередей) не копятся, а считаются при каждом
+сборе функциями, зарегистрированными через gauge().
+"""
+import atexit
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1.0
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ARCHIVE_NAME = 'archive.json'
+
+
+def _write_atomic(path, data):
+    # Не через storage.atomic_write_bytes: storage сам пишет метрики, а fsync здесь не нужен
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    def __init__(self, registry, name, help_text, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, value=1, **labels):
+        self.registry._update(self.name, self._key(labels), lambda current: (current or 0) + value)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames, buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        def update(current):
+            # [счетчики по корзинам (не накопительные)..., сумма, количество]
+            current = current or [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    current[i] += 1
+                    break
+            current[-2] += value
+            current[-1] += 1
+            return current
+        self.registry._update(self.name, self._key(labels), update)
+
+    def time(self, **labels):
+        """Контекстный менеджер: наблюдает длительность блока в секундах"""
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    """Набор метрик процесса с периодическим сбросом на диск.
+
+    Args:
+        directory: Общая папка файлов метрик всех процессов.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.token = uuid.uuid4().hex
+        self._metrics = {}
+        self._gauges = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        self._started_pid = None
+        self._lock_file = None
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(self, name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, callback):
+        """Мгновенное значение, которое вычисляется callback() при каждом сборе"""
+        self._gauges[name] = (help_text, callback)
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    # ---- запись ----
+
+    def _update(self, name, key, update):
+        self._ensure_started()
+        with self._lock:
+            values = self._values.setdefault(name, {})
+            values[key] = update(values.get(key))
+            self._dirty = True
+
+    def _ensure_started(self):
+        """Запускает сброс на диск в текущем процессе (в том числе после fork)"""
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            if self._started_pid is not None:
+                # Дочерний процесс после fork: значения родителя уже посчитаны им
+                self.token = uuid.uuid4().hex
+                self._values = {}
+            self._started_pid = os.getpid()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._lock_file = open(self._path('.lock'), 'a')
+            if fcntl is not None:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        except OSError as e:
+            logger.warning(f"[METRICS] Не удалось подготовить папку метрик {self.directory}: {e}")
+            return
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _path(self, suffix):
+        return os.path.join(self.directory, f'{self.token}{suffix}')
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"[METRICS] Не удалось сбросить метрики: {e}")
+
+    def flush(self):
+        """Сбрасывает значения процесса в его файл, если они менялись"""
+        # Отдельная блокировка: более старый снимок не должен лечь поверх нового
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty or self._started_pid != os.getpid() or self._lock_file is None:
+                    return
+                data = json.dumps(self._serialize(self._values)).encode('utf-8')
+                self._dirty = False
+            _write_atomic(self._path('.json'), data)
+
+    @staticmethod
+    def _serialize(values):
+        return {name: [[list(key), value] for key, value in series.items()] for name, series in values.items()}
+
+    # ---- сбор ----
+
+    def _owner_alive(self, token):
+        if fcntl is None:
+            return True
+        path = os.path.join(self.directory, f'{token}.lock')
+        try:
+            with open(path, 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        return False
+
+    def _read(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _merge(self, total, data):
+        for name, series in data.items():
+            target = total.setdefault(name, {})
+            for key, value in series:
+                key = tuple(key)
+                current = target.get(key)
+                if current is None:
+                    target[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target[key] = current + value
+
+    def _archive_dead(self):
+        """Вливает файлы завершившихся процессов в archive.json. Вызывается под archive.lock."""
+        archive_path = os.path.join(self.directory, ARCHIVE_NAME)
+        dead = [name[:-5] for name in os.listdir(self.directory)
+                if name.endswith('.json') and name != ARCHIVE_NAME and not self._owner_alive(name[:-5])]
+        if not dead:
+            return
+        archive = {}
+        self._merge(archive, self._read(archive_path))
+        for token in dead:
+            self._merge(archive, self._read(os.path.join(self.directory, f'{token}.json')))
+        _write_atomic(archive_path, json.dumps(self._serialize(archive)).encode('utf-8'))
+        for token in dead:
+            for suffix in ('.json', '.lock'):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.directory, f'{token}{suffix}'))
+
+    def collect(self):
+        """Суммарные значения всех процессов: {имя: {метки: значение}}"""
+        self._ensure_started()
+        self.flush()
+        total = {}
+        # Под блокировкой: параллельный сбор не должен архивировать файл, который мы читаем
+        with _file_lock(os.path.join(self.directory, 'archive.lock')):
+            self._archive_dead()
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    self._merge(total, self._read(os.path.join(self.directory, name)))
+        return total
+
+    def render(self):
+        """Текст в формате экспозиции Prometheus 0.0.4"""
+        values = self.collect()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for key, value in sorted(values.get(name, {}).items()):
+                if metric.type == 'counter':
+                    lines.append(f'{name}{_labels(metric.labelnames, key)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets, value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(metric.labelnames, key, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_bucket{_labels(metric.labelnames, key, [("le", "+Inf")])} {value[-1]}')
+                lines.append(f'{name}_sum{_labels(metric.labelnames, key)} {_format_value(value[-2])}')
+                lines.append(f'{name}_count{_labels(metric.labelnames, key)} {value[-1]}')
+        for name, (help_text, callback) in self._gauges.items():
+            try:
+                value = callback()
+            except Exception as e:
+                logger.warning(f"[METRICS] Не удалось вычислить {name}: {e}")
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry(os.getenv('METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'metrics')))
+
+# ---- метрики бэкенда ----
+
+http_requests = registry.counter(
+    'postpress_http_requests_total', 'HTTP-запросы по маршруту и статусу', ('method', 'route', 'status'))
+http_request_seconds = registry.histogram(
+    'postpress_http_request_duration_seconds', 'Длительность обработки HTTP-запроса', ('method', 'route'))
+upload_bytes = registry.counter(
+    'postpress_upload_bytes_total', 'Принятые байты загрузок изображений')
+upload_results = registry.counter(
+    'postpress_uploads_total', 'Загрузки изображений по способу обработки', ('mode',))
+image_processing_seconds = registry.histogram(
+    'postpress_image_processing_seconds', 'Полная обработка загрузки: декодирование, мастер, версии', ('mode',))
+image_decode_seconds = registry.histogram(
+    'postpress_image_decode_seconds', 'Декодирование изображения по исходному формату', ('format',))
+works_store_seconds = registry.histogram(
+    'postpress_works_store_seconds', 'Чтение и запись хранилища работ', ('backend', 'op'))
+smtp_send_seconds = registry.histogram(
+    'postpress_smtp_send_seconds', 'Отправка письма через SMTP', ('outcome',))
+smtp_sends = registry.counter(
+    'postpress_smtp_sends_total', 'Попытки отправки писем по результату', ('outcome',))
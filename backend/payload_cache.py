@@ -0,0 +1,128 @@
+"""Кэш готовых к отдаче JSON-ответов.
+
+Сериализованное тело и его gzip/brotli варианты вычисляются один раз на версию
+данных и переиспользуются до следующего изменения. Вместе с телом хранятся
+строгий ETag и Last-Modified, чтобы повторные запросы отвечались 304.
+"""
+import gzip
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import time
+
+logger = logging.getLogger(__name__)
+
+# brotli — необязательная зависимость: без неё отдаем gzip и несжатый вариант
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+# Совсем маленькие ответы сжимать нет смысла
+MIN_COMPRESS_SIZE = 256
+
+
+class EncodedPayload:
+    """Одна версия ответа: тело, его сжатые варианты и валидаторы кэша."""
+
+    def __init__(self, body, last_modified):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.last_modified = last_modified
+        self._encoded = {'identity': body}
+        self._lock = threading.Lock()
+
+    def available_encodings(self):
+        encodings = ['identity']
+        if len(self.body) >= MIN_COMPRESS_SIZE:
+            encodings.insert(0, 'gzip')
+            if brotli is not None:
+                encodings.insert(0, 'br')
+        return encodings
+
+    def etag_for(self, encoding):
+        """Строгий ETag отдельного представления (сжатые байты отличаются)"""
+        if encoding == 'identity':
+            return self.etag
+        return f"{self.etag}-{encoding}"
+
+    def encoded(self, encoding):
+        """Возвращает тело в заданной кодировке, сжимая его при первом запросе"""
+        with self._lock:
+            data = self._encoded.get(encoding)
+            if data is None:
+                started = time.perf_counter()
+                if encoding == 'gzip':
+                    data = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+                elif encoding == 'br':
+                    data = brotli.compress(self.body, quality=BROTLI_QUALITY)
+                else:
+                    raise ValueError(f"Неизвестная кодировка: {encoding}")
+                self._encoded[encoding] = data
+                logger.info(f"[CACHE] {encoding}: {len(self.body)} -> {len(data)} байт "
+                            f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+            return data
+
+    def choose_encoding(self, accept_encodings):
+        """Выбирает лучшую кодировку из поддерживаемых клиентом (werkzeug MIMEAccept)"""
+        for encoding in self.available_encodings():
+            if encoding == 'identity' or accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+
+class PayloadCache:
+    """Держит сериализованный ответ для текущей версии данных."""
+
+    def __init__(self, dumps):
+        self._dumps = dumps
+        self._lock = threading.Lock()
+        self._version = None
+        self._payload = None
+
+    def get(self, version, data, last_modified=None):
+        """Возвращает EncodedPayload для версии, сериализуя data только при её смене"""
+        with self._lock:
+            if self._payload is not None and version is not None and version == self._version:
+                return self._payload
+            body = self._dumps(data).encode('utf-8')
+            payload = EncodedPayload(body, last_modified or time.time())
+            self._version = version
+            self._payload = payload
+            logger.info(f"[CACHE] Ответ пересобран: {len(body)} байт, ETag {payload.etag}")
+            return payload
+
+
+class KeyedPayloadCache:
+    """Несколько ответов по ключу (страницы выборки, отдельные работы) для текущей версии данных.
+
+    Args:
+        dumps: Функция сериализации.
+        max_entries: Сколько последних ключей держать; при смене версии
+            записи пересобираются по мере запросов.
+    """
+
+    def __init__(self, dumps, max_entries=256):
+        self._dumps = dumps
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, version, build, last_modified=None):
+        """Возвращает EncodedPayload для ключа, вызывая build() только при промахе"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and version is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+        # Сериализация вне блокировки: промахи по разным ключам не ждут друг друга
+        payload = EncodedPayload(self._dumps(build()).encode('utf-8'), last_modified or time.time())
+        with self._lock:
+            self._entries[key] = (version, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return payload
@@ -0,0 +1,167 @@
+"""Профилирование запросов и обработки изображений по запросу.
+
+Профиль включается для отдельного запроса: заголовком X-Profile от
+авторизованного администратора или случайной выборкой (PROFILE_SAMPLE_RATE).
+Во время такого запроса участки кода, обернутые в stage('имя'), записывают
+свою длительность; при X-Profile: cprofile (или pyinstrument, если он
+установлен) дополнительно снимается профиль интерпретатора.
+
+Готовые профили складываются в кольцевой буфер из файлов data/profiles —
+последние PROFILE_BUFFER_SIZE штук, общие для всех воркеров gunicorn.
+
+Вне профилируемого запроса stage() почти ничего не стоит: одна проверка
+contextvar.
+"""
+import contextlib
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import time
+import uuid
+
+try:
+    import pyinstrument  # type: ignore
+except ImportError:
+    pyinstrument = None
+
+from storage import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ('stages', 'cprofile', 'pyinstrument')
+CPROFILE_TOP = 40  # строк pstats в сохраненном профиле
+
+_current = contextvars.ContextVar('profile', default=None)
+
+
+class _Stage:
+    __slots__ = ('name', 'stages', 'started')
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = _current.get()
+
+    def __enter__(self):
+        if self.stages is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.stages is not None:
+            self.stages.append((self.name, round((time.perf_counter() - self.started) * 1000, 3)))
+
+
+def stage(name):
+    """Замеряет участок кода, если в текущем контексте идет профилирование"""
+    return _Stage(name)
+
+
+@contextlib.contextmanager
+def capture_stages():
+    """Собирает stage() внутри блока в список [(имя, мс), ...] независимо от запроса"""
+    stages = []
+    token = _current.set(stages)
+    try:
+        yield stages
+    finally:
+        _current.reset(token)
+
+
+class RequestProfile:
+    """Профиль одного запроса: этапы и, по желанию, профиль интерпретатора"""
+
+    def __init__(self, mode='stages'):
+        if mode == 'pyinstrument' and pyinstrument is None:
+            logger.warning("[PROFILE] pyinstrument не установлен, используем cProfile")
+            mode = 'cprofile'
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.stages = []
+        self._token = None
+        self._profiler = None
+
+    def start(self):
+        self._token = _current.set(self.stages)
+        if self.mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.mode == 'pyinstrument':
+            self._profiler = pyinstrument.Profiler()
+            self._profiler.start()
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+
+    def stop(self):
+        """Останавливает профилирование и возвращает текст отчета интерпретатора или None"""
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        report = None
+        if self.mode == 'cprofile':
+            self._profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self._profiler, stream=out).sort_stats('cumulative').print_stats(CPROFILE_TOP)
+            report = out.getvalue()
+        elif self.mode == 'pyinstrument':
+            self._profiler.stop()
+            report = self._profiler.output_text(unicode=True)
+        _current.reset(self._token)
+        return duration_ms, report
+
+
+class ProfileBuffer:
+    """Последние N профилей в файлах, общие для всех процессов.
+
+    Args:
+        directory: Папка профилей.
+        size: Сколько последних профилей хранить.
+    """
+
+    def __init__(self, directory, size=50):
+        self.directory = directory
+        self.size = max(1, size)
+
+    def _names(self):
+        try:
+            return sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        except FileNotFoundError:
+            return []
+
+    def add(self, record):
+        """Сохраняет профиль и вытесняет самые старые сверх лимита"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.time_ns()}-{record['id']}.json"
+        atomic_write_bytes(os.path.join(self.directory, name),
+                           json.dumps(record, ensure_ascii=False).encode('utf-8'))
+        names = self._names()
+        for old in names[:max(0, len(names) - self.size)]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.directory, old))
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def list(self):
+        """Краткие записи (без отчета интерпретатора), новые первыми"""
+        records = []
+        for name in reversed(self._names()):
+            record = self._read(name)
+            if record is not None:
+                record.pop('report', None)
+                records.append(record)
+        return records
+
+    def get(self, profile_id):
+        """Полный профиль по id или None"""
+        if not profile_id.isalnum():
+            return None
+        for name in self._names():
+            if name.endswith(f'-{profile_id}.json'):
+                return self._read(name)
+        return None
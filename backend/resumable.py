@@ -0,0 +1,231 @@
+"""Возобновляемая загрузка больших исходников кусками (по образцу протокола tus).
+
+Оригиналы TIFF/HEIC бывают больше MAX_CONTENT_LENGTH, а обрыв соединения на
+середине обычной загрузки заставляет начинать заново. Здесь загрузка идет в
+три шага:
+
+1. create — сессия с объявленным размером и пустой файл .part;
+2. append (PATCH) — куски дописываются в конец .part строго по смещению;
+   после обрыва клиент спрашивает текущее смещение и продолжает с него;
+3. finish — собранный файл отдается вызывающему (жесткой ссылкой) вместе с
+   SHA-256 и дальше обрабатывается как обычная загрузка. Сессия остается,
+   пока вызывающий не закроет ее (close) после успешной обработки: если
+   обработка упала, завершение можно повторить без повторной передачи.
+
+Смещение сессии — это размер файла .part: в него попадают только целиком
+полученные куски чтения, поэтому после обрыва он всегда согласован с
+содержимым. Куски пишутся потоком, без копии всей загрузки в памяти.
+Сессии лежат в файлах, поэтому продолжать можно через любой воркер.
+"""
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+
+from storage import UPLOAD_CHUNK_SIZE, atomic_write_bytes, file_lock
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL = 24 * 3600  # брошенные сессии удаляются через сутки без изменений
+
+
+class UploadOffsetError(ValueError):
+    """Кусок прислан не с текущего смещения сессии"""
+
+    def __init__(self, offset):
+        super().__init__(f"Ожидалось смещение {offset}")
+        self.offset = offset
+
+
+class ResumableUploads:
+    """Сессии возобновляемых загрузок в папке на диске.
+
+    Args:
+        directory: Папка сессий (записи .json и собираемые файлы .part).
+        max_size: Максимальный размер одной загрузки в байтах.
+        ttl: Через сколько секунд без изменений сессия считается брошенной.
+    """
+
+    def __init__(self, directory, max_size, ttl=SESSION_TTL):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _record_path(self, upload_id):
+        return os.path.join(self.directory, f'{upload_id}.json')
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.directory, f'{upload_id}.part')
+
+    def _lock_path(self, upload_id):
+        return os.path.join(self.directory, f'{upload_id}.lock')
+
+    def _load(self, upload_id):
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(self._record_path(upload_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save(self, record):
+        record['updated_at'] = datetime.now().isoformat()
+        atomic_write_bytes(self._record_path(record['id']), json.dumps(record, ensure_ascii=False).encode('utf-8'))
+
+    def _remove(self, upload_id):
+        for path in (self._part_path(upload_id), self._record_path(upload_id), self._lock_path(upload_id)):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def get(self, upload_id):
+        """Запись сессии с текущим смещением (offset) или None"""
+        record = self._load(upload_id)
+        if record is None:
+            return None
+        try:
+            record['offset'] = os.path.getsize(self._part_path(upload_id))
+        except FileNotFoundError:
+            return None
+        return record
+
+    def create(self, work_id, filename, mimetype, length):
+        """Начинает загрузку объявленного размера.
+
+        Raises:
+            ValueError: Если размер не положительный или больше max_size.
+        """
+        if length <= 0:
+            raise ValueError("Размер загрузки должен быть больше нуля")
+        if length > self.max_size:
+            raise ValueError(f"Файл слишком большой: больше {self.max_size} байт")
+        self.cleanup()
+        upload_id = uuid.uuid4().hex
+        open(self._part_path(upload_id), 'wb').close()
+        record = {
+            'id': upload_id,
+            'work_id': work_id,
+            'filename': filename,
+            'mimetype': mimetype,
+            'length': length,
+            'created_at': datetime.now().isoformat(),
+        }
+        self._save(record)
+        logger.info(f"[RESUMABLE] Сессия {upload_id} для работы {work_id}: {filename}, {length} байт")
+        return dict(record, offset=0)
+
+    def append(self, upload_id, offset, stream, chunk_size=UPLOAD_CHUNK_SIZE):
+        """Дописывает кусок из потока в конец загрузки.
+
+        Если поток оборвется, уже записанные куски чтения остаются в файле и
+        клиент продолжит с нового смещения.
+
+        Args:
+            upload_id: Сессия.
+            offset: Смещение, с которого клиент шлет кусок.
+            stream: Файлоподобный объект с методом read() (тело запроса).
+            chunk_size: Размер куска чтения.
+
+        Returns:
+            dict | None: Запись сессии с новым смещением или None, если сессии нет.
+
+        Raises:
+            UploadOffsetError: Если offset не совпадает с текущим смещением.
+            ValueError: Если кусок выходит за объявленный размер.
+        """
+        if self._load(upload_id) is None:
+            return None
+        with file_lock(self._lock_path(upload_id)):
+            record = self.get(upload_id)
+            if record is None:
+                return None
+            if offset != record['offset']:
+                raise UploadOffsetError(record['offset'])
+            written = offset
+            try:
+                with open(self._part_path(upload_id), 'ab') as f:
+                    while True:
+                        chunk = stream.read(chunk_size)
+                        if not chunk:
+                            break
+                        if written + len(chunk) > record['length']:
+                            raise ValueError(f"Данные длиннее объявленного размера {record['length']} байт")
+                        f.write(chunk)
+                        written += len(chunk)
+            finally:
+                if written != offset:
+                    self._save(record)
+                    logger.info(f"[RESUMABLE] Сессия {upload_id}: {written} из {record['length']} байт")
+            record['offset'] = written
+            return record
+
+    def finish(self, upload_id, dest_path):
+        """Отдает собранный файл в dest_path; сессия остается до close().
+
+        dest_path — жесткая ссылка на собранный файл (или копия, если ссылку
+        создать нельзя): вызывающий может переместить или удалить его, не
+        трогая сессию.
+
+        Returns:
+            tuple[dict, str] | None: Запись сессии и SHA-256 файла или None, если сессии нет.
+
+        Raises:
+            ValueError: Если получены не все байты.
+        """
+        if self._load(upload_id) is None:
+            return None
+        with file_lock(self._lock_path(upload_id)):
+            record = self.get(upload_id)
+            if record is None:
+                return None
+            if record['offset'] != record['length']:
+                raise ValueError(f"Загрузка не завершена: получено {record['offset']} из {record['length']} байт")
+            digest = hashlib.sha256()
+            with open(self._part_path(upload_id), 'rb') as f:
+                while chunk := f.read(UPLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+            link_path = f'{dest_path}.link'
+            try:
+                os.link(self._part_path(upload_id), link_path)
+            except OSError:
+                shutil.copyfile(self._part_path(upload_id), link_path)
+            os.replace(link_path, dest_path)
+        logger.info(f"[RESUMABLE] Сессия {upload_id} собрана: {record['length']} байт")
+        return record, digest.hexdigest()
+
+    def close(self, upload_id):
+        """Закрывает сессию после успешной обработки собранного файла"""
+        with file_lock(self._lock_path(upload_id)):
+            self._remove(upload_id)
+        logger.info(f"[RESUMABLE] Сессия {upload_id} закрыта")
+
+    def discard(self, upload_id):
+        """Отменяет загрузку. Возвращает False, если сессии нет."""
+        if self._load(upload_id) is None:
+            return False
+        with file_lock(self._lock_path(upload_id)):
+            if self._load(upload_id) is None:
+                return False
+            self._remove(upload_id)
+        logger.info(f"[RESUMABLE] Сессия {upload_id} отменена")
+        return True
+
+    def cleanup(self):
+        """Удаляет брошенные сессии"""
+        now = time.time()
+        for name in os.listdir(self.directory):
+            upload_id, ext = os.path.splitext(name)
+            if ext != '.json':
+                continue
+            try:
+                if now - os.path.getmtime(os.path.join(self.directory, name)) > self.ttl:
+                    logger.info(f"[RESUMABLE] Удаляется брошенная сессия {upload_id}")
+                    self._remove(upload_id)
+            except FileNotFoundError:
+                pass
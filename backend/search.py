@@ -0,0 +1,386 @@
+"""Полнотекстовый поиск по работам.
+
+Инвертированный индекс по названию, описанию и области работы живет в памяти
+процесса. Слова приводятся к основе стеммером Snowball для русского языка
+(реализован здесь же, без внешних зависимостей), поэтому «кухни», «кухню» и
+«кухня» находят одно и то же. Результаты ранжируются по BM25 с весами полей.
+
+Обработчики add/update/delete обновляют индекс на месте. Изменения, сделанные
+другими воркерами gunicorn, подхватываются при следующем поиске: индекс
+сравнивает updated_at работ новой версии хранилища со своими и
+переиндексирует только изменившиеся.
+
+Замер на синтетическом корпусе: python search.py bench --works 100000
+"""
+import argparse
+import bisect
+import functools
+import heapq
+import itertools
+import logging
+import math
+import random
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+FIELD_WEIGHTS = {'title': 3.0, 'area': 2.0, 'description': 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_QUERY_TERMS = 16
+# Начало слова раскрывается не короче 3 букв и не более чем в 64 самых частых основы
+MIN_PREFIX = 3
+MAX_PREFIX_TERMS = 64
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+STOPWORDS = frozenset((
+    'и в во на с со по к ко о об от до из за у для при под над без про через а но или '
+    'не ни же ли бы то это как что так все всё его ее её их мы вы он она они'
+).split())
+
+
+# ---- стеммер Snowball для русского языка ----
+
+_VOWELS = 'аеиоуыэюя'
+_PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+_REFLEXIVE = ('ся', 'сь')
+_ADJECTIVE = ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+              'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+_PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+_VERB = (('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+         ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен',
+          'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'))
+_NOUN = ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий', 'й',
+         'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я')
+_SUPERLATIVE = ('ейше', 'ейш')
+_DERIVATIONAL = ('ость', 'ост')
+
+
+def _longest_first(groups):
+    # Окончания проверяются от длинных к коротким
+    return tuple(tuple(sorted(group, key=len, reverse=True)) for group in groups)
+
+
+_PERFECTIVE_GERUND = _longest_first(_PERFECTIVE_GERUND)
+_PARTICIPLE = _longest_first(_PARTICIPLE)
+_VERB = _longest_first(_VERB)
+_REFLEXIVE, _ADJECTIVE, _NOUN, _SUPERLATIVE, _DERIVATIONAL = _longest_first(
+    (_REFLEXIVE, _ADJECTIVE, _NOUN, _SUPERLATIVE, _DERIVATIONAL))
+
+
+def _region(word, start=0):
+    """Начало области после первого сочетания гласная+согласная (R1/R2 Snowball)"""
+    for i in range(start + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _strip(word, suffixes, after_a=False):
+    """Отрезает самое длинное окончание из suffixes или возвращает None.
+
+    after_a: окончание группы 1 — допустимо только после «а» или «я».
+    """
+    for suffix in suffixes:
+        if word.endswith(suffix):
+            rest = word[:-len(suffix)]
+            if after_a and not rest.endswith(('а', 'я')):
+                continue
+            return rest
+    return None
+
+
+def _strip_groups(word, groups):
+    candidates = [r for r in (_strip(word, groups[0], after_a=True), _strip(word, groups[1])) if r is not None]
+    # Из двух групп побеждает более длинное окончание, то есть более короткий остаток
+    return min(candidates, key=len) if candidates else None
+
+
+@functools.lru_cache(maxsize=65536)
+def stem(word):
+    """Основа русского слова (алгоритм Snowball); остальные слова возвращаются как есть"""
+    word = word.lower().replace('ё', 'е')
+    rv_start = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), len(word))
+    prefix, rv = word[:rv_start], word[rv_start:]
+    if not rv:
+        return word
+
+    # Шаг 1
+    result = _strip_groups(rv, _PERFECTIVE_GERUND)
+    if result is None:
+        reflexive = _strip(rv, _REFLEXIVE)
+        if reflexive is not None:
+            rv = reflexive
+        adjective = _strip(rv, _ADJECTIVE)
+        if adjective is not None:
+            participle = _strip_groups(adjective, _PARTICIPLE)
+            result = participle if participle is not None else adjective
+        else:
+            result = _strip_groups(rv, _VERB)
+            if result is None:
+                result = _strip(rv, _NOUN)
+        if result is None:
+            result = rv
+    rv = result
+
+    # Шаг 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательный суффикс только в R2
+    word = prefix + rv
+    r2 = _region(word, _region(word))
+    derivational = _strip(word, _DERIVATIONAL)
+    if derivational is not None and len(derivational) >= r2:
+        word = derivational
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 4
+    superlative = _strip(rv, _SUPERLATIVE)
+    if superlative is not None:
+        rv = superlative
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    elif superlative is None and rv.endswith('ь'):
+        rv = rv[:-1]
+    return prefix + rv
+
+
+def tokenize(text):
+    """Основы слов текста без стоп-слов"""
+    return [stem(token) for token in TOKEN_RE.findall((text or '').lower())
+            if len(token) > 1 and token not in STOPWORDS]
+
+
+# ---- индекс ----
+
+class SearchIndex:
+    """Инвертированный индекс работ: основа -> {id работы: взвешенная частота}"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._terms = {}     # id -> основы работы, чтобы убрать её из индекса
+        self._lengths = {}   # id -> взвешенная длина работы
+        self._stamps = {}    # id -> updated_at проиндексированной версии
+        self._total_length = 0.0
+        self._version = None
+        self._sorted_terms = None  # для поиска по началу слова, строится лениво
+
+    def _remove(self, work_id):
+        for term in self._terms.pop(work_id, ()):
+            docs = self._postings.get(term)
+            if docs is not None:
+                docs.pop(work_id, None)
+                if not docs:
+                    del self._postings[term]
+                    self._sorted_terms = None
+        self._total_length -= self._lengths.pop(work_id, 0.0)
+        self._stamps.pop(work_id, None)
+
+    def _add(self, work):
+        work_id = work['id']
+        frequencies = {}
+        length = 0.0
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(work.get(field)):
+                frequencies[term] = frequencies.get(term, 0.0) + weight
+                length += weight
+        for term, frequency in frequencies.items():
+            docs = self._postings.get(term)
+            if docs is None:
+                docs = self._postings[term] = {}
+                self._sorted_terms = None
+            docs[work_id] = frequency
+        self._terms[work_id] = tuple(frequencies)
+        self._lengths[work_id] = length
+        self._stamps[work_id] = work.get('updated_at')
+        self._total_length += length
+
+    def update_work(self, work):
+        """Индексирует новую или измененную работу"""
+        with self._lock:
+            self._remove(work['id'])
+            self._add(work)
+
+    def remove_work(self, work_id):
+        with self._lock:
+            self._remove(work_id)
+
+    def sync(self, version, works):
+        """Приводит индекс к версии хранилища, переиндексируя только изменившиеся работы"""
+        with self._lock:
+            if version is not None and version == self._version:
+                return
+            started = time.perf_counter()
+            seen = set()
+            changed = 0
+            for work in works:
+                seen.add(work['id'])
+                if self._stamps.get(work['id'], ()) != work.get('updated_at') or work['id'] not in self._terms:
+                    self._remove(work['id'])
+                    self._add(work)
+                    changed += 1
+            removed = [work_id for work_id in self._terms if work_id not in seen]
+            for work_id in removed:
+                self._remove(work_id)
+            self._version = version
+            if changed or removed:
+                logger.info(f"[SEARCH] Индекс обновлен: изменено {changed}, удалено {len(removed)} "
+                            f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    def search(self, query, limit=20):
+        """Ранжированные id работ по запросу.
+
+        Работа попадает в выдачу, если содержит все слова запроса; последнее
+        слово может быть началом слова (поиск по мере ввода).
+
+        Returns:
+            tuple[list[tuple[str, float]], int]: [(id, релевантность), ...] и
+            общее число найденных работ.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not terms:
+            return [], 0
+        with self._lock:
+            count = len(self._lengths)
+            if not count:
+                return [], 0
+            average = self._total_length / count or 1.0
+            term_docs = [self._postings.get(term, {}) for term in terms[:-1]]
+            # Последнее слово: точная основа или любое слово, которое с неё начинается
+            last = terms[-1]
+            if self._sorted_terms is None:
+                self._sorted_terms = sorted(self._postings)
+            matches = [self._postings[last]] if last in self._postings else []
+            if len(last) >= MIN_PREFIX:
+                for i in range(bisect.bisect_left(self._sorted_terms, last), len(self._sorted_terms)):
+                    term = self._sorted_terms[i]
+                    if not term.startswith(last):
+                        break
+                    if term != last:
+                        matches.append(self._postings[term])
+                matches.sort(key=len, reverse=True)
+                del matches[MAX_PREFIX_TERMS:]
+            if len(matches) == 1:
+                term_docs.append(matches[0])
+            else:
+                prefixed = {}
+                for docs in matches:
+                    for work_id, frequency in docs.items():
+                        if frequency > prefixed.get(work_id, 0.0):
+                            prefixed[work_id] = frequency
+                term_docs.append(prefixed)
+            if any(not docs for docs in term_docs):
+                return [], 0
+            term_docs.sort(key=len)
+            matched = set(term_docs[0])
+            for docs in term_docs[1:]:
+                matched.intersection_update(docs)
+            idfs = [math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5)) for docs in term_docs]
+            weighted = list(zip(term_docs, idfs))
+            lengths = self._lengths
+            k = BM25_K1 * (1 - BM25_B)
+            scale = BM25_K1 * BM25_B / average
+            scores = []
+            for work_id in matched:
+                norm = k + scale * lengths[work_id]
+                score = 0.0
+                for docs, idf in weighted:
+                    frequency = docs[work_id]
+                    score += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+                scores.append((work_id, round(score, 4)))
+        return heapq.nsmallest(limit, scores, key=lambda item: (-item[1], item[0])), len(scores)
+
+
+# ---- замер ----
+
+_BENCH_WORDS = ('ремонт кухни ванной комнаты спальни гостиной квартиры дома офиса под ключ '
+                'укладка плитки ламината паркета покраска стен потолков штукатурка шпаклевка '
+                'электрика сантехника замена труб окон дверей натяжные потолки перепланировка '
+                'дизайн проект черновая чистовая отделка фасада балкона лоджии утепление').split()
+_BENCH_AREAS = ('Кухня', 'Ванная', 'Спальня', 'Гостиная', 'Офис', 'Балкон', 'Фасад')
+
+
+def _synthetic_vocabulary(rng, size=20000):
+    """Словарь: реальные слова отрасли и псевдослова с русскими окончаниями"""
+    syllables = ('ка', 'ро', 'ми', 'на', 'ло', 'те', 'ва', 'ст', 'по', 'ре', 'ди', 'зо', 'бу', 'ше')
+    endings = ('а', 'ы', 'ой', 'ами', 'ий', 'ого', 'ение', 'ость', 'ка', 'ных')
+    words = list(_BENCH_WORDS)
+    while len(words) < size:
+        words.append(''.join(rng.choices(syllables, k=rng.randint(2, 4))) + rng.choice(endings))
+    return words
+
+
+def _synthetic_works(count, rng):
+    # Частоты слов по закону Ципфа, как в обычном тексте
+    vocabulary = _synthetic_vocabulary(rng)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    cumulative = list(itertools.accumulate(weights))
+
+    def text(words):
+        return ' '.join(rng.choices(vocabulary, cum_weights=cumulative, k=words))
+
+    return [{
+        'id': f'w{i}',
+        'title': text(4).capitalize(),
+        'description': text(40),
+        'area': rng.choice(_BENCH_AREAS),
+        'updated_at': '2025-01-01T00:00:00',
+    } for i in range(count)], vocabulary, cumulative
+
+
+def bench(count, queries, seed=1):
+    """Время построения индекса и поиска на синтетическом корпусе"""
+    rng = random.Random(seed)
+    works, vocabulary, cumulative = _synthetic_works(count, rng)
+    index = SearchIndex()
+    started = time.perf_counter()
+    index.sync(1, works)
+    build_s = time.perf_counter() - started
+
+    samples = [' '.join(rng.choices(vocabulary, cum_weights=cumulative, k=rng.randint(1, 3)))
+               for _ in range(queries)]
+    samples += [rng.choice(_BENCH_WORDS)[:4] for _ in range(queries // 4)]  # начало частого слова
+    latencies = []
+    for query in samples:
+        started = time.perf_counter()
+        index.search(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+
+    started = time.perf_counter()
+    works[0] = dict(works[0], title='Новое название', updated_at='2025-01-02T00:00:00')
+    index.update_work(works[0])
+    update_ms = (time.perf_counter() - started) * 1000
+    return {
+        'works': count,
+        'terms': len(index._postings),
+        'build_s': round(build_s, 2),
+        'update_ms': round(update_ms, 3),
+        'p50_ms': round(latencies[len(latencies) // 2], 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)], 2),
+        'max_ms': round(latencies[-1], 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Поиск по работам POSTPRESS')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('bench', help='замерить поиск на синтетическом корпусе')
+    bench_parser.add_argument('--works', type=int, default=100000)
+    bench_parser.add_argument('--queries', type=int, default=1000)
+    stem_parser = subparsers.add_parser('stem', help='показать основы слов')
+    stem_parser.add_argument('text')
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        result = bench(args.works, args.queries)
+        print(', '.join(f'{key}={value}' for key, value in result.items()))
+    elif args.command == 'stem':
+        print(' '.join(tokenize(args.text)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,591 @@
+"""SQLite-хранилище работ и заявок.
+
+Альтернатива JSON-файлам, включается переменной окружения STORAGE_BACKEND=sqlite.
+База работает в режиме WAL: читатели не блокируют писателя, а каждое изменение
+затрагивает только свои строки, без перезаписи всего набора данных.
+
+Интерфейс совпадает с storage.WorksStore и contacts_log.JsonlContactsStore, а список
+работ отдается в том же виде, что и раньше в /api/works.
+
+Запуск как скрипта:
+    python sqlite_storage.py migrate   # перенос data/works.json, data/contacts.json и data/contacts-*.jsonl в базу
+    python sqlite_storage.py export    # выгрузка работ в JSON в формате /api/works
+    python sqlite_storage.py bench [--sizes 1000 10000 50000]   # JSON против SQLite по мере роста данных
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from contacts_log import JsonlContactsStore
+from metrics import works_store_seconds
+
+logger = logging.getLogger(__name__)
+
+WORK_COLUMNS = ('id', 'title', 'description', 'area', 'created_at', 'updated_at')
+CONTACT_COLUMNS = ('name', 'phone', 'message', 'timestamp', 'ip_address', 'user_agent')
+MIGRATE_BATCH = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value NUMERIC NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('works_version', 0);
+
+CREATE TABLE IF NOT EXISTS works (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    area TEXT NOT NULL DEFAULT '',
+    created_at TEXT,
+    updated_at TEXT,
+    extra TEXT
+);
+
+CREATE TABLE IF NOT EXISTS work_images (
+    work_seq INTEGER NOT NULL REFERENCES works(seq) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    info TEXT,
+    PRIMARY KEY (work_seq, position)
+);
+CREATE INDEX IF NOT EXISTS idx_work_images_filename ON work_images(filename);
+
+CREATE TABLE IF NOT EXISTS contacts (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    message TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL,
+    ip_address TEXT,
+    user_agent TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_contacts_timestamp ON contacts(timestamp);
+"""
+
+
+class SqliteDatabase:
+    """Соединения с базой: по одному на поток, схема создается при первом подключении."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(SCHEMA)
+                    _upgrade_schema(conn)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    def transaction(self):
+        """Транзакция на запись (BEGIN IMMEDIATE сразу берет блокировку писателя)"""
+        return _Transaction(self.connection())
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+def _upgrade_schema(conn):
+    """Добавляет колонки, появившиеся после создания базы"""
+    image_columns = {row[1] for row in conn.execute('PRAGMA table_info(work_images)')}
+    if 'info' not in image_columns:
+        conn.execute('ALTER TABLE work_images ADD COLUMN info TEXT')
+
+
+def _split_work(work):
+    """Разделяет работу на колонки таблицы и прочие поля (хранятся в extra)"""
+    columns = {key: work.get(key) for key in WORK_COLUMNS}
+    columns['title'] = columns['title'] or ''
+    columns['description'] = columns['description'] or ''
+    columns['area'] = columns['area'] or ''
+    extra = {k: v for k, v in work.items() if k not in WORK_COLUMNS and k not in ('images', 'image_info')}
+    columns['extra'] = json.dumps(extra, ensure_ascii=False) if extra else None
+    return columns
+
+
+class SqliteWorksStore:
+    """Работы в SQLite с кэшем в памяти, который сверяется со счетчиком версий.
+
+    Каждое изменение увеличивает works_version в той же транзакции. Чтение без
+    изменений стоит одного запроса к meta. Свои изменения процесс применяет к
+    кэшу точечно, а чужие (другой воркер) приводят к однократной перезагрузке.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.RLock()
+        self._version = None
+        self._modified = None
+        self._index = {}
+        self._works = None
+
+    def _meta(self, conn):
+        rows = conn.execute("SELECT key, value FROM meta WHERE key IN ('works_version', 'works_modified')")
+        meta = dict(rows.fetchall())
+        return meta.get('works_version', 0), meta.get('works_modified')
+
+    def _read_work(self, conn, seq, images=None):
+        row = conn.execute('SELECT * FROM works WHERE seq = ?', (seq,)).fetchone()
+        if images is None:
+            images = [(r['filename'], r['info']) for r in conn.execute(
+                'SELECT filename, info FROM work_images WHERE work_seq = ? ORDER BY position', (seq,))]
+        return self._row_to_work(row, images)
+
+    @staticmethod
+    def _row_to_work(row, images):
+        """Собирает работу в формате /api/works; images — пары (filename, info JSON)"""
+        work = {
+            'id': row['id'],
+            'title': row['title'],
+            'description': row['description'],
+            'area': row['area'],
+            'images': [filename for filename, _ in images],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        }
+        if row['extra']:
+            work.update(json.loads(row['extra']))
+        image_info = {filename: json.loads(info) for filename, info in images if info}
+        if image_info:
+            work['image_info'] = image_info
+        return work
+
+    def _load(self):
+        with works_store_seconds.time(backend='sqlite', op='load'):
+            self._load_rows()
+
+    def _load_rows(self):
+        conn = self.db.connection()
+        # Одна транзакция на чтение — список и версия согласованы между собой
+        conn.execute('BEGIN')
+        try:
+            version, modified = self._meta(conn)
+            images = {}
+            for row in conn.execute('SELECT work_seq, filename, info FROM work_images ORDER BY work_seq, position'):
+                images.setdefault(row['work_seq'], []).append((row['filename'], row['info']))
+            index = {}
+            for row in conn.execute('SELECT * FROM works ORDER BY seq'):
+                index[row['id']] = self._row_to_work(row, images.get(row['seq'], []))
+        finally:
+            conn.execute('COMMIT')
+        logger.info(f"[WORKS] Загружено {len(index)} работ из {self.db.path}")
+        self._index, self._works = index, None
+        self._version, self._modified = version, modified
+
+    def _ensure_fresh(self):
+        if self._version is not None and self._meta(self.db.connection())[0] == self._version:
+            return
+        self._load()
+
+    def _list(self):
+        if self._works is None:
+            self._works = list(self._index.values())
+        return self._works
+
+    def all(self):
+        """Возвращает общий список работ. Изменять его нельзя."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._list()
+
+    def state(self):
+        """Возвращает (works, version, last_modified) для кэширования ответов"""
+        with self._lock:
+            self._ensure_fresh()
+            return self._list(), self._version, self._modified
+
+    def get(self, work_id):
+        """Возвращает работу по id или None. Изменять её нельзя."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._index.get(work_id)
+
+    def snapshot(self):
+        """Возвращает независимую копию списка работ"""
+        return copy.deepcopy(self.all())
+
+    def image_refs(self, filename):
+        """Сколько работ ссылается на файл изображения (по индексу filename)"""
+        row = self.db.connection().execute(
+            'SELECT COUNT(DISTINCT work_seq) AS refs FROM work_images WHERE filename = ?', (filename,)).fetchone()
+        return row['refs']
+
+    def find_image(self, filename):
+        """Метаданные изображения из любой ссылающейся работы ({} без метаданных) или None"""
+        row = self.db.connection().execute(
+            'SELECT info FROM work_images WHERE filename = ? LIMIT 1', (filename,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row['info']) if row['info'] else {}
+
+    def _seq(self, conn, work_id):
+        row = conn.execute('SELECT seq FROM works WHERE id = ?', (work_id,)).fetchone()
+        return row['seq'] if row else None
+
+    def _insert(self, conn, work):
+        columns = _split_work(work)
+        names = ', '.join(columns)
+        placeholders = ', '.join('?' for _ in columns)
+        cursor = conn.execute(f'INSERT INTO works ({names}) VALUES ({placeholders})', tuple(columns.values()))
+        image_info = work.get('image_info', {})
+        conn.executemany(
+            'INSERT INTO work_images (work_seq, position, filename, info) VALUES (?, ?, ?, ?)',
+            [(cursor.lastrowid, position, filename, _dump_info(image_info.get(filename)))
+             for position, filename in enumerate(work.get('images', []))])
+        return cursor.lastrowid
+
+    def _write(self, work_id, change, create=False):
+        """Выполняет change(conn, seq) в транзакции и точечно обновляет кэш.
+
+        change возвращает seq измененной работы или None, если работа удалена.
+        Без create несуществующая работа не меняется и возвращается None.
+        """
+        with self._lock:
+            with works_store_seconds.time(backend='sqlite', op='save'), self.db.transaction() as conn:
+                version, _ = self._meta(conn)
+                seq = self._seq(conn, work_id)
+                if seq is None and not create:
+                    return None
+                seq = change(conn, seq)
+                work = self._read_work(conn, seq) if seq is not None else None
+                modified = time.time()
+                conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                 [('works_version', version + 1), ('works_modified', modified)])
+
+            if self._version == version:
+                if work is None:
+                    self._index.pop(work_id, None)
+                else:
+                    self._index[work_id] = work
+                self._works = None
+                self._version, self._modified = version + 1, modified
+            else:
+                # Кэш отстал от базы — перечитаем целиком при следующем обращении
+                self._version = None
+            return work
+
+    def add(self, work):
+        """Добавляет работу"""
+        return self._write(work['id'], lambda conn, seq: self._insert(conn, work), create=True)
+
+    def update(self, work_id, fields):
+        """Обновляет поля работы. Возвращает обновленную работу или None."""
+        def change(conn, seq):
+            work = self._read_work(conn, seq, images=[])
+            work.update(fields)
+            columns = _split_work(work)
+            assignments = ', '.join(f'{name} = ?' for name in columns)
+            conn.execute(f'UPDATE works SET {assignments} WHERE seq = ?', (*columns.values(), seq))
+            return seq
+        return self._write(work_id, change)
+
+    def delete(self, work_id):
+        """Удаляет работу. Возвращает удаленную работу или None."""
+        removed = []
+        def change(conn, seq):
+            removed.append(self._read_work(conn, seq))
+            conn.execute('DELETE FROM works WHERE seq = ?', (seq,))
+            return None
+        self._write(work_id, change)
+        return removed[0] if removed else None
+
+    def add_image(self, work_id, filename, updated_at, info=None):
+        """Добавляет изображение (и его метаданные) в конец списка работы. Возвращает работу или None."""
+        return self.add_images(work_id, [(filename, info)], updated_at)
+
+    def add_images(self, work_id, images, updated_at):
+        """Добавляет несколько изображений одной транзакцией. images — [(имя, метаданные или None), ...]."""
+        def change(conn, seq):
+            for filename, info in images:
+                exists = conn.execute('SELECT 1 FROM work_images WHERE work_seq = ? AND filename = ?',
+                                      (seq, filename)).fetchone()
+                if exists:
+                    if info:
+                        conn.execute('UPDATE work_images SET info = ? WHERE work_seq = ? AND filename = ?',
+                                     (_dump_info(info), seq, filename))
+                else:
+                    conn.execute(
+                        'INSERT INTO work_images (work_seq, position, filename, info) '
+                        'SELECT ?, COALESCE(MAX(position), -1) + 1, ?, ? FROM work_images WHERE work_seq = ?',
+                        (seq, filename, _dump_info(info), seq))
+            conn.execute('UPDATE works SET updated_at = ? WHERE seq = ?', (updated_at, seq))
+            return seq
+        return self._write(work_id, change)
+
+    def update_image_info(self, updates):
+        """Дополняет метаданные изображений нескольких работ одной транзакцией, не трогая updated_at.
+
+        updates — {id работы: {имя: поля}}; удаленные работы и изображения пропускаются.
+        """
+        with self._lock:
+            with works_store_seconds.time(backend='sqlite', op='save'), self.db.transaction() as conn:
+                version, _ = self._meta(conn)
+                for work_id, infos in updates.items():
+                    seq = self._seq(conn, work_id)
+                    if seq is None:
+                        continue
+                    for filename, meta in infos.items():
+                        row = conn.execute('SELECT info FROM work_images WHERE work_seq = ? AND filename = ?',
+                                           (seq, filename)).fetchone()
+                        if row is not None:
+                            info = dict(json.loads(row['info']) if row['info'] else {}, **meta)
+                            conn.execute('UPDATE work_images SET info = ? WHERE work_seq = ? AND filename = ?',
+                                         (_dump_info(info), seq, filename))
+                conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                 [('works_version', version + 1), ('works_modified', time.time())])
+            # Кэш перечитается целиком при следующем обращении
+            self._version = None
+
+    def remove_image(self, work_id, filename):
+        """Убирает изображение из работы. Возвращает работу или None."""
+        def change(conn, seq):
+            conn.execute('DELETE FROM work_images WHERE work_seq = ? AND filename = ?', (seq, filename))
+            return seq
+        return self._write(work_id, change)
+
+    def save(self, works):
+        """Целиком заменяет список работ (миграции, импорт)"""
+        with self._lock:
+            with self.db.transaction() as conn:
+                version, _ = self._meta(conn)
+                conn.execute('DELETE FROM works')
+                for work in works:
+                    self._insert(conn, work)
+                conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                 [('works_version', version + 1), ('works_modified', time.time())])
+            self._version = None
+
+    def compact(self):
+        """Переносит WAL-журнал SQLite в основной файл базы"""
+        self.db.connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+class SqliteContactsStore:
+    """Заявки с контактной формы в таблице contacts."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def _insert(self, conn, contact):
+        columns = {key: contact.get(key) for key in CONTACT_COLUMNS}
+        columns['message'] = columns['message'] or ''
+        extra = {k: v for k, v in contact.items() if k not in CONTACT_COLUMNS}
+        columns['extra'] = json.dumps(extra, ensure_ascii=False) if extra else None
+        names = ', '.join(columns)
+        placeholders = ', '.join('?' for _ in columns)
+        conn.execute(f'INSERT INTO contacts ({names}) VALUES ({placeholders})', tuple(columns.values()))
+
+    def append(self, contact):
+        """Сохраняет одну заявку"""
+        with self.db.transaction() as conn:
+            self._insert(conn, contact)
+
+    def extend(self, contacts):
+        """Сохраняет пачку заявок одной транзакцией (миграция)"""
+        with self.db.transaction() as conn:
+            for contact in contacts:
+                self._insert(conn, contact)
+
+    def read_page(self, cursor=None, limit=100):
+        """Возвращает (заявки, следующий курсор) по возрастанию seq"""
+        after = int(cursor) if cursor else 0
+        rows = self.db.connection().execute(
+            'SELECT * FROM contacts WHERE seq > ? ORDER BY seq LIMIT ?', (after, limit)).fetchall()
+        records = []
+        for row in rows:
+            record = {key: row[key] for key in CONTACT_COLUMNS}
+            if row['extra']:
+                record.update(json.loads(row['extra']))
+            records.append(record)
+        return records, str(rows[-1]['seq']) if len(rows) == limit else None
+
+
+def _dump_info(info):
+    return json.dumps(info, ensure_ascii=False) if info else None
+
+
+def migrate_json(db, works_path, contacts_path, contacts_dir=None):
+    """Однократно переносит работы и заявки из JSON-файлов в пустую базу.
+
+    Заявки берутся из старого contacts.json (если он еще не перенесен в журнал
+    командой contacts_log.py import) и из сегментов журнала contacts-*.jsonl
+    в папке contacts_dir.
+    """
+    works_store = SqliteWorksStore(db)
+    if works_store.all():
+        raise RuntimeError(f"В базе {db.path} уже есть работы, миграция отменена")
+
+    works = []
+    if os.path.exists(works_path):
+        with open(works_path, 'r', encoding='utf-8') as f:
+            works = json.load(f)
+    works_store.save(works)
+
+    contacts_store = SqliteContactsStore(db)
+    log = JsonlContactsStore(contacts_dir) if contacts_dir and os.path.isdir(contacts_dir) else None
+    contacts_count = 0
+    if os.path.exists(contacts_path) and not (log and log.is_imported(contacts_path)):
+        with open(contacts_path, 'r', encoding='utf-8') as f:
+            contacts = json.load(f)
+        contacts_store.extend(contacts)
+        contacts_count += len(contacts)
+    if log is not None:
+        batch = []
+        for contact in log.iter_all():
+            batch.append(contact)
+            if len(batch) >= MIGRATE_BATCH:
+                contacts_store.extend(batch)
+                contacts_count += len(batch)
+                batch = []
+        contacts_store.extend(batch)
+        contacts_count += len(batch)
+
+    logger.info(f"[MIGRATE] Перенесено работ: {len(works)}, заявок: {contacts_count}")
+    return len(works), contacts_count
+
+
+def _p50_ms(samples):
+    samples = sorted(samples)
+    return round(samples[len(samples) // 2] * 1000, 3)
+
+
+def _timed(action, repeats):
+    samples = []
+    for i in range(repeats):
+        started = time.perf_counter()
+        action(i)
+        samples.append(time.perf_counter() - started)
+    return _p50_ms(samples)
+
+
+def bench(size):
+    """Латентность операций JSON- и SQLite-хранилищ при size работ и size заявок.
+
+    update — изменение одной работы; cold_read — чтение списка другим воркером
+    после чужого изменения; warm_read — повторное чтение без изменений;
+    contact — сохранение одной заявки (для JSON — прежняя перезапись contacts.json).
+    """
+    from storage import WorksStore, atomic_write_json, synthetic_works
+
+    repeats = max(3, min(50, 100_000 // size))
+    works = synthetic_works(size)
+    contact = {'name': 'Иван', 'phone': '+7 900 000-00-00', 'message': 'Нужна вывеска',
+               'timestamp': '2025-01-01T00:00:00', 'ip_address': '127.0.0.1', 'user_agent': 'bench'}
+    results = []
+    with tempfile.TemporaryDirectory(prefix='storage-bench-') as directory:
+        works_path = os.path.join(directory, 'works.json')
+        contacts_path = os.path.join(directory, 'contacts.json')
+        atomic_write_json(works_path, works)
+        atomic_write_json(contacts_path, [contact] * size)
+        writer, reader = WorksStore(works_path), WorksStore(works_path)
+        reader.all()
+
+        def json_contact(i):
+            with open(contacts_path, 'r', encoding='utf-8') as f:
+                contacts = json.load(f)
+            contacts.append(contact)
+            atomic_write_json(contacts_path, contacts)
+
+        results.append(('json', writer, reader, json_contact))
+
+        db = SqliteDatabase(os.path.join(directory, 'bench.db'))
+        SqliteWorksStore(db).save(works)
+        SqliteContactsStore(db).extend([contact] * size)
+        other_db = SqliteDatabase(db.path)  # «другой воркер» со своим соединением и кэшем
+        sqlite_writer, sqlite_reader = SqliteWorksStore(db), SqliteWorksStore(other_db)
+        sqlite_reader.all()
+        sqlite_contacts = SqliteContactsStore(db)
+        results.append(('sqlite', sqlite_writer, sqlite_reader, lambda i: sqlite_contacts.append(contact)))
+
+        rows = []
+        for backend, writer, reader, append_contact in results:
+            row = {'backend': backend, 'size': size, 'repeats': repeats}
+            update_samples, cold_samples = [], []
+            for i in range(repeats):
+                work_id = works[(i * 7919) % size]['id']
+                started = time.perf_counter()
+                writer.update(work_id, {'title': f'Изменено {i}'})
+                update_samples.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                reader.state()
+                cold_samples.append(time.perf_counter() - started)
+            row['update_ms'] = _p50_ms(update_samples)
+            row['cold_read_ms'] = _p50_ms(cold_samples)
+            row['warm_read_ms'] = _timed(lambda i: reader.state(), repeats)
+            row['contact_ms'] = _timed(append_contact, repeats)
+            rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(base_dir, 'data')
+
+    parser = argparse.ArgumentParser(description='Обслуживание SQLite-хранилища POSTPRESS')
+    parser.add_argument('--db', default=os.getenv('SQLITE_PATH', os.path.join(data_dir, 'postpress.db')))
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate = subparsers.add_parser('migrate', help='перенести works.json и заявки (contacts.json, журнал) в базу')
+    migrate.add_argument('--works', default=os.path.join(data_dir, 'works.json'))
+    migrate.add_argument('--contacts', default=os.path.join(data_dir, 'contacts.json'))
+    migrate.add_argument('--contacts-dir', default=data_dir, help='папка с сегментами contacts-*.jsonl')
+    export = subparsers.add_parser('export', help='выгрузить работы в JSON (формат /api/works)')
+    export.add_argument('--output', default='-')
+    bench_parser = subparsers.add_parser('bench', help='сравнить JSON и SQLite по мере роста данных')
+    bench_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10_000, 50_000])
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        logging.basicConfig(level=logging.WARNING)
+        for size in args.sizes:
+            for row in bench(size):
+                print(', '.join(f'{key}={value}' for key, value in row.items()))
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = SqliteDatabase(args.db)
+
+    if args.command == 'migrate':
+        works_count, contacts_count = migrate_json(db, args.works, args.contacts, args.contacts_dir)
+        print(f"Готово: {works_count} работ, {contacts_count} заявок -> {args.db}")
+    elif args.command == 'export':
+        data = json.dumps(SqliteWorksStore(db).all(), ensure_ascii=False, indent=2)
+        if args.output == '-':
+            sys.stdout.write(data + '\n')
+        else:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(data)
+
+
+if __name__ == '__main__':
+    main()
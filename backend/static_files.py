@@ -0,0 +1,151 @@
+"""Отдача загруженных изображений без nginx.
+
+Общие правила для бэкенда (app.py, через werkzeug.send_file) и локального
+сервера разработки (main.py, через send_upload): тип файла по расширению,
+включая HEIC/AVIF, ETag, поддержка Range и условных запросов, и долгий
+кэш с immutable для имен по содержимому — такой файл под своим именем
+никогда не меняется.
+
+Модуль не зависит от Flask и Pillow: main.py импортирует его напрямую.
+"""
+import email.utils
+import mimetypes
+import os
+import re
+
+# Имена из images.content_base/derivative_name: 32 hex-символа SHA-256 [+ _метка]
+CONTENT_NAME_RE = re.compile(r'^[0-9a-f]{32}(_[a-z0-9]+)?\.[a-z0-9]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+DEFAULT_MAX_AGE = 3600
+# В slim-образах нет /etc/mime.types, а во встроенной таблице Python нет HEIC
+UPLOAD_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.avif': 'image/avif',
+    '.heic': 'image/heic',
+    '.heif': 'image/heif',
+}
+
+
+def is_content_addressed(filename):
+    return CONTENT_NAME_RE.match(filename) is not None
+
+
+def upload_mimetype(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return UPLOAD_TYPES.get(ext) or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def upload_max_age(filename):
+    return IMMUTABLE_MAX_AGE if is_content_addressed(filename) else DEFAULT_MAX_AGE
+
+
+def cache_control(filename):
+    if is_content_addressed(filename):
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={DEFAULT_MAX_AGE}'
+
+
+def upload_etag(filename, stat):
+    """ETag без кавычек: для имен по содержимому — само имя, иначе время изменения и размер"""
+    if is_content_addressed(filename):
+        return filename
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def resolve_upload(folder, filename):
+    """Путь к файлу загрузки или None, если имя небезопасно или файла нет"""
+    if not filename or filename.startswith('.') or '/' in filename or '\\' in filename:
+        return None
+    path = os.path.join(folder, filename)
+    return path if os.path.isfile(path) else None
+
+
+def not_modified(etag, mtime, if_none_match, if_modified_since):
+    """Можно ли ответить 304 на условный запрос. Некорректная дата — TypeError/ValueError."""
+    if if_none_match:
+        tags = [tag.strip().removeprefix('W/').strip('"') for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+    if if_modified_since:
+        return int(mtime) <= email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+    return False
+
+
+def parse_range(header, size):
+    """Разбирает Range: bytes=... (один диапазон).
+
+    Returns:
+        tuple[int, int] | None: (начало, конец включительно) или None, если
+        заголовок отсутствует или не поддерживается — тогда отдается весь файл.
+
+    Raises:
+        ValueError: Диапазон вне файла (416).
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[6:].strip().partition('-')
+    try:
+        if start:
+            first = int(start)
+            last = int(end) if end else size - 1
+        else:
+            # bytes=-N — последние N байт
+            first = max(0, size - int(end))
+            last = size - 1
+    except ValueError:
+        return None
+    if first >= size or first > last:
+        raise ValueError('Диапазон вне файла')
+    return first, min(last, size - 1)
+
+
+def send_upload(handler, folder, filename):
+    """Отдает загрузку из BaseHTTPRequestHandler (main.py) через sendfile"""
+    path = resolve_upload(folder, filename)
+    if path is None:
+        handler.send_error(404, 'File not found')
+        return
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        etag = upload_etag(filename, stat)
+        try:
+            is_not_modified = not_modified(etag, stat.st_mtime, handler.headers.get('If-None-Match'),
+                                           handler.headers.get('If-Modified-Since'))
+        except (TypeError, ValueError):
+            is_not_modified = False
+        byte_range = None
+        if not is_not_modified and handler.headers.get('If-Range', f'"{etag}"').strip('"') == etag:
+            try:
+                byte_range = parse_range(handler.headers.get('Range'), stat.st_size)
+            except ValueError:
+                handler.send_response(416)
+                handler.send_header('Content-Range', f'bytes */{stat.st_size}')
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+                return
+
+        if is_not_modified:
+            handler.send_response(304)
+        elif byte_range is not None:
+            handler.send_response(206)
+            handler.send_header('Content-Range', f'bytes {byte_range[0]}-{byte_range[1]}/{stat.st_size}')
+        else:
+            handler.send_response(200)
+        offset, last = byte_range or (0, stat.st_size - 1)
+        handler.send_header('ETag', f'"{etag}"')
+        handler.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+        handler.send_header('Cache-Control', cache_control(filename))
+        handler.send_header('Accept-Ranges', 'bytes')
+        if is_not_modified:
+            handler.end_headers()
+            return
+        handler.send_header('Content-Type', upload_mimetype(filename))
+        handler.send_header('Content-Length', str(last - offset + 1))
+        handler.end_headers()
+        if handler.command != 'HEAD':
+            handler.wfile.flush()
+            # socket.sendfile использует os.sendfile, где он есть: байты не проходят через Python
+            handler.connection.sendfile(f, offset, last - offset + 1)
@@ -0,0 +1,603 @@
+"""Хранилище работ портфолио.
+
+Держит разобранный works.json в памяти процесса вместе с индексом id → работа
+и перечитывает файл только если изменились его mtime, размер или inode.
+Благодаря этому каждый воркер gunicorn видит правки, сделанные другими
+воркерами, но не разбирает JSON на каждый запрос.
+
+Каждое изменение выполняется под межпроцессной блокировкой (flock) поверх
+свежего состояния с диска, поэтому параллельные воркеры не теряют правки друг
+друга. Файл записывается атомарно: во временный файл, fsync, rename.
+
+В режиме журнала (WAL) изменение не переписывает works.json целиком, а
+дописывает одну строку в works.json.wal. Журнал периодически сворачивается
+в works.json. Операции журнала идемпотентны, поэтому повторное применение
+хвоста после сбоя во время сворачивания дает то же состояние.
+
+Запуск как скрипта:
+    python storage.py bench [--works 100 10000 100000]   # чтение до кэша, холодное и теплое
+    python storage.py stress [--processes 8] [--ops 50] [--wal]   # запись из нескольких процессов
+"""
+import contextlib
+import copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from metrics import works_store_seconds
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMPACT_EVERY = 200
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _stat_signature(st):
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def atomic_write_bytes(path, data):
+    """Атомарно заменяет файл: временный файл рядом, fsync, rename поверх оригинала"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    _fsync_directory(directory)
+
+
+def atomic_write_json(path, data):
+    """Атомарно записывает JSON в том же формате, что и раньше (indent=2)"""
+    atomic_write_bytes(path, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+def spool_upload(stream, path, max_bytes=None, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Копирует поток загрузки в файл кусками, считая SHA-256 и проверяя лимит.
+
+    В памяти одновременно находится не больше одного куска, поэтому размер
+    загрузки не влияет на потребление памяти воркером.
+
+    Args:
+        stream: Файлоподобный объект с методом read().
+        path: Куда записать байты.
+        max_bytes: Максимальный размер или None без ограничения.
+        chunk_size: Размер куска чтения.
+
+    Returns:
+        tuple[int, str]: Размер в байтах и SHA-256 в hex.
+
+    Raises:
+        ValueError: Если поток длиннее max_bytes (недописанный файл удаляется).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise ValueError(f"Файл слишком большой: больше {max_bytes} байт")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        raise
+    return size, digest.hexdigest()
+
+
+def _fsync_directory(directory):
+    """Фиксирует rename на диске (на платформах, где это возможно)"""
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Эксклюзивная межпроцессная блокировка на отдельном lock-файле"""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class WorksStore:
+    """Кэш списка работ, привязанный к состоянию файлов на диске.
+
+    Args:
+        path: Путь к works.json.
+        wal: Включить журнал изменений вместо полной перезаписи файла.
+        compact_every: Через сколько записей журнал сворачивается в works.json.
+    """
+
+    def __init__(self, path, wal=False, compact_every=DEFAULT_COMPACT_EVERY):
+        self.path = path
+        self.wal_path = path + '.wal'
+        self.lock_path = path + '.lock'
+        self.wal = wal
+        self.compact_every = max(1, compact_every)
+        self._lock = threading.RLock()
+        self._index = {}
+        self._works = None
+        self._base_signature = None
+        self._wal_inode = None
+        self._wal_offset = 0
+        self._wal_records = 0
+        self._loaded = False
+
+    # ---- чтение ----
+
+    def _wal_stat(self):
+        if not self.wal:
+            return None
+        try:
+            return os.stat(self.wal_path)
+        except FileNotFoundError:
+            return None
+
+    def _base_stat_signature(self):
+        try:
+            return _stat_signature(os.stat(self.path))
+        except FileNotFoundError:
+            return None
+
+    def _read_base(self):
+        """Читает works.json и возвращает (works, signature) прочитанной версии"""
+        with works_store_seconds.time(backend='json', op='load'):
+            return self._read_base_file()
+
+    def _read_base_file(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                signature = _stat_signature(os.fstat(f.fileno()))
+                works = json.load(f)
+        except FileNotFoundError:
+            logger.warning(f"[WORKS] Файл {self.path} не найден, возвращаем пустой список")
+            return [], None
+        except json.JSONDecodeError:
+            logger.error(f"[WORKS] Ошибка чтения JSON файла {self.path}, используем пустой список")
+            return [], self._base_stat_signature()
+        logger.info(f"[WORKS] Загружено {len(works)} работ из {self.path}")
+        return works, signature
+
+    def _replay_wal(self, offset):
+        """Применяет записи журнала начиная с offset. Недописанный хвост пропускается."""
+        try:
+            f = open(self.wal_path, 'rb')
+        except FileNotFoundError:
+            self._wal_inode, self._wal_offset = None, 0
+            return
+        with f:
+            self._wal_inode = os.fstat(f.fileno()).st_ino
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.error(f"[WORKS] Поврежденная запись журнала на смещении {offset}, пропускаем")
+                else:
+                    self._apply(record)
+                    self._wal_records += 1
+                offset += len(line)
+        self._wal_offset = offset
+
+    def _ensure_fresh(self):
+        """Подтягивает изменения с диска, сделанные этим или другими процессами"""
+        base_signature = self._base_stat_signature()
+        wal_st = self._wal_stat()
+        if self._loaded and base_signature == self._base_signature:
+            if wal_st is None and self._wal_inode is None:
+                return
+            if wal_st is not None and wal_st.st_ino == self._wal_inode:
+                if wal_st.st_size == self._wal_offset:
+                    return
+                if wal_st.st_size > self._wal_offset:
+                    # Журнал только дописан — применяем лишь новые записи
+                    self._replay_wal(self._wal_offset)
+                    self._works = None
+                    return
+
+        works, self._base_signature = self._read_base()
+        self._index = {w['id']: w for w in works}
+        self._works = works
+        self._wal_inode, self._wal_offset, self._wal_records = None, 0, 0
+        if self.wal:
+            self._replay_wal(0)
+            self._works = None
+        self._loaded = True
+
+    def _version(self):
+        return (self._base_signature, self._wal_inode, self._wal_offset)
+
+    def _last_modified(self):
+        mtimes = [self._base_signature[0] if self._base_signature else 0]
+        wal_st = self._wal_stat()
+        if wal_st is not None and wal_st.st_size:
+            mtimes.append(wal_st.st_mtime_ns)
+        return max(mtimes) / 1e9 if any(mtimes) else None
+
+    def _list(self):
+        if self._works is None:
+            self._works = list(self._index.values())
+        return self._works
+
+    def all(self):
+        """Возвращает общий список работ. Изменять его нельзя."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._list()
+
+    def state(self):
+        """Возвращает (works, version, last_modified) для кэширования ответов"""
+        with self._lock:
+            self._ensure_fresh()
+            return self._list(), self._version(), self._last_modified()
+
+    def get(self, work_id):
+        """Возвращает работу по id за O(1) или None. Изменять её нельзя."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._index.get(work_id)
+
+    def snapshot(self):
+        """Возвращает независимую копию списка работ для изменения и save()"""
+        with self._lock:
+            self._ensure_fresh()
+            return copy.deepcopy(self._list())
+
+    def image_refs(self, filename):
+        """Сколько работ ссылается на файл изображения"""
+        with self._lock:
+            self._ensure_fresh()
+            return sum(1 for work in self._index.values() if filename in work.get('images', []))
+
+    def find_image(self, filename):
+        """Метаданные изображения из любой ссылающейся работы ({} без метаданных) или None"""
+        with self._lock:
+            self._ensure_fresh()
+            for work in self._index.values():
+                if filename in work.get('images', []):
+                    return work.get('image_info', {}).get(filename, {})
+            return None
+
+    # ---- изменение ----
+
+    def _apply(self, record):
+        """Применяет одну операцию к индексу. Работы не мутируются, а заменяются копией."""
+        op = record['op']
+        work_id = record.get('id')
+        if op == 'add':
+            self._index[record['work']['id']] = record['work']
+            return record['work']
+        if op == 'update_image_info':
+            for work_id, images in record['works']:
+                work = self._index.get(work_id)
+                if work is None:
+                    continue
+                image_info = dict(work.get('image_info', {}))
+                for filename, meta in images:
+                    if filename in work.get('images', []):
+                        image_info[filename] = dict(image_info.get(filename) or {}, **meta)
+                self._index[work_id] = dict(work, image_info=image_info)
+            return None
+        work = self._index.get(work_id)
+        if work is None:
+            return None
+        if op == 'delete':
+            return self._index.pop(work_id)
+        work = dict(work, images=list(work.get('images', [])))
+        if op == 'update':
+            work.update(record['fields'])
+        elif op == 'add_image':
+            if record['filename'] not in work['images']:
+                work['images'].append(record['filename'])
+            if record.get('info'):
+                work['image_info'] = dict(work.get('image_info', {}), **{record['filename']: record['info']})
+            work['updated_at'] = record['updated_at']
+        elif op == 'add_images':
+            image_info = dict(work.get('image_info', {}))
+            for filename, info in record['images']:
+                if filename not in work['images']:
+                    work['images'].append(filename)
+                if info:
+                    image_info[filename] = info
+            if image_info:
+                work['image_info'] = image_info
+            work['updated_at'] = record['updated_at']
+        elif op == 'remove_image':
+            if record['filename'] in work['images']:
+                work['images'].remove(record['filename'])
+            if record['filename'] in work.get('image_info', {}):
+                work['image_info'] = {k: v for k, v in work['image_info'].items() if k != record['filename']}
+        else:
+            raise ValueError(f"Неизвестная операция журнала: {op}")
+        self._index[work_id] = work
+        return work
+
+    def _commit(self, record):
+        """Под блокировкой применяет операцию к свежему состоянию и сохраняет её"""
+        with self._lock, file_lock(self.lock_path):
+            self._ensure_fresh()
+            if 'id' in record and record['id'] not in self._index:
+                return None
+            try:
+                result = self._apply(record)
+                self._works = None
+                if self.wal:
+                    self._append_wal(record)
+                else:
+                    self._write_base()
+            except Exception:
+                # Состояние в памяти могло разойтись с диском — перечитаем при следующем обращении
+                self._loaded = False
+                raise
+            return result
+
+    def _append_wal(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        fd = os.open(self.wal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            with works_store_seconds.time(backend='json', op='wal_append'):
+                os.write(fd, line)
+                os.fsync(fd)
+            self._wal_inode = os.fstat(fd).st_ino
+        finally:
+            os.close(fd)
+        self._wal_offset += len(line)
+        self._wal_records += 1
+        if self._wal_records >= self.compact_every:
+            self._compact()
+
+    def _write_base(self):
+        works = self._list()
+        logger.info(f"[SAVE] Сохраняем {len(works)} работ в {self.path}")
+        with works_store_seconds.time(backend='json', op='save'):
+            atomic_write_json(self.path, works)
+        self._base_signature = self._base_stat_signature()
+
+    def _compact(self):
+        """Сворачивает журнал в works.json. Вызывается под блокировкой."""
+        logger.info(f"[SAVE] Сворачиваем журнал ({self._wal_records} записей) в {self.path}")
+        self._write_base()
+        # Новый пустой журнал получает другой inode — остальные воркеры перечитают базу
+        atomic_write_bytes(self.wal_path, b'')
+        self._wal_inode = os.stat(self.wal_path).st_ino
+        self._wal_offset = 0
+        self._wal_records = 0
+
+    def add(self, work):
+        """Добавляет работу"""
+        return self._commit({'op': 'add', 'work': work})
+
+    def update(self, work_id, fields):
+        """Обновляет поля работы. Возвращает обновленную работу или None."""
+        return self._commit({'op': 'update', 'id': work_id, 'fields': fields})
+
+    def delete(self, work_id):
+        """Удаляет работу. Возвращает удаленную работу или None."""
+        return self._commit({'op': 'delete', 'id': work_id})
+
+    def add_image(self, work_id, filename, updated_at, info=None):
+        """Добавляет изображение (и его метаданные) в конец списка работы. Возвращает работу или None."""
+        return self._commit({'op': 'add_image', 'id': work_id, 'filename': filename,
+                             'updated_at': updated_at, 'info': info})
+
+    def add_images(self, work_id, images, updated_at):
+        """Добавляет несколько изображений одной записью. images — [(имя, метаданные или None), ...]."""
+        return self._commit({'op': 'add_images', 'id': work_id, 'updated_at': updated_at,
+                             'images': [[filename, info] for filename, info in images]})
+
+    def update_image_info(self, updates):
+        """Дополняет метаданные изображений нескольких работ одной записью, не трогая updated_at.
+
+        updates — {id работы: {имя: поля}}; удаленные работы и изображения пропускаются.
+        """
+        self._commit({'op': 'update_image_info',
+                      'works': [[work_id, [[filename, meta] for filename, meta in infos.items()]]
+                                for work_id, infos in updates.items()]})
+
+    def remove_image(self, work_id, filename):
+        """Убирает изображение из работы. Возвращает работу или None."""
+        return self._commit({'op': 'remove_image', 'id': work_id, 'filename': filename})
+
+    def save(self, works):
+        """Целиком заменяет список работ (миграции, импорт)"""
+        with self._lock, file_lock(self.lock_path):
+            self._index = {w['id']: w for w in works}
+            self._works = None
+            try:
+                self._write_base()
+                if self.wal:
+                    atomic_write_bytes(self.wal_path, b'')
+            except Exception:
+                self._loaded = False
+                raise
+            self._loaded = False
+
+    def compact(self):
+        """Принудительно сворачивает журнал (например, при остановке)"""
+        if not self.wal:
+            return
+        with self._lock, file_lock(self.lock_path):
+            self._ensure_fresh()
+            if self._wal_offset:
+                self._compact()
+
+
+# ---- замеры и проверки (запуск как скрипта) ----
+
+def synthetic_works(count, prefix='w'):
+    """Работы в формате works.json для замеров: по три изображения с метаданными"""
+    works = []
+    for i in range(count):
+        images = [f'{prefix}{i:07d}-{n}.jpg' for n in range(3)]
+        works.append({
+            'id': f'{prefix}{i:07d}',
+            'title': f'Работа {i}',
+            'description': 'Печать на баннерной ткани, монтаж и демонтаж конструкции ' * 2,
+            'area': f'{i % 500} м²',
+            'images': images,
+            'image_info': {name: {'width': 1600, 'height': 1200, 'variants': []} for name in images},
+            'created_at': '2025-01-01T00:00:00',
+            'updated_at': '2025-01-01T00:00:00',
+        })
+    return works
+
+
+def _p50(samples):
+    samples = sorted(samples)
+    return round(samples[len(samples) // 2] * 1000, 3)
+
+
+def bench_reads(count):
+    """Латентность чтения списка работ для GET /api/works при count работах.
+
+    before_ms — как было до кэша: каждый запрос читает и разбирает works.json
+    и кодирует ответ. cold_ms — первый запрос после изменения файла (перечитать,
+    закодировать ответ заново). warm_ms — повторный запрос: проверка stat и
+    уже закодированный ответ из кэша (payload_cache).
+    """
+    import time
+    repeats = max(3, min(200, 200_000 // count))
+    with tempfile.TemporaryDirectory(prefix='works-bench-') as directory:
+        path = os.path.join(directory, 'works.json')
+        atomic_write_json(path, synthetic_works(count))
+
+        before = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            with open(path, 'r', encoding='utf-8') as f:
+                works = json.load(f)
+            json.dumps(works, ensure_ascii=False)
+            before.append(time.perf_counter() - started)
+
+        store = WorksStore(path)
+        cold, warm = [], []
+        for i in range(repeats):
+            os.utime(path, ns=(i, i))  # «чужая» запись: другой mtime — кэш устарел
+            started = time.perf_counter()
+            works = store.all()
+            json.dumps(works, ensure_ascii=False)
+            cold.append(time.perf_counter() - started)
+        for _ in range(repeats):
+            started = time.perf_counter()
+            store.state()
+            warm.append(time.perf_counter() - started)
+    return {'works': count, 'repeats': repeats,
+            'before_ms': _p50(before), 'cold_ms': _p50(cold), 'warm_ms': _p50(warm)}
+
+
+def _stress_worker(path, wal, worker, ops):
+    store = WorksStore(path, wal=wal, compact_every=25)
+    for i in range(ops):
+        work_id = f'p{worker}-{i}'
+        store.add({'id': work_id, 'title': work_id, 'images': [], 'created_at': '', 'updated_at': ''})
+        store.add_image(work_id, f'{work_id}.jpg', '')
+        # Общая работа: все процессы одновременно дописывают в неё изображения
+        store.add_image('shared', f'shared-{work_id}.jpg', '')
+        store.update(work_id, {'title': f'{work_id} (изменено)'})
+
+
+def stress(processes, ops, wal=False):
+    """Параллельные add/add_image/update из нескольких процессов на одном works.json.
+
+    Returns:
+        dict: Сколько работ и изображений ожидалось и найдено, валиден ли JSON на диске.
+    """
+    import multiprocessing
+    with tempfile.TemporaryDirectory(prefix='works-stress-') as directory:
+        path = os.path.join(directory, 'works.json')
+        WorksStore(path, wal=wal).save([{'id': 'shared', 'title': 'shared', 'images': [],
+                                          'created_at': '', 'updated_at': ''}])
+        context = multiprocessing.get_context('spawn')
+        workers = [context.Process(target=_stress_worker, args=(path, wal, n, ops)) for n in range(processes)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+
+        store = WorksStore(path, wal=wal)
+        store.compact()
+        with open(path, 'r', encoding='utf-8') as f:
+            on_disk = json.load(f)  # после сворачивания works.json — валидный JSON со всеми правками
+        works = {work['id']: work for work in store.all()}
+        own = [works.get(f'p{n}-{i}') for n in range(processes) for i in range(ops)]
+        result = {
+            'processes': processes,
+            'failed_processes': sum(1 for process in workers if process.exitcode != 0),
+            'works_expected': processes * ops + 1,
+            'works': len(works),
+            'works_on_disk': len(on_disk),
+            'renamed': sum(1 for work in own if work and work['title'].endswith('(изменено)')),
+            'images_expected': processes * ops * 2,
+            'images': sum(len(work.get('images', [])) for work in works.values()),
+            'shared_images': len(set(works['shared']['images'])),
+        }
+    result['ok'] = (result['failed_processes'] == 0
+                    and result['works'] == result['works_on_disk'] == result['works_expected']
+                    and result['renamed'] == processes * ops
+                    and result['images'] == result['images_expected']
+                    and result['shared_images'] == processes * ops)
+    return result
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Хранилище работ POSTPRESS: замеры и проверки')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('bench', help='латентность чтения списка работ до и после кэша')
+    bench_parser.add_argument('--works', type=int, nargs='+', default=[100, 10_000, 100_000])
+    stress_parser = subparsers.add_parser('stress', help='параллельная запись из нескольких процессов')
+    stress_parser.add_argument('--processes', type=int, default=8)
+    stress_parser.add_argument('--ops', type=int, default=50, help='работ на процесс')
+    stress_parser.add_argument('--wal', action='store_true', help='режим журнала')
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        for count in args.works:
+            print(', '.join(f'{key}={value}' for key, value in bench_reads(count).items()))
+    elif args.command == 'stress':
+        result = stress(args.processes, args.ops, wal=args.wal)
+        print(', '.join(f'{key}={value}' for key, value in result.items()))
+        if not result['ok']:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
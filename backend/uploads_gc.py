@@ -0,0 +1,358 @@
+"""Проверка целостности папки загрузок и сборка мусора.
+
+Файлы изображений удаляются обычным os.remove вне транзакции хранилища, а
+фолбэк загрузки пишет файл до того, как работа сохранена, поэтому в
+uploads/ со временем копятся файлы без ссылок (сироты), а работы могут
+ссылаться на пропавшие файлы. Сканер сверяет папку со ссылками из всех работ
+(мастер-файлы и производные версии, images.image_files()) и находит:
+
+- сирот — файлы, на которые не ссылается ни одна работа (кроме свежих:
+  обработанная загрузка лежит на диске чуть раньше, чем попадает в работу);
+  сиротой считается только файл с именем, которое дает сам бэкенд (MANAGED_NAME),
+  а положенные вручную файлы вроде logo.png, который отдает сайт, только
+  перечисляются в отчете и не удаляются;
+- пропавшие файлы — ссылки работ на файлы, которых нет;
+- дубликаты — файлы с одинаковым содержимым под разными именами;
+- расхождения — мастер-файлы, размер которых не совпадает с метаданными.
+
+Индекс папки хранится в SQLite (data/uploads_index.db) и обновляется
+инкрементально: если время изменения папки то же, она не читается вовсе,
+иначе os.scandir() дает только имена (без stat), и stat делается лишь для
+новых файлов. Файлы с именем по содержимому не меняются на месте, поэтому
+известные имена не перепроверяются (полная проверка — full=True). SHA-256
+считается только для файлов, размер которых совпал с размером другого файла.
+
+Сироты удаляются партиями: каждая партия заново сверяется со ссылками под
+той же блокировкой (IMAGE_REFS_LOCK), что и привязка и удаление изображений
+в app.py, и блокировка отпускается между партиями. Побайтовые дубликаты,
+на которые ссылаются работы, объединяет images.py dedupe.
+
+Запуск как скрипта:
+    python uploads_gc.py scan [--full] [--json]   # отчет о папке загрузок
+    python uploads_gc.py collect [--batch N] [--limit N] [--dry-run]   # удалить сирот
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+
+from images import file_sha256, image_files
+from storage import file_lock
+
+logger = logging.getLogger(__name__)
+
+ORPHAN_GRACE = 3600  # файлы моложе часа не считаются сиротами: загрузка еще может к ним привязаться
+GC_BATCH_SIZE = 500  # файлов в одной партии удаления (под одной блокировкой)
+REPORT_SAMPLE = 100  # сколько имен каждого вида показывать в отчете
+# Имена, которые дает бэкенд: SHA-256 или (у старых загрузок) UUID, версии с _метка, и временные файлы
+MANAGED_NAME = re.compile(
+    r'^(?:[0-9a-f]{32}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(?:_[a-z]+)?\.[0-9a-z]{1,8}$'
+    r'|^\..+\.tmp$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value NUMERIC NOT NULL
+);
+"""
+
+
+def _is_upload(name):
+    # Скрытые файлы — служебные (.gitkeep), кроме брошенных временных файлов _save_atomic
+    return not name.startswith('.') or name.endswith('.tmp')
+
+
+class UploadsIndex:
+    """Индекс папки загрузок в SQLite: имя, размер, mtime и (по надобности) SHA-256.
+
+    Args:
+        folder: Папка загрузок.
+        path: Файл базы индекса.
+    """
+
+    def __init__(self, folder, path):
+        self.folder = folder
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def refresh(self, full=False):
+        """Приводит индекс в соответствие с папкой.
+
+        Args:
+            full: Перечитать размеры всех файлов, даже если папка не менялась;
+                у файлов с изменившимся размером сбрасывается хэш.
+
+        Returns:
+            dict: listed (папка перечитана), added, removed, changed.
+        """
+        stats = {'listed': False, 'added': 0, 'removed': 0, 'changed': 0}
+        # Под блокировкой, чтобы два воркера не обновляли индекс одновременно
+        with file_lock(self.path + '.lock'), self._connect() as conn:
+            folder_mtime = os.stat(self.folder).st_mtime_ns
+            row = conn.execute("SELECT value FROM meta WHERE key = 'folder_mtime'").fetchone()
+            if not full and row is not None and row[0] == folder_mtime:
+                return stats
+            stats['listed'] = True
+
+            known = dict(conn.execute("SELECT name, size FROM files"))
+            present, added = set(), []
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if not _is_upload(entry.name) or not entry.is_file(follow_symlinks=False):
+                        continue
+                    present.add(entry.name)
+                    if entry.name in known and not full:
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        present.discard(entry.name)
+                        continue
+                    if entry.name in known and known[entry.name] == st.st_size:
+                        continue
+                    stats['changed' if entry.name in known else 'added'] += 1
+                    added.append((entry.name, st.st_size, st.st_mtime))
+
+            removed = [(name,) for name in known.keys() - present]
+            conn.executemany("DELETE FROM files WHERE name = ?", removed)
+            conn.executemany("INSERT OR REPLACE INTO files (name, size, mtime, sha256) VALUES (?, ?, ?, NULL)",
+                             added)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('folder_mtime', ?)", (folder_mtime,))
+            stats['removed'] = len(removed)
+        if stats['added'] or stats['removed'] or stats['changed']:
+            logger.info(f"[GC] Индекс загрузок обновлен: {stats}")
+        return stats
+
+    def files(self):
+        """{имя: (размер, mtime)} всех файлов в индексе"""
+        with self._connect() as conn:
+            return {name: (size, mtime) for name, size, mtime in conn.execute("SELECT name, size, mtime FROM files")}
+
+    def duplicate_groups(self):
+        """Группы имен с одинаковым содержимым (SHA-256 считается только при совпадении размеров)"""
+        with self._connect() as conn:
+            pending = conn.execute(
+                "SELECT name FROM files WHERE sha256 IS NULL AND size IN "
+                "(SELECT size FROM files GROUP BY size HAVING COUNT(*) > 1)").fetchall()
+        hashed = []
+        for (name,) in pending:
+            try:
+                hashed.append((file_sha256(os.path.join(self.folder, name)), name))
+            except FileNotFoundError:
+                continue
+        with self._connect() as conn:
+            conn.executemany("UPDATE files SET sha256 = ? WHERE name = ?", hashed)
+            rows = conn.execute(
+                "SELECT sha256, name FROM files WHERE sha256 IN "
+                "(SELECT sha256 FROM files WHERE sha256 IS NOT NULL GROUP BY sha256 HAVING COUNT(*) > 1) "
+                "ORDER BY sha256, name").fetchall()
+        groups = {}
+        for sha256, name in rows:
+            groups.setdefault(sha256, []).append(name)
+        return list(groups.values())
+
+    def forget(self, names):
+        """Убирает удаленные файлы из индекса"""
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM files WHERE name = ?", [(name,) for name in names])
+
+
+def references(works):
+    """Ссылки работ на файлы: {имя: (id работы, имя мастер-файла)} для мастеров и версий"""
+    refs = {}
+    for work in works:
+        image_info = work.get('image_info', {})
+        for filename in work.get('images', []):
+            for name in image_files(filename, image_info.get(filename)):
+                refs.setdefault(name, (work.get('id'), filename))
+    return refs
+
+
+def find_orphans(files, refs, grace=ORPHAN_GRACE, now=None):
+    """Имена файлов бэкенда без ссылок, которые старше grace секунд"""
+    cutoff = (now or time.time()) - grace
+    return sorted(name for name, (_, mtime) in files.items()
+                  if name not in refs and mtime < cutoff and MANAGED_NAME.match(name))
+
+
+def scan_uploads(index, works, full=False, grace=ORPHAN_GRACE):
+    """Отчет о папке загрузок: сироты, пропавшие файлы, дубликаты и расхождения размеров.
+
+    Args:
+        index: UploadsIndex папки загрузок.
+        works: Список работ (store.all()).
+        full: Перечитать всю папку (см. UploadsIndex.refresh()).
+        grace: Возраст в секундах, с которого файл без ссылок считается сиротой.
+
+    Returns:
+        dict: Счетчики и до REPORT_SAMPLE примеров каждого вида.
+    """
+    started = time.perf_counter()
+    refreshed = index.refresh(full=full)
+    files = index.files()
+    refs = references(works)
+
+    orphans = find_orphans(files, refs, grace)
+    unmanaged = sorted(name for name in files if name not in refs and not MANAGED_NAME.match(name))
+    missing = [{'work_id': work_id, 'filename': name, 'master': master, 'derivative': name != master}
+               for name, (work_id, master) in refs.items() if name not in files]
+    mismatched = []
+    for work in works:
+        for filename, info in work.get('image_info', {}).items():
+            if filename in files and info.get('bytes') is not None and info['bytes'] != files[filename][0]:
+                mismatched.append({'work_id': work.get('id'), 'filename': filename,
+                                   'expected_bytes': info['bytes'], 'bytes': files[filename][0]})
+    duplicates = index.duplicate_groups()
+
+    report = {
+        'index': refreshed,
+        'files': len(files),
+        'bytes': sum(size for size, _ in files.values()),
+        'referenced': sum(1 for name in refs if name in files),
+        'orphans': {
+            'count': len(orphans),
+            'bytes': sum(files[name][0] for name in orphans),
+            'sample': orphans[:REPORT_SAMPLE],
+        },
+        'unmanaged': {'count': len(unmanaged), 'sample': unmanaged[:REPORT_SAMPLE]},
+        'missing': {
+            'count': len(missing),
+            'masters': sum(1 for item in missing if not item['derivative']),
+            'sample': missing[:REPORT_SAMPLE],
+        },
+        'duplicates': {
+            'groups': len(duplicates),
+            'bytes': sum(files[group[0]][0] * (len(group) - 1) for group in duplicates if group[0] in files),
+            'sample': duplicates[:REPORT_SAMPLE],
+        },
+        'mismatched': {'count': len(mismatched), 'sample': mismatched[:REPORT_SAMPLE]},
+        'scan_ms': round((time.perf_counter() - started) * 1000),
+    }
+    logger.info(f"[GC] Скан загрузок: файлов {report['files']}, сирот {len(orphans)}, "
+                f"пропавших {len(missing)}, групп дубликатов {len(duplicates)}, за {report['scan_ms']} мс")
+    return report
+
+
+def collect_orphans(index, store, lock_path, batch_size=GC_BATCH_SIZE, limit=None, grace=ORPHAN_GRACE,
+                    dry_run=False):
+    """Удаляет сирот партиями, сверяя каждую партию со свежими ссылками под блокировкой.
+
+    Args:
+        index: UploadsIndex папки загрузок.
+        store: Хранилище работ.
+        lock_path: Блокировка ссылок на файлы (IMAGE_REFS_LOCK).
+        batch_size: Файлов в одной партии.
+        limit: Максимум файлов за вызов или None — все.
+        grace: Возраст в секундах, с которого файл без ссылок считается сиротой.
+        dry_run: Только посчитать.
+
+    Returns:
+        dict: candidates, removed, bytes_freed, skipped (нашлась ссылка или файла уже нет), remaining.
+    """
+    index.refresh()
+    files = index.files()
+    orphans = find_orphans(files, references(store.all()), grace)
+    batch = orphans[:limit] if limit else orphans
+    stats = {'candidates': len(orphans), 'removed': 0, 'bytes_freed': 0, 'skipped': 0,
+             'remaining': len(orphans) - len(batch)}
+    if dry_run:
+        stats['bytes_freed'] = sum(files[name][0] for name in batch)
+        return stats
+
+    for start in range(0, len(batch), batch_size):
+        removed = []
+        with file_lock(lock_path):
+            # Пока шел скан, к файлу могла привязаться загрузка
+            refs = references(store.all())
+            for name in batch[start:start + batch_size]:
+                if name in refs:
+                    stats['skipped'] += 1
+                    continue
+                try:
+                    os.remove(os.path.join(index.folder, name))
+                except FileNotFoundError:
+                    stats['skipped'] += 1
+                else:
+                    stats['removed'] += 1
+                    stats['bytes_freed'] += files[name][0]
+                removed.append(name)
+        index.forget(removed)
+        logger.info(f"[GC] Партия {start // batch_size + 1}: всего удалено {stats['removed']} файлов, "
+                    f"{stats['bytes_freed']} байт")
+    return stats
+
+
+def main(argv=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(base_dir, 'data')
+
+    parser = argparse.ArgumentParser(description='Проверка и очистка папки загрузок POSTPRESS')
+    parser.add_argument('--uploads', default=os.path.join(base_dir, 'uploads'))
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default=os.getenv('STORAGE_BACKEND', 'json'))
+    parser.add_argument('--works', default=os.path.join(data_dir, 'works.json'))
+    parser.add_argument('--db', default=os.getenv('SQLITE_PATH', os.path.join(data_dir, 'postpress.db')))
+    parser.add_argument('--index', default=os.path.join(data_dir, 'uploads_index.db'))
+    parser.add_argument('--lock', default=os.path.join(data_dir, 'uploads.lock'),
+                        help='блокировка ссылок на файлы (та же, что у бэкенда)')
+    parser.add_argument('--grace', type=int, default=ORPHAN_GRACE, help='минимальный возраст сироты, с')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    scan = subparsers.add_parser('scan', help='отчет: сироты, пропавшие файлы, дубликаты')
+    scan.add_argument('--full', action='store_true', help='перечитать все файлы, а не только изменения')
+    scan.add_argument('--json', action='store_true', help='вывести отчет целиком в JSON')
+    collect = subparsers.add_parser('collect', help='удалить файлы без ссылок')
+    collect.add_argument('--batch', type=int, default=GC_BATCH_SIZE, help='файлов в партии')
+    collect.add_argument('--limit', type=int, default=None, help='максимум файлов за запуск')
+    collect.add_argument('--dry-run', action='store_true', help='только посчитать')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.storage == 'sqlite':
+        from sqlite_storage import SqliteDatabase, SqliteWorksStore
+        store = SqliteWorksStore(SqliteDatabase(args.db))
+    else:
+        from storage import WorksStore
+        store = WorksStore(args.works)
+    index = UploadsIndex(args.uploads, args.index)
+
+    if args.command == 'scan':
+        report = scan_uploads(index, store.all(), full=args.full, grace=args.grace)
+        if args.json:
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            print(f"Файлов {report['files']} ({report['bytes']} байт), со ссылками {report['referenced']}")
+            print(f"Сирот {report['orphans']['count']} ({report['orphans']['bytes']} байт), "
+                  f"файлов не от бэкенда {report['unmanaged']['count']}")
+            print(f"Пропавших файлов {report['missing']['count']}, из них мастер-файлов {report['missing']['masters']}")
+            print(f"Групп дубликатов {report['duplicates']['groups']} ({report['duplicates']['bytes']} байт лишних)")
+            print(f"Расхождений размера {report['mismatched']['count']}, скан {report['scan_ms']} мс")
+    elif args.command == 'collect':
+        stats = collect_orphans(index, store, args.lock, batch_size=args.batch, limit=args.limit,
+                                grace=args.grace, dry_run=args.dry_run)
+        prefix = 'План' if args.dry_run else 'Готово'
+        print(f"{prefix}: сирот {stats['candidates']}, удалено {stats['removed']}, "
+              f"освобождается {stats['bytes_freed']} байт, пропущено {stats['skipped']}, "
+              f"осталось {stats['remaining']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Постраничная выборка работ с фильтрами и проекцией полей.
+
+Индексы (позиция по id, позиции по области, работы по дате создания)
+строятся один раз на версию данных хранилища и переиспользуются всеми
+запросами до следующего изменения, поэтому выборка страницы не сканирует
+весь список работ.
+
+Порядок выдачи совпадает с порядком работ в хранилище (как в /api/works без
+параметров). Курсор — "<позиция>.<id>" последней выданной работы: если эту
+работу успели удалить, выборка продолжится с её прежней позиции.
+
+grid_index() — компактный индекс для сетки портфолио: подпись и обложка с
+размерами и заглушкой, чтобы разметить всю сетку до загрузки изображений.
+"""
+import bisect
+import re
+import threading
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+# Любой из этих параметров переключает GET /api/works на постраничный ответ
+QUERY_PARAMS = ('limit', 'cursor', 'fields', 'area', 'since', 'until')
+FIELD_RE = re.compile(r'^([a-z_]+)(?:\[(\d+)\])?$')
+# Поле, которого нет в работе: число изображений (для сетки с images[0])
+VIRTUAL_FIELDS = {'image_count': lambda work: len(work.get('images', []))}
+# Версии обложки, из которых карточка сетки выбирает srcset (лайтбокс ей не нужен)
+GRID_VARIANTS = ('card', 'thumb')
+
+
+class QueryError(ValueError):
+    """Некорректные параметры выборки"""
+
+
+class WorksIndex:
+    """Индексы одной версии списка работ"""
+
+    def __init__(self, works):
+        self.works = works
+        self.position = {}
+        self.by_area = {}
+        dated = []
+        for i, work in enumerate(works):
+            self.position[work['id']] = i
+            self.by_area.setdefault(_area_key(work.get('area')), []).append(i)
+            dated.append((work.get('created_at') or '', i))
+        dated.sort()
+        self.dates = [date for date, _ in dated]
+        self.date_positions = [i for _, i in dated]
+
+    def _date_range(self, since, until):
+        lo = bisect.bisect_left(self.dates, since) if since else 0
+        hi = bisect.bisect_right(self.dates, until) if until else len(self.dates)
+        return lo, hi
+
+    def candidates(self, area=None, since=None, until=None):
+        """Позиции подходящих работ по возрастанию"""
+        if area is not None:
+            positions = self.by_area.get(_area_key(area), [])
+            if since or until:
+                positions = [i for i in positions if _in_range(self.works[i].get('created_at') or '', since, until)]
+            return positions
+        if since or until:
+            lo, hi = self._date_range(since, until)
+            return sorted(self.date_positions[lo:hi])
+        return range(len(self.works))
+
+    def resolve_cursor(self, cursor):
+        """Позиция, с которой продолжать выдачу"""
+        position, work_id = cursor
+        current = self.position.get(work_id)
+        # Работа удалена — продолжаем с её бывшей позиции (работы после неё сдвинулись на одну)
+        return current + 1 if current is not None else position
+
+
+class IndexCache:
+    """Индекс для текущей версии хранилища"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = None
+
+    def get(self, version, works):
+        with self._lock:
+            if self._index is None or version is None or version != self._version:
+                self._index = WorksIndex(works)
+                self._version = version
+            return self._index
+
+
+def _area_key(area):
+    return (area or '').strip().casefold()
+
+
+def _in_range(date, since, until):
+    return (not since or date >= since) and (not until or date <= until)
+
+
+def _date_bound(value, end=False):
+    """ISO-дата или дата-время как граница сравнения строк created_at"""
+    if not value:
+        return None
+    if not re.match(r'^\d{4}-\d{2}-\d{2}([T ][\d:.+\-]*)?$', value):
+        raise QueryError(f'Некорректная дата: {value}')
+    # Дата без времени в until включает весь день
+    return value + '\uffff' if end and len(value) == 10 else value
+
+
+def parse_cursor(value):
+    """Разбирает курсор "<позиция>.<id>" в (позиция, id)"""
+    if not value:
+        return None
+    position, _, work_id = value.partition('.')
+    if not position.isdigit() or not work_id:
+        raise QueryError('Некорректный курсор')
+    return int(position), work_id
+
+
+def parse_fields(value):
+    """Разбирает fields=id,title,images[0] в [(имя, индекс или None), ...]"""
+    if not value:
+        return None
+    fields = []
+    for token in value.split(','):
+        token = token.strip()
+        if not token:
+            continue
+        match = FIELD_RE.match(token)
+        if not match:
+            raise QueryError(f'Некорректное поле: {token}')
+        fields.append((match.group(1), int(match.group(2)) if match.group(2) is not None else None))
+    return fields
+
+
+def project(work, fields):
+    """Оставляет в работе только запрошенные поля"""
+    if fields is None:
+        return work
+    result = {}
+    for name, item in fields:
+        if name in VIRTUAL_FIELDS:
+            result[name] = VIRTUAL_FIELDS[name](work)
+        elif name not in work:
+            continue
+        elif item is not None and isinstance(work[name], list):
+            # images[0] -> images: [первое изображение], форма списка сохраняется
+            selected = result.setdefault(name, [])
+            if item < len(work[name]):
+                selected.append(work[name][item])
+        else:
+            result[name] = work[name]
+    if 'image_info' in result and 'images' in result:
+        # Метаданные только для выбранных изображений
+        result['image_info'] = {k: v for k, v in result['image_info'].items() if k in result['images']}
+    return result
+
+
+def parse_limit(args, default=DEFAULT_LIMIT):
+    """Размер страницы из request.args"""
+    try:
+        limit = int(args.get('limit', default))
+    except ValueError:
+        raise QueryError('limit должен быть числом')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise QueryError(f'limit должен быть от 1 до {MAX_LIMIT}')
+    return limit
+
+
+def parse_query(args):
+    """Параметры выборки из request.args"""
+    return {
+        'cursor': parse_cursor(args.get('cursor')),
+        'limit': parse_limit(args),
+        'fields': parse_fields(args.get('fields')),
+        'area': args.get('area'),
+        'since': _date_bound(args.get('since')),
+        'until': _date_bound(args.get('until'), end=True),
+    }
+
+
+def run_query(index, query):
+    """Страница работ: {'works', 'next_cursor', 'total'}"""
+    positions = index.candidates(query['area'], query['since'], query['until'])
+    start = 0
+    if query['cursor']:
+        after = index.resolve_cursor(query['cursor'])
+        start = bisect.bisect_left(positions, after)
+    page = positions[start:start + query['limit']]
+    works = [project(index.works[i], query['fields']) for i in page]
+    next_cursor = None
+    if start + len(page) < len(positions):
+        last = page[-1]
+        next_cursor = f"{last}.{index.works[last]['id']}"
+    return {'works': works, 'next_cursor': next_cursor, 'total': len(positions)}
+
+
+def grid_item(work):
+    """Запись сетки: id, подпись, число изображений и обложка (размеры, заглушка, версии)"""
+    images = work.get('images') or []
+    item = {
+        'id': work['id'],
+        'title': work.get('title', ''),
+        'area': work.get('area', ''),
+        'image_count': len(images),
+    }
+    if images:
+        info = (work.get('image_info') or {}).get(images[0]) or {}
+        item['cover'] = {
+            'filename': images[0],
+            'width': info.get('width', 0),
+            'height': info.get('height', 0),
+            'placeholder': info.get('placeholder'),
+            'color': info.get('color'),
+            'variants': [v for v in info.get('variants', []) if v.get('label') in GRID_VARIANTS],
+        }
+    return item
+
+
+def grid_index(works):
+    return {'works': [grid_item(work) for work in works], 'total': len(works)}
@@ -29,7 +29,157 @@ async function uploadImageToWork(workId, file) {
         try { const j = await resp.json(); errText = j.error || j.message || ''; } catch {}
         throw new Error(errText || `HTTP ${resp.status}`);
     }
-    return resp.json();
+    const data = await resp.json();
+    // 202: изображение обрабатывается в фоне — ждем завершения задания
+    if (resp.status === 202 && data.job_id) {
+        const job = await waitForImageJob(data.job_id);
+        return job.result;
+    }
+    return data;
+}
+
+// Пакетная загрузка: запрос не больше MAX_CONTENT_LENGTH (64MB, с запасом на multipart)
+// и не больше IMAGE_BATCH_MAX_FILES файлов
+const IMAGE_BATCH_MAX_BYTES = 60 * 1024 * 1024;
+const IMAGE_BATCH_MAX_FILES = 50;
+
+function splitIntoBatches(files) {
+    const batches = [];
+    let batch = [];
+    let batchBytes = 0;
+    for (const file of files) {
+        if (batch.length && (batchBytes + file.size > IMAGE_BATCH_MAX_BYTES || batch.length >= IMAGE_BATCH_MAX_FILES)) {
+            batches.push(batch);
+            batch = [];
+            batchBytes = 0;
+        }
+        batch.push(file);
+        batchBytes += file.size;
+    }
+    if (batch.length) batches.push(batch);
+    return batches;
+}
+
+// Большие исходники грузим кусками с продолжением после обрыва
+const RESUMABLE_THRESHOLD = 32 * 1024 * 1024;
+const RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024;
+const RESUMABLE_RETRIES = 5;
+
+async function readUploadResponse(resp) {
+    let data = {};
+    try { data = await resp.json(); } catch {}
+    if (!resp.ok) throw Object.assign(new Error(data.error || data.message || `HTTP ${resp.status}`), { status: resp.status });
+    return data;
+}
+
+// Helper: resumable upload of one large image (create → PATCH chunks → finalize)
+async function uploadImageResumable(workId, file) {
+    const session = await readUploadResponse(await fetch(`${API_BASE}/api/works/${workId}/uploads`, {
+        method: 'POST',
+        credentials: 'include',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size, mimetype: file.type })
+    }));
+    const uploadUrl = `${API_BASE}${session.upload_url}`;
+    let offset = 0;
+    let failures = 0;
+    while (offset < file.size) {
+        try {
+            const resp = await fetch(uploadUrl, {
+                method: 'PATCH',
+                credentials: 'include',
+                headers: { 'Upload-Offset': String(offset), 'Content-Type': 'application/offset+octet-stream' },
+                body: file.slice(offset, offset + RESUMABLE_CHUNK_SIZE)
+            });
+            if (resp.status === 409) {
+                // Сервер уже получил больше или меньше — продолжаем с его смещения
+                offset = (await resp.json()).offset;
+                continue;
+            }
+            offset = (await readUploadResponse(resp)).offset;
+            failures = 0;
+        } catch (e) {
+            if (e.status === 404 || ++failures > RESUMABLE_RETRIES) throw e;
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            // Узнаем, сколько байт сервер успел записать до обрыва
+            try {
+                offset = (await readUploadResponse(await fetch(uploadUrl, { credentials: 'include' }))).offset;
+            } catch {}
+        }
+    }
+    const resp = await fetch(`${uploadUrl}/finalize`, { method: 'POST', credentials: 'include' });
+    const data = await readUploadResponse(resp);
+    if (resp.status === 202 && data.job_id) {
+        return (await waitForImageJob(data.job_id)).result;
+    }
+    return data;
+}
+
+// Helper: upload several images to specific work.
+// Возвращает [{ file, result } | { file, error }]
+async function uploadImagesToWork(workId, files) {
+    const outcomes = [];
+    for (const file of files.filter(f => f.size > RESUMABLE_THRESHOLD)) {
+        try {
+            outcomes.push({ file, result: await uploadImageResumable(workId, file) });
+        } catch (e) {
+            outcomes.push({ file, error: e.message });
+        }
+    }
+    for (const batch of splitIntoBatches(files.filter(f => f.size <= RESUMABLE_THRESHOLD))) {
+        const fd = new FormData();
+        for (const file of batch) {
+            fd.append('images', await prepareImageForUpload(file));
+        }
+        let data = null;
+        try {
+            const resp = await fetch(`${API_BASE}/api/works/${workId}/images/batch`, {
+                method: 'POST',
+                credentials: 'include',
+                body: fd
+            });
+            try { data = await resp.json(); } catch {}
+            if (!data || !Array.isArray(data.results)) {
+                throw new Error((data && (data.error || data.message)) || `HTTP ${resp.status}`);
+            }
+        } catch (e) {
+            batch.forEach(file => outcomes.push({ file, error: e.message }));
+            continue;
+        }
+        batch.forEach((file, i) => {
+            const item = data.results[i] || {};
+            if (item.filename) outcomes.push({ file, result: item });
+            else outcomes.push({ file, error: item.error || data.error || 'Ошибка загрузки' });
+        });
+    }
+    return outcomes;
+}
+
+// Ждет завершения задания обработки: SSE, а если недоступно — опрос
+function waitForImageJob(jobId) {
+    const finish = (job, resolve, reject) => {
+        if (job.status === 'done') { resolve(job); return true; }
+        if (job.status === 'failed') { reject(new Error(job.error || 'Ошибка обработки изображения')); return true; }
+        return false;
+    };
+    const poll = (resolve, reject) => {
+        fetch(`${API_BASE}/api/image-jobs/${jobId}`, { credentials: 'include' })
+            .then(r => r.ok ? r.json() : Promise.reject(new Error(`HTTP ${r.status}`)))
+            .then(job => { if (!finish(job, resolve, reject)) setTimeout(() => poll(resolve, reject), 1000); })
+            .catch(reject);
+    };
+    return new Promise((resolve, reject) => {
+        if (typeof EventSource === 'undefined') { poll(resolve, reject); return; }
+        const source = new EventSource(`${API_BASE}/api/image-jobs/${jobId}/events`, { withCredentials: true });
+        source.onmessage = (event) => {
+            if (finish(JSON.parse(event.data), resolve, reject)) source.close();
+        };
+        source.onerror = () => {
+            // Обрыв или конец потока по таймауту: досматриваем опросом
+            source.close();
+            poll(resolve, reject);
+        };
+    });
 }
 
 function renderImagePreview() {
@@ -362,10 +512,11 @@ function hideWorkModal() {
 
 async function handleImageSelection(event) {
     const files = Array.from(event.target.files);
-    const maxSize = 64 * 1024 * 1024 * 8; // 64MB
+    const maxSize = 2 * 1024 * 1024 * 1024; // 2GB, как RESUMABLE_MAX_SIZE на сервере
+    const toUpload = [];
     for (const file of files) {
         if (file.size > maxSize) {
-            showNotification(`Файл "${file.name}" слишком большой. Максимальный размер: 32MB`, true);
+            showNotification(`Файл "${file.name}" слишком большой. Максимальный размер: 2GB`, true);
             continue;
         }
         if (file.size === 0) {
@@ -380,18 +531,26 @@ async function handleImageSelection(event) {
             selectedImages.push(file);
             renderImagePreview();
         } else {
-            try {
-                const result = await uploadImageToWork(currentWork.id, file);
-                existingImages.push(result.filename);
-                renderImagePreview();
-                showNotification('Изображение добавлено');
-            } catch (e) {
-                console.error('Ошибка загрузки:', e);
-                showNotification(`Ошибка загрузки "${file.name}": ${e.message}`, true);
-            }
+            toUpload.push(file);
         }
     }
     event.target.value = '';
+    if (!toUpload.length) return;
+    const outcomes = await uploadImagesToWork(currentWork.id, toUpload);
+    let added = 0;
+    for (const outcome of outcomes) {
+        if (outcome.error) {
+            console.error('Ошибка загрузки:', outcome.error);
+            showNotification(`Ошибка загрузки "${outcome.file.name}": ${outcome.error}`, true);
+            continue;
+        }
+        existingImages.push(outcome.result.filename);
+        added++;
+    }
+    if (added) {
+        renderImagePreview();
+        showNotification(added === 1 ? 'Изображение добавлено' : `Изображений добавлено: ${added}`);
+    }
 }
 
 // Remove selected image
@@ -536,15 +695,15 @@ async function handleWorkSave(event) {
         let uploadedCount = 0;
         let errorCount = 0;
         
-        for (let i = 0; i < selectedImages.length; i++) {
-            const originalImage = selectedImages[i];
-            try {
-                await uploadImageToWork(workId, originalImage);
-                uploadedCount++;
-            } catch (e) {
-                console.error('Ошибка загрузки:', e);
-                showNotification(`Ошибка загрузки "${originalImage.name}": ${e.message}`, true);
-                errorCount++;
+        if (selectedImages.length) {
+            for (const outcome of await uploadImagesToWork(workId, selectedImages)) {
+                if (outcome.error) {
+                    console.error('Ошибка загрузки:', outcome.error);
+                    showNotification(`Ошибка загрузки "${outcome.file.name}": ${outcome.error}`, true);
+                    errorCount++;
+                } else {
+                    uploadedCount++;
+                }
             }
         }
         
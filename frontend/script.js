@@ -37,27 +37,206 @@ function createPlaceholderImages() {
     return [];
 }
 
+// Image variants (уменьшенные версии из image_info, см. backend/images.py)
+function imageVariants(work, filename) {
+    const info = work.image_info && work.image_info[filename];
+    return info && info.variants ? info.variants : [];
+}
+
+// URL версии с нужной меткой (или ближайшей большей), иначе оригинала
+function variantUrl(variants, filename, label) {
+    const order = ['thumb', 'card', 'lightbox'];
+    const wanted = order.indexOf(label);
+    const variant = variants
+        .filter(v => v.jpg && order.indexOf(v.label) >= wanted)
+        .sort((a, b) => a.width - b.width)[0] || variants.find(v => v.jpg);
+    return `${UPLOAD_BASE}/uploads/${variant ? variant.jpg : filename}`;
+}
+
+function imageUrl(work, filename, label) {
+    return variantUrl(imageVariants(work, filename), filename, label);
+}
+
+// <picture> с srcset по всем версиям: браузер сам выберет формат и ширину.
+// deferred: адреса кладутся в data-src/data-srcset и подставляются позже (revealPicture)
+function variantsPictureHtml(filename, variants, sizes, attrs = '', deferred = false) {
+    const prefix = deferred ? 'data-' : '';
+    if (variants.length === 0) {
+        return `<img ${prefix}src="${UPLOAD_BASE}/uploads/${filename}" ${attrs}>`;
+    }
+    const srcset = ext => variants
+        .filter(v => v[ext])
+        .map(v => `${UPLOAD_BASE}/uploads/${v[ext]} ${v.width}w`)
+        .join(', ');
+    const sources = ['avif', 'webp']
+        .filter(ext => variants.some(v => v[ext]))
+        .map(ext => `<source type="image/${ext}" ${prefix}srcset="${srcset(ext)}" sizes="${sizes}">`)
+        .join('');
+    return `<picture>${sources}<img ${prefix}src="${variantUrl(variants, filename, 'card')}" ${prefix}srcset="${srcset('jpg')}" sizes="${sizes}" ${attrs}></picture>`;
+}
+
+function pictureHtml(work, filename, sizes, attrs = '') {
+    return variantsPictureHtml(filename, imageVariants(work, filename), sizes, attrs);
+}
+
+function revealPicture(container) {
+    container.querySelectorAll('[data-srcset]').forEach(el => {
+        el.srcset = el.dataset.srcset;
+        delete el.dataset.srcset;
+    });
+    container.querySelectorAll('img[data-src]').forEach(img => {
+        img.src = img.dataset.src;
+        delete img.dataset.src;
+    });
+}
+
 // Portfolio Variables
 let portfolioWorks = [];
 let currentWorkIndex = 0;
 let currentImageIndex = 0;
 
+// Сетка портфолио строится по компактному индексу /api/works/grid (подписи,
+// размеры обложек и заглушки LQIP), а полные данные работы загружаются при
+// открытии. В DOM живут только карточки видимых рядов; изображения карточек
+// запрашиваются, когда карточка подходит к области видимости.
+const PORTFOLIO_OVERSCAN_ROWS = 2;
+const PORTFOLIO_ROW_ESTIMATE = 400;  // px, до первого замера карточки
+const PORTFOLIO_CARD_SIZES = '(max-width: 480px) 100vw, (max-width: 1024px) 50vw, 400px';
+
+let portfolioGrid = null;  // { element, items, cards, rowHeight, measured, first, last, columns, observer }
+
+function portfolioCardHtml(item, index) {
+    const cover = item.cover;
+    // Размеры обложки известны заранее — браузер не ждет заголовков файла для разметки
+    const size = cover && cover.width && cover.height ? ` width="${cover.width}" height="${cover.height}"` : '';
+    const attrs = `alt="${item.title || 'Работа'}" class="portfolio-cover" decoding="async" onload="this.classList.add('loaded')"${size}`;
+    return `
+            <div class="portfolio-item" onclick="openPortfolioModal(${index})">
+                <div class="portfolio-image"${cover && cover.color ? ` style="background-color: ${cover.color}"` : ''}>
+                    ${cover && cover.placeholder ?
+                        `<div class="portfolio-placeholder" style="background-image: url('${cover.placeholder}')"></div>` : ''
+                    }
+                    ${cover ? variantsPictureHtml(cover.filename, cover.variants || [], PORTFOLIO_CARD_SIZES, attrs, true) : ''}
+                    ${item.image_count > 1 ? 
+                        `<div class="portfolio-images-count">📷 ${item.image_count} фото</div>` : ''
+                    }
+                </div>
+                <div class="portfolio-content">
+                    <h3 class="portfolio-title">${item.title || 'Без названия'}</h3>
+                    ${item.area ? `<div class="portfolio-area">${item.area}</div>` : ''}
+                </div>
+            </div>
+        `;
+}
+
+function portfolioCard(index) {
+    let card = portfolioGrid.cards.get(index);
+    if (!card) {
+        const template = document.createElement('template');
+        template.innerHTML = portfolioCardHtml(portfolioGrid.items[index], index).trim();
+        card = template.content.firstElementChild;
+        portfolioGrid.cards.set(index, card);
+        portfolioGrid.observer.observe(card);
+    }
+    return card;
+}
+
+// Отрисовывает ряды, попадающие в окно просмотра (с запасом); остальные ряды
+// заменены отступами сверху и снизу той же высоты
+function renderPortfolioWindow(force = false) {
+    const state = portfolioGrid;
+    if (!state) return;
+    const grid = state.element;
+    const style = getComputedStyle(grid);
+    const columns = Math.max(1, style.gridTemplateColumns.split(' ').filter(Boolean).length);
+    const gap = parseFloat(style.rowGap) || 0;
+    const rows = Math.ceil(state.items.length / columns);
+    const top = -grid.getBoundingClientRect().top;
+    const first = Math.min(rows, Math.max(0, Math.floor(top / state.rowHeight) - PORTFOLIO_OVERSCAN_ROWS));
+    const last = Math.min(rows, Math.max(first, Math.ceil((top + window.innerHeight) / state.rowHeight) + PORTFOLIO_OVERSCAN_ROWS));
+    if (!force && first === state.first && last === state.last && columns === state.columns) return;
+    state.first = first;
+    state.last = last;
+    state.columns = columns;
+
+    const visible = [];
+    const end = Math.min(state.items.length, last * columns);
+    for (let i = first * columns; i < end; i++) visible.push(i);
+    const keep = new Set(visible);
+    state.cards.forEach((card, index) => {
+        if (!keep.has(index)) {
+            state.observer.unobserve(card);
+            state.cards.delete(index);
+        }
+    });
+    // Уже созданные карточки переносятся, а не пересоздаются — загруженные изображения остаются
+    grid.replaceChildren(...visible.map(portfolioCard));
+    grid.style.paddingTop = `${first * state.rowHeight}px`;
+    grid.style.paddingBottom = `${Math.max(0, (rows - last) * state.rowHeight - gap)}px`;
+
+    // Высота ряда — по самой высокой карточке: все ряды одинаковые, отступы точные
+    let tallest = 0;
+    for (const card of grid.children) tallest = Math.max(tallest, card.offsetHeight);
+    if (tallest && (!state.measured || tallest + gap > state.rowHeight)) {
+        state.measured = true;
+        state.rowHeight = tallest + gap;
+        grid.style.gridAutoRows = `${tallest}px`;
+        renderPortfolioWindow(true);
+    }
+}
+
+function schedulePortfolioRender(force = false) {
+    if (!portfolioGrid || portfolioGrid.frame) return;
+    portfolioGrid.frame = requestAnimationFrame(() => {
+        portfolioGrid.frame = null;
+        renderPortfolioWindow(force);
+    });
+}
+
+function setupPortfolioGrid(element, items) {
+    if (portfolioGrid) portfolioGrid.observer.disconnect();
+    const observer = new IntersectionObserver((entries) => {
+        entries.forEach(entry => {
+            if (entry.isIntersecting) {
+                revealPicture(entry.target);
+                observer.unobserve(entry.target);
+            }
+        });
+    }, { rootMargin: '200px 0px' });
+    portfolioGrid = {
+        element, items, observer,
+        cards: new Map(),
+        rowHeight: PORTFOLIO_ROW_ESTIMATE,
+        measured: false,
+        first: -1, last: -1, columns: 0,
+        frame: null
+    };
+    element.innerHTML = '';
+    element.classList.add('virtual');
+    renderPortfolioWindow(true);
+}
+
+window.addEventListener('scroll', () => schedulePortfolioRender(), { passive: true });
+window.addEventListener('resize', () => schedulePortfolioRender(true));
+
 // Load portfolio works
 async function loadPortfolio() {
     try {
-        const response = await fetch(`${API_BASE}/api/works`);
-        if (!response.ok) throw new Error('Ошибка загрузки портфолио');
-        
-        portfolioWorks = await response.json();
-        const portfolioGrid = document.getElementById('portfolioGrid');
+        const gridElement = document.getElementById('portfolioGrid');
         
-        if (!portfolioGrid) {
+        if (!gridElement) {
             console.error('portfolioGrid не найден');
             return;
         }
         
+        const response = await fetch(`${API_BASE}/api/works/grid`);
+        if (!response.ok) throw new Error('Ошибка загрузки портфолио');
+        const index = await response.json();
+        // Копия: openPortfolioModal заменяет записи полными работами, а сетке нужны записи индекса
+        portfolioWorks = [...index.works];
+        
         if (portfolioWorks.length === 0) {
-            portfolioGrid.innerHTML = `
+            gridElement.innerHTML = `
                 <div class="empty-portfolio">
                     <div class="empty-portfolio-icon">📷</div>
                     <h3>Портфолио пока пусто</h3>
@@ -67,29 +246,16 @@ async function loadPortfolio() {
             return;
         }
         
-        // Генерируем HTML для работ в виде сетки (без описаний в карточках)
-        portfolioGrid.innerHTML = portfolioWorks.map((work, index) => `
-            <div class="portfolio-item" onclick="openPortfolioModal(${index})">
-                <div class="portfolio-image" ${work.images && work.images[0] ? `style="background-image: url('${UPLOAD_BASE}/uploads/${work.images[0]}')"` : ''}>
-                    ${work.images && work.images.length > 1 ? 
-                        `<div class="portfolio-images-count">📷 ${work.images.length} фото</div>` : ''
-                    }
-                </div>
-                <div class="portfolio-content">
-                    <h3 class="portfolio-title">${work.title || 'Без названия'}</h3>
-                    ${work.area ? `<div class="portfolio-area">${work.area}</div>` : ''}
-                </div>
-            </div>
-        `).join('');
+        setupPortfolioGrid(gridElement, index.works);
         
     } catch (error) {
         console.error('Ошибка загрузки портфолио:', error);
         showNotification('Не удалось загрузить портфолио', true);
         
         // Показываем плейсхолдер при ошибке
-        const portfolioGrid = document.getElementById('portfolioGrid');
-        if (portfolioGrid) {
-            portfolioGrid.innerHTML = `
+        const gridElement = document.getElementById('portfolioGrid');
+        if (gridElement) {
+            gridElement.innerHTML = `
                 <div class="empty-portfolio">
                     <div class="empty-portfolio-icon">⚠️</div>
                     <h3>Ошибка загрузки</h3>
@@ -108,6 +274,13 @@ async function openPortfolioModal(index) {
             return;
         }
         
+        // В сетке только обложка — догружаем работу целиком
+        if (!('description' in portfolioWorks[index])) {
+            const response = await fetch(`${API_BASE}/api/works/${encodeURIComponent(portfolioWorks[index].id)}`);
+            if (!response.ok) throw new Error('Ошибка загрузки работы');
+            portfolioWorks[index] = await response.json();
+        }
+        
         currentWorkIndex = index;
         currentImageIndex = 0;
         const work = portfolioWorks[index];
@@ -125,7 +298,7 @@ async function openPortfolioModal(index) {
                 
                 <div class="modal-image-container">
                     <div class="modal-image-wrapper">
-                        <img src="${work.images && work.images[0] ? `${UPLOAD_BASE}/uploads/${work.images[0]}` : '/uploads/placeholder.jpg'}" 
+                        <img src="${work.images && work.images[0] ? imageUrl(work, work.images[0], 'lightbox') : '/uploads/placeholder.jpg'}" 
                              alt="${work.title || 'Работа'}" 
                              class="modal-image"
                              onerror="this.src='/uploads/placeholder.jpg'">
@@ -159,7 +332,7 @@ async function openPortfolioModal(index) {
                         ${work.images.map((img, i) => `
                             <div class="modal-thumbnail ${i === 0 ? 'active' : ''}" 
                                  onclick="changeModalImageByIndex(${i})">
-                                <img src="${UPLOAD_BASE}/uploads/${img}" alt="" onerror="this.src='/uploads/placeholder.jpg'">
+                                <img src="${imageUrl(work, img, 'thumb')}" alt="" loading="lazy" onerror="this.src='/uploads/placeholder.jpg'">
                             </div>
                         `).join('')}
                     </div>
@@ -276,7 +449,7 @@ function changeModalImageByIndex(imageIndex) {
         
         // Change image after a short delay
         setTimeout(() => {
-            currentImg.src = `${UPLOAD_BASE}/uploads/${work.images[imageIndex]}`;
+            currentImg.src = imageUrl(work, work.images[imageIndex], 'lightbox');
             currentImg.classList.remove('switching');
         }, 100);
     }
@@ -4,38 +4,97 @@ POSTPRESS - Local Development Server
 Простой локальный сервер для тестирования frontend части сайта элитной упаковки
 """
 
+import http.client
 import http.server
-import socketserver
+import queue
+import time
 import webbrowser
 import os
 import sys
 from pathlib import Path
 import urllib.request
 import urllib.error
-from urllib.parse import urljoin
+from urllib.parse import unquote, urlsplit
 
 # Конфигурация
 PORT = 8000
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FRONTEND_DIR = os.path.join(BASE_DIR, "frontend")
+UPLOADS_DIR = os.path.join(BASE_DIR, "backend", "uploads")
 BACKEND_URL = "http://localhost:5000"  # URL бэкенда
+PROXY_POOL_SIZE = 8          # keep-alive соединений к бэкенду в запасе
+PROXY_IDLE_TIMEOUT = 4.0     # uvicorn закрывает простаивающие соединения через 5 с
+PROXY_TIMEOUT = 120          # как --timeout у gunicorn
+PROXY_CHUNK_SIZE = 64 * 1024
+# Заголовки одного соединения, которые прокси не пересылает
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+              'transfer-encoding', 'upgrade', 'host', 'content-length'}
+
+# Загрузки отдаются по тем же правилам, что и в бэкенде
+sys.path.insert(0, os.path.join(BASE_DIR, "backend"))
+from static_files import send_upload  # noqa: E402
+
+class ClientAborted(Exception):
+    """Клиент закрыл соединение, не отправив тело запроса целиком"""
+
+
+class BackendPool:
+    """Keep-alive соединения к бэкенду, общие для потоков сервера"""
+    
+    def __init__(self, url, size=PROXY_POOL_SIZE):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self._idle = queue.LifoQueue(maxsize=size)
+    
+    def connect(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=PROXY_TIMEOUT)
+    
+    def acquire(self):
+        """Возвращает (соединение, было ли оно уже использовано)"""
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return self.connect(), False
+            if time.monotonic() - released_at < PROXY_IDLE_TIMEOUT:
+                return conn, True
+            conn.close()
+    
+    def release(self, conn, response):
+        """Возвращает соединение в запас, если бэкенд не просил его закрыть"""
+        if response.will_close:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait((conn, time.monotonic()))
+        except queue.Full:
+            conn.close()
+
+
+backend_pool = BackendPool(BACKEND_URL)
+
 
 class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     """Кастомный обработчик для корректной работы с HTML файлами и API запросами"""
     
+    # keep-alive с браузером: каждый ответ несет Content-Length или идет чанками
+    protocol_version = 'HTTP/1.1'
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=FRONTEND_DIR, **kwargs)
     
     def end_headers(self):
         # Добавляем CORS заголовки для локальной разработки
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, PUT, DELETE')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, PUT, PATCH, DELETE')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Upload-Offset')
         super().end_headers()
     
     def do_OPTIONS(self):
         """Обработка CORS preflight запросов"""
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
     def do_GET(self):
@@ -46,18 +105,8 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             return
         # Обрабатываем запросы к изображениям
         elif self.path.startswith('/uploads/'):
-            filename = os.path.basename(self.path)
-            file_path = os.path.join(BASE_DIR, 'backend', 'uploads', filename)
-            if os.path.exists(file_path):
-                self.send_response(200)
-                self.send_header('Content-type', 'image/jpeg')
-                self.end_headers()
-                with open(file_path, 'rb') as f:
-                    self.wfile.write(f.read())
-                return
-            else:
-                self.send_error(404, "File not found")
-                return
+            send_upload(self, UPLOADS_DIR, unquote(urlsplit(self.path).path[len('/uploads/'):]))
+            return
             
         # Для остальных запросов показываем статические файлы
         if self.path == '/':
@@ -67,6 +116,16 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         
         return super().do_GET()
     
+    def do_HEAD(self):
+        """Обработка HEAD запросов"""
+        if self.path.startswith('/api/'):
+            self.proxy_request('HEAD')
+            return
+        if self.path.startswith('/uploads/'):
+            send_upload(self, UPLOADS_DIR, unquote(urlsplit(self.path).path[len('/uploads/'):]))
+            return
+        return super().do_HEAD()
+    
     def do_POST(self):
         """Обработка POST запросов"""
         if self.path.startswith('/api/'):
@@ -81,6 +140,13 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             return
         self.send_error(404, "Not Found")
     
+    def do_PATCH(self):
+        """Обработка PATCH запросов (куски возобновляемой загрузки)"""
+        if self.path.startswith('/api/'):
+            self.proxy_request('PATCH')
+            return
+        self.send_error(404, "Not Found")
+    
     def do_DELETE(self):
         """Обработка DELETE запросов"""
         if self.path.startswith('/api/'):
@@ -89,45 +155,109 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         self.send_error(404, "Not Found")
     
     def proxy_request(self, method):
-        """Проксирование запросов на бэкенд"""
+        """Проксирование запросов на бэкенд потоком, через keep-alive соединения"""
+        length = int(self.headers.get('Content-Length') or 0)
+        chunked = 'chunked' in self.headers.get('Transfer-Encoding', '').lower()
+        has_body = length > 0 or chunked
         try:
-            # Формируем URL для бэкенда
-            backend_url = urljoin(BACKEND_URL, self.path)
-            
-            # Читаем тело запроса, если есть
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length) if content_length > 0 else None
-            
-            # Создаем запрос
-            request = urllib.request.Request(
-                backend_url,
-                data=body,
-                method=method,
-                headers={k: v for k, v in self.headers.items() if k.lower() not in ['host', 'content-length']}
-            )
-            
-            # Отправляем запрос на бэкенд
-            with urllib.request.urlopen(request) as response:
-                # Копируем статус и заголовки
-                self.send_response(response.status)
-                for header, value in response.getheaders():
-                    if header.lower() not in ['server', 'date', 'transfer-encoding']:
-                        self.send_header(header, value)
-                self.end_headers()
-                
-                # Копируем тело ответа
-                self.wfile.write(response.read())
-                
-        except urllib.error.HTTPError as e:
-            self.send_response(e.code)
-            for header, value in e.headers.items():
-                if header.lower() not in ['server', 'date', 'transfer-encoding']:
-                    self.send_header(header, value)
-            self.end_headers()
-            self.wfile.write(e.read())
-            
+            conn, reused = backend_pool.acquire()
+            try:
+                response = self._forward_request(conn, method, length, chunked)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # Бэкенд закрыл простаивавшее соединение: повторяем, только если тело еще не прочитано
+                if not reused or has_body:
+                    raise
+                conn = backend_pool.connect()
+                response = self._forward_request(conn, method, length, chunked)
+        except ClientAborted:
+            conn.close()
+            self.close_connection = True
+            return
         except Exception as e:
-            self.send_error(500, f"Proxy Error: {str(e)}")
+            conn.close()
+            # Текст ошибки — в теле: строка статуса допускает только latin-1
+            self.send_error(502, "Proxy Error", explain=str(e))
+            return
+        
+        try:
+            self._forward_response(method, response)
+        except (ConnectionResetError, BrokenPipeError):
+            # Браузер ушел, не дочитав ответ (например, закрыл поток SSE)
+            self.close_connection = True
+            conn.close()
+            return
+        backend_pool.release(conn, response)
+    
+    def _forward_request(self, conn, method, length, chunked):
+        """Отправляет запрос бэкенду, передавая тело кусками по мере чтения от клиента"""
+        conn.putrequest(method, self.path, skip_accept_encoding=True)
+        for header, value in self.headers.items():
+            if header.lower() not in HOP_BY_HOP:
+                conn.putheader(header, value)
+        if chunked:
+            conn.putheader('Transfer-Encoding', 'chunked')
+        elif length or method in ('POST', 'PUT'):
+            conn.putheader('Content-Length', str(length))
+        conn.endheaders()
+        
+        if chunked:
+            while True:
+                size = int(self.rfile.readline().split(b';', 1)[0].strip() or b'0', 16)
+                if not size:
+                    # Последний кусок; трейлеры клиента (до пустой строки) не пересылаем
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    conn.send(b'0\r\n\r\n')
+                    break
+                data = self.rfile.read(size)
+                self.rfile.readline()  # CRLF после куска
+                conn.send(b'%x\r\n%s\r\n' % (size, data))
+        else:
+            remaining = length
+            while remaining > 0:
+                data = self.rfile.read(min(PROXY_CHUNK_SIZE, remaining))
+                if not data:
+                    raise ClientAborted()
+                conn.send(data)
+                remaining -= len(data)
+        return conn.getresponse()
+    
+    def _forward_response(self, method, response):
+        """Пересылает ответ бэкенда клиенту по мере поступления"""
+        self.send_response(response.status, response.reason)
+        for header, value in response.getheaders():
+            if header.lower() not in HOP_BY_HOP and header.lower() not in ('server', 'date'):
+                self.send_header(header, value)
+        
+        no_body = method == 'HEAD' or response.status in (204, 304) or 100 <= response.status < 200
+        length = response.getheader('Content-Length')
+        if no_body:
+            if length is not None:
+                self.send_header('Content-Length', length)
+            self.end_headers()
+            response.read()
+            return
+        if length is not None:
+            self.send_header('Content-Length', length)
+            self.end_headers()
+            while True:
+                data = response.read(PROXY_CHUNK_SIZE)
+                if not data:
+                    break
+                self.wfile.write(data)
+            return
+        
+        # Длина неизвестна (SSE, потоковые ответы) — отдаем чанками сразу по мере прихода
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        while True:
+            data = response.read1(PROXY_CHUNK_SIZE)
+            if not data:
+                break
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
     
     def log_message(self, format, *args):
         """Кастомное логирование"""
@@ -176,7 +306,8 @@ def check_backend():
 def start_server():
     """Запускаем локальный сервер"""
     try:
-        with socketserver.TCPServer(("", PORT), CustomHTTPRequestHandler) as httpd:
+        # Каждый запрос в своем потоке: медленная загрузка не останавливает остальной сайт
+        with http.server.ThreadingHTTPServer(("", PORT), CustomHTTPRequestHandler) as httpd:
             server_url = f"http://localhost:{PORT}"
             admin_url = f"http://localhost:{PORT}/admin"
             